@@ -0,0 +1,182 @@
+"""Times listing, rendering, chmod and reconnect paths against a local stand-in server.
+
+    python -m benchmarks.run --files 10 1000 100000 --latency 0 20 100 -o results.json
+    python -m benchmarks.run --files 1000 --baseline results.json
+
+Everything runs headlessly: the render step times the view pipeline of main.py (sort
+and row formatting) without creating a window. With --baseline the run exits with status 1
+when an operation got slower than the baseline by more than --tolerance.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import tempfile
+
+import paramiko
+
+import main as gui  # The GUI module, its window is only built when run as a script
+import permissions_manager
+from permissions_manager import core
+from benchmarks.server import LatencyProxy, StandInHost
+
+
+TREE_MARKER = '.benchmark-tree'
+VISIBLE_ROWS = 40  # Rows a maximized file view shows
+REGRESSION_FLOOR_SECONDS = 0.005  # Smaller slowdowns are timer noise, not regressions
+
+def generate_tree(base, count):
+    """Creates a directory of count empty files under base, reused when it already exists."""
+    directory = os.path.join(base, f'files-{count}')
+    marker = os.path.join(directory, TREE_MARKER)
+    if os.path.exists(marker):
+        return directory
+    os.makedirs(directory, exist_ok=True)
+    for i in range(count):
+        os.close(os.open(os.path.join(directory, f'file-{i:07d}'), os.O_CREAT | os.O_WRONLY, 0o644))
+    os.close(os.open(marker, os.O_CREAT | os.O_WRONLY, 0o644))
+    return directory
+
+def connect(port):
+    return core.open_ssh_client('127.0.0.1', port, 'benchmark', 'benchmark', None, allow_agent=False)
+
+def render_headless(entries):
+    """What a listing costs between arriving and being on screen: sort into the view, format the
+    visible window, and format every row once as sorting and scrolling eventually do."""
+    view = [gui.PARENT_ENTRY] + sorted(entries, key=gui.SORT_KEYS['Name'])
+    for entry in view[:VISIBLE_ROWS + gui.VIEW_BUFFER_ROWS]:
+        gui.entry_values(entry)
+    for entry in view:
+        gui.entry_values(entry)
+
+def time_operation(operation, repeat):
+    runs = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        operation()
+        runs.append(time.perf_counter() - started)
+    return runs
+
+def benchmark(directory, port, repeat):
+    """Returns {operation: [seconds per run]} for one tree behind one port."""
+    client, sftp_client = connect(port)
+    session = {'client': client, 'sftp': sftp_client}
+    names = sorted(name for name in os.listdir(directory) if name != TREE_MARKER)
+    listed = {}
+
+    def list_sftp():
+        entries, errors, mtime = core.list_directory(client, sftp_client, directory)
+        listed.update(entries=entries, mtime=mtime)
+
+    def reconnect():
+        session['client'].close()
+        session['client'], session['sftp'] = connect(port)
+
+    operations = [
+        ('list_sftp', list_sftp),
+        ('list_exec', lambda: core.list_directory(client, None, directory)),
+        # A cached listing whose directory mtime is unchanged, what navigating back costs
+        ('revalidate_sftp', lambda: core.list_directory(client, sftp_client, directory, listed)),
+        ('render', lambda: render_headless(listed['entries'])),
+        ('chmod_single', lambda: core.chmod_entries(client, directory, '644', names[:1])),
+        ('chmod_bulk', lambda: core.chmod_entries(client, directory, '644', names)),
+        ('chmod_recursive', lambda: core.chmod_recursive(client, directory, '644', '755')),
+        ('reconnect', reconnect),
+    ]
+    results = {}
+    try:
+        for name, operation in operations:
+            results[name] = time_operation(operation, repeat)
+    finally:
+        session['client'].close()
+        if session['client'] is not client:
+            client.close()
+    return results
+
+def summarize(runs):
+    return {
+        'runs': [round(run, 6) for run in runs],
+        'min': round(min(runs), 6),
+        'median': round(statistics.median(runs), 6),
+        'max': round(max(runs), 6),
+    }
+
+def compare(results, baseline, tolerance):
+    """Yields (key, baseline_median, median) for every operation slower than tolerance allows."""
+    previous = {(row['files'], row['latency_ms'], row['operation']): row['median'] for row in baseline['results']}
+    for row in results:
+        key = (row['files'], row['latency_ms'], row['operation'])
+        if key in previous and row['median'] > max(previous[key] * tolerance, previous[key] + REGRESSION_FLOOR_SECONDS):
+            yield key, previous[key], row['median']
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.run', description=__doc__.splitlines()[0])
+    parser.add_argument('--files', type=int, nargs='+', default=[10, 1000, 10000],
+                        help="directory sizes to generate, 10 to 1000000")
+    parser.add_argument('--latency', type=float, nargs='+', default=[0],
+                        help="injected round-trip times in milliseconds")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--tree-dir', default=os.path.join(tempfile.gettempdir(), 'permissions-manager-benchmark'),
+                        help="where generated trees are kept and reused between runs")
+    parser.add_argument('-o', '--output', help="write the JSON results to a file instead of stdout")
+    parser.add_argument('--baseline', help="JSON results of an earlier run to compare against")
+    parser.add_argument('--tolerance', type=float, default=1.25,
+                        help="slowdown factor over the baseline median reported as a regression")
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    host = StandInHost()
+    server_port = host.start()
+    results = []
+    try:
+        for count in args.files:
+            directory = generate_tree(args.tree_dir, count)
+            for latency in args.latency:
+                proxy = None
+                port = server_port
+                if latency:
+                    proxy = LatencyProxy(server_port, latency / 1000)
+                    port = proxy.start()
+                try:
+                    timings = benchmark(directory, port, args.repeat)
+                finally:
+                    if proxy:
+                        proxy.stop()
+                for operation, runs in timings.items():
+                    results.append(dict(summarize(runs), files=count, latency_ms=latency, operation=operation))
+                    print(f"{count:>8} files {latency:>6g} ms  {operation:<16} {statistics.median(runs):.4f}s",
+                          file=sys.stderr)
+    finally:
+        host.stop()
+
+    report = {
+        'version': permissions_manager.__version__,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'paramiko': paramiko.__version__,
+        'platform': platform.platform(),
+        'repeat': args.repeat,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = list(compare(results, json.load(f), args.tolerance))
+        for (count, latency, operation), before, after in regressions:
+            print(f"Regression: {operation} with {count} files at {latency:g} ms took {after:.4f}s, "
+                  f"baseline {before:.4f}s", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
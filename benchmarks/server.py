@@ -0,0 +1,206 @@
+"""Local stand-in for a real server: a paramiko SSH server with an SFTP subsystem and exec
+channels that run commands through the local shell, plus a TCP proxy injecting link latency.
+
+Both only serve 127.0.0.1 and accept any password, never expose them beyond a benchmark run.
+"""
+import os
+import heapq
+import logging
+import socket
+import threading
+import subprocess
+import time
+
+import paramiko
+from paramiko import SFTPAttributes, SFTPServer, SFTPServerInterface, SFTP_OK
+
+
+CHUNK_SIZE = 32768
+LOG_CHANNEL = 'benchmarks.server'
+
+# Server transports log every client that goes away, which is how each benchmark ends
+logging.getLogger(LOG_CHANNEL).setLevel(logging.CRITICAL)
+
+class StandInSFTP(SFTPServerInterface):
+    """Serves the local filesystem with real paths, so SFTP and exec listings see the same tree."""
+
+    def list_folder(self, path):
+        try:
+            attributes = []
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    attr = SFTPAttributes.from_stat(entry.stat(follow_symlinks=False), entry.name)
+                    attributes.append(attr)
+            return attributes
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    def stat(self, path):
+        try:
+            return SFTPAttributes.from_stat(os.stat(path))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    def lstat(self, path):
+        try:
+            return SFTPAttributes.from_stat(os.lstat(path))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    def chattr(self, path, attr):
+        try:
+            if attr.st_mode is not None:
+                os.chmod(path, attr.st_mode)
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        return SFTP_OK
+
+    def canonicalize(self, path):
+        return os.path.normpath(path if path.startswith('/') else '/' + path)
+
+class StandInServer(paramiko.ServerInterface):
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED if kind == 'session' else paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_exec_request(self, channel, command):
+        threading.Thread(target=run_exec, args=(channel, command), daemon=True).start()
+        return True
+
+def run_exec(channel, command):
+    """Runs command with sh -c and pumps stdin, stdout and stderr like sshd does."""
+    try:
+        process = subprocess.Popen(command, shell=True, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+    except OSError as e:
+        # Same outcome as on a real server, e.g. E2BIG for a command line over the kernel limit
+        channel.sendall_stderr(f"sh: {e.strerror}\n".encode())
+        channel.send_exit_status(126)
+        channel.close()
+        return
+
+    def pump_stderr():
+        for data in iter(lambda: process.stderr.read1(CHUNK_SIZE), b''):
+            channel.sendall_stderr(data)
+
+    stderr_thread = threading.Thread(target=pump_stderr, daemon=True)
+    stderr_thread.start()
+    process.stdin.close()
+    try:
+        for data in iter(lambda: process.stdout.read1(CHUNK_SIZE), b''):
+            channel.sendall(data)
+    except (OSError, EOFError, paramiko.SSHException):
+        process.kill()  # The client closed the channel
+    stderr_thread.join()
+    channel.send_exit_status(process.wait())
+    channel.close()
+
+class StandInHost:
+    """Runs the stand-in SSH server on an ephemeral port, start() returns the port."""
+
+    def __init__(self):
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self.listener = None
+        self.transports = []
+
+    def start(self):
+        self.listener = socket.socket()
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(64)
+        threading.Thread(target=self.accept_loop, daemon=True).start()
+        return self.listener.getsockname()[1]
+
+    def accept_loop(self):
+        while True:
+            try:
+                client, address = self.listener.accept()
+            except OSError:
+                return
+            transport = paramiko.Transport(client)
+            transport.set_log_channel(LOG_CHANNEL)
+            transport.add_server_key(self.host_key)
+            transport.set_subsystem_handler('sftp', SFTPServer, StandInSFTP)
+            transport.start_server(server=StandInServer())
+            self.transports.append(transport)
+
+    def stop(self):
+        self.listener.close()
+        for transport in self.transports:
+            transport.close()
+
+class LatencyProxy:
+    """Forwards TCP connections to target_port, delaying every chunk by half the round-trip time
+    in each direction. Chunks are delayed, not serialized, so pipelined requests stay pipelined."""
+
+    def __init__(self, target_port, latency):
+        self.target_port = target_port
+        self.one_way = latency / 2
+        self.listener = None
+
+    def start(self):
+        self.listener = socket.socket()
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(64)
+        threading.Thread(target=self.accept_loop, daemon=True).start()
+        return self.listener.getsockname()[1]
+
+    def accept_loop(self):
+        while True:
+            try:
+                client, address = self.listener.accept()
+            except OSError:
+                return
+            upstream = socket.create_connection(('127.0.0.1', self.target_port))
+            for source, destination in ((client, upstream), (upstream, client)):
+                source.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                self.forward(source, destination)
+
+    def forward(self, source, destination):
+        pending = []  # (deliver_at, sequence, data) heap
+        condition = threading.Condition()
+
+        def read():
+            sequence = 0
+            while True:
+                try:
+                    data = source.recv(CHUNK_SIZE)
+                except OSError:
+                    data = b''
+                with condition:
+                    heapq.heappush(pending, (time.monotonic() + self.one_way, sequence, data))
+                    condition.notify()
+                sequence += 1
+                if not data:
+                    return
+
+        def write():
+            while True:
+                with condition:
+                    while not pending:
+                        condition.wait()
+                    deliver_at, sequence, data = pending[0]
+                    delay = deliver_at - time.monotonic()
+                    if delay > 0:
+                        condition.wait(delay)
+                        continue
+                    heapq.heappop(pending)
+                try:
+                    if not data:
+                        destination.shutdown(socket.SHUT_WR)
+                        return
+                    destination.sendall(data)
+                except OSError:
+                    return
+
+        threading.Thread(target=read, daemon=True).start()
+        threading.Thread(target=write, daemon=True).start()
+
+    def stop(self):
+        self.listener.close()
@@ -1,41 +1,196 @@
 import os
-import sqlite3
+import posixpath
+import fnmatch
+import stat
+import queue
+import threading
+import time
 import paramiko
 import webbrowser
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
 import tkinter.simpledialog as simpledialog
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
+from permissions_manager import changes, db, helper, instrumentation, inventory, keys, local, snapshot
+from permissions_manager.cache import ListingCache
+from permissions_manager.core import (
+    ERROR_SAMPLE_SIZE, MODE_PATTERN, SEARCH_LIMIT, TREE_MAX_DIRECTORIES, TaskCancelled, audit_host,
+    build_search_command, chmod_entries, chmod_recursive, fetch_extended_attributes, get_octal_permissions,
+    list_directory, list_tree, open_ssh_chain, resolve_target, search_tree, setfacl_entries, stat_entries,
+    watch_directory,
+)
 
-# SQLite Database setup
-conn = sqlite3.connect('connections.db')
-cursor = conn.cursor()
-cursor.execute('''
-    CREATE TABLE IF NOT EXISTS connections (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        host TEXT NOT NULL,
-        port INTEGER NOT NULL,
-        username TEXT NOT NULL,
-        password TEXT,
-        key_file TEXT
-    )
-''')
-cursor.execute('''
-    CREATE TABLE IF NOT EXISTS settings (
-        id INTEGER PRIMARY KEY,
-        theme TEXT NOT NULL
-    )
-''')
-conn.commit()
 
 # SSH Connection Global Variable
 ssh = None
+sftp = None  # Long-lived SFTP session on the same transport, None if the server has no SFTP subsystem
+current_host = None  # 'user@host:port' of the active connection, used to key the listing cache
+current_conn_id = None  # connections table id of the active connection, None for unsaved ones
 current_path = '/'  # Initial directory path
 
-# Load saved theme
-cursor.execute("SELECT theme FROM settings WHERE id = 1")
-row = cursor.fetchone()
-current_theme = row[0] if row else 'light'
+# Open sessions per connections table id, least recently used first
+connection_pool = OrderedDict()
+MAX_POOLED_CONNECTIONS = 5
+use_ssh_agent = True  # Offer ssh-agent keys when authenticating
+use_ssh_config = True  # Resolve host aliases, users, identity files and ProxyJump through ~/.ssh/config
+use_remote_helper = False  # Start the persistent python3 helper on connected hosts that have one
+
+# Directory listings per (host, path), revalidated against the directory mtime
+LISTING_CACHE_BYTES = 64 * 1024 * 1024
+LISTING_CACHE_TTL = 600
+listing_cache = ListingCache(LISTING_CACHE_BYTES, LISTING_CACHE_TTL)
+CACHE_REVALIDATE_SECONDS = 5
+AUTO_REFRESH_MS = 30000  # Periodic check of the current directory, skipped while its mtime is unchanged
+
+# Virtualized file view: only the visible window of view_entries is materialized as Treeview rows
+PARENT_ENTRY = {'name': '../', 'size': '', 'mode': None, 'owner': '', 'group': '', 'type': 'directory'}
+VIEW_BUFFER_ROWS = 10
+ROW_CHUNK_SIZE = 100
+HEADING_HEIGHT = 25
+current_entries = []  # Entries of the current directory as listed
+current_index = {}  # Name -> position in current_entries
+shown_listing = None  # (host, path) of the listing in current_entries
+view_entries = []  # current_entries filtered and sorted, this is what the scrollbar spans
+view_offset = 0  # Index in view_entries of the first materialized row
+row_items = []  # Pool of Treeview item ids reused while scrolling
+row_entries = {}  # Treeview item id -> entry it currently shows
+selected_names = set()  # Selection kept by name so it survives scrolling
+sort_column = 'Name'
+sort_reverse = False
+render_pending = False
+
+# Tree view: directories expand lazily, subtrees are listed in parallel over the active connection
+TREE_PLACEHOLDER = "Loading..."
+TREE_MAX_CHILDREN = 5000  # Rows inserted per directory, larger ones are better browsed in the flat view
+TREE_EXPAND_DEPTH = 3  # Directory levels listed by Expand Subtree
+tree_listings = {}  # Directory path -> entries loaded into the tree, current_path included
+tree_items = {}  # Treeview item id -> (directory, entry) of every row in the tree
+tree_nodes = {}  # Path -> Treeview item id
+tree_open = set()  # Expanded directory paths, kept when the tree is rebuilt
+tree_generation = 0  # Bumped whenever the tree is reset so late listings are dropped
+
+# Background workers for remote operations, results are handed back to Tk through ui_queue
+executor = ThreadPoolExecutor(max_workers=4)
+ui_queue = queue.Queue()
+UI_POLL_MS = 50
+running_tasks = 0
+listing_cancel_event = None  # Set to cancel the directory listing still in flight
+cancellable_events = set()  # Cancel events of running operations the Cancel button stops
+
+# Background prefetch of subdirectory listings into listing_cache
+PREFETCH_MAX_DIRECTORIES = 50  # Subdirectories prefetched per listed directory
+prefetch_enabled = True
+prefetch_depth = 1
+prefetch_workers = 2
+prefetch_executor = ThreadPoolExecutor(max_workers=prefetch_workers)
+prefetch_generation = 0  # Bumped on navigation so queued prefetches of the old location are dropped
+prefetch_sessions = threading.local()  # (client, SFTP session) of each prefetch worker
+
+# Watch mode: a long-running remote watcher streams changes of the current directory
+watch_cancel_event = None  # Set to stop the running watcher, None while not watching
+
+# Mode and ownership edits staged across directories, applied as one journaled batch
+pending_changes = changes.PendingChanges()
+PENDING_DISPLAY_LIMIT = 5000  # Rows shown in the pending changes window, all of them are applied
+
+# Manage Connections shows one page of the saved connections, searched as you type
+CONNECTION_SEARCH_DELAY_MS = 200
+
+# Multi-host audit
+AUDIT_WORKERS = 16
+AUDIT_DISPLAY_LIMIT = 10000  # Rows shown in the audit window, the database keeps all of them
+
+# Server-side search, type choices mapped to find -type letters
+SEARCH_TYPE_OPTIONS = {
+    "Any": '',
+    "File": 'f',
+    "Directory": 'd',
+    "Symlink": 'l',
+    "Socket": 's',
+    "Named pipe": 'p',
+    "Block device": 'b',
+    "Character device": 'c',
+}
+
+def post_to_ui(callback, *args):
+    """Schedules a callback to run on the Tk main loop (safe to call from any thread)."""
+    ui_queue.put((callback, args))
+
+def process_ui_queue():
+    try:
+        while True:
+            callback, args = ui_queue.get_nowait()
+            with instrumentation.span(getattr(callback, '__name__', 'callback'), 'ui'):
+                callback(*args)
+    except queue.Empty:
+        pass
+    root.after(UI_POLL_MS, process_ui_queue)
+
+def run_in_background(func, *args, on_success=None, on_error=None, cancel_event=None, cancellable=False,
+                      status="Working..."):
+    """Runs func(*args) on the worker pool and delivers the result to on_success on the main loop.
+    Results of cancelled tasks are dropped, cancellable tasks can be stopped with the Cancel button.
+    A status of None runs the task quietly, without the progress indicator."""
+    if cancel_event is None:
+        cancel_event = threading.Event()
+    quiet = status is None
+    if not quiet:
+        start_progress(status)
+    if cancellable:
+        cancellable_events.add(cancel_event)
+        cancel_button.state(['!disabled'])
+
+    action = status or getattr(func, '__name__', 'task')
+
+    def task():
+        try:
+            with instrumentation.action(action):
+                result = func(*args)
+        except Exception as e:
+            post_to_ui(finish_task, cancel_event, on_error or show_task_error, e, quiet)
+        else:
+            post_to_ui(finish_task, cancel_event, on_success, result, quiet)
+
+    executor.submit(task)
+    return cancel_event
+
+def finish_task(cancel_event, callback, value, quiet=False):
+    cancellable_events.discard(cancel_event)
+    if not cancellable_events:
+        cancel_button.state(['disabled'])
+    if not quiet:
+        stop_progress()
+    if cancel_event.is_set() or callback is None:
+        return
+    callback(value)
+
+def show_task_error(error):
+    messagebox.showerror("Error", str(error))
+
+def start_progress(status):
+    global running_tasks
+    running_tasks += 1
+    status_label.config(text=status)
+    progress_bar.start(10)
+
+def stop_progress():
+    global running_tasks
+    running_tasks -= 1
+    if running_tasks <= 0:
+        running_tasks = 0
+        progress_bar.stop()
+        status_label.config(text="")
+
+def update_status(text):
+    status_label.config(text=text)
+
+def cancel_operation():
+    for cancel_event in cancellable_events:
+        cancel_event.set()
+    cancel_button.state(['disabled'])
+    status_label.config(text="Cancelled.")
 
 def set_theme(theme):
     global current_theme
@@ -131,96 +286,129 @@ def custom_simpledialog(prompt, title="Input", parent=None, is_password=False):
     dialog.wait_window(dialog)
     return user_input.get()
 
-def connect_ssh(host, port, username, password, key_file=None, windows_to_close=[]):
-    global ssh
-    if ssh:
-        ssh.close()
-    
-    ssh = paramiko.SSHClient()
-    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    
+def load_private_key(key_file):
+    """Loads a private key, prompting for the passphrase if the key is encrypted. Decrypted keys are
+    cached, so reconnects neither parse the file again nor prompt."""
     try:
-        if key_file:
-            key_file = key_file.strip()
-            if os.path.isfile(key_file):
-                try:
-                    # Determine the key type from the file content
-                    key_type = None
-                    with open(key_file, 'r') as f:
-                        key_data = f.read()
-                        if 'OPENSSH PRIVATE KEY' in key_data:
-                            key_type = 'OPENSSH'
-                        elif 'RSA' in key_data:
-                            key_type = 'RSA'
-                        elif 'DSA' in key_data:
-                            key_type = 'DSA'
-                        elif 'ECDSA' in key_data:
-                            key_type = 'ECDSA'
-                        elif 'ED25519' in key_data:
-                            key_type = 'ED25519'
-                        else:
-                            raise ValueError("Unsupported key format.")
-                    
-                    # Load the private key based on its type
-                    if key_type == 'OPENSSH':
-                        private_key = paramiko.Ed25519Key.from_private_key_file(key_file)
-                    elif key_type == 'RSA':
-                        private_key = paramiko.RSAKey.from_private_key_file(key_file)
-                    elif key_type == 'DSA':
-                        private_key = paramiko.DSSKey.from_private_key_file(key_file)
-                    elif key_type == 'ECDSA':
-                        private_key = paramiko.ECDSAKey.from_private_key_file(key_file)
-                    elif key_type == 'ED25519':
-                        private_key = paramiko.Ed25519Key.from_private_key_file(key_file)
-                    else:
-                        raise ValueError("Unsupported key type or key format.")
-                    
-                    ssh.connect(host, port=port, username=username, pkey=private_key)
-                
-                except paramiko.PasswordRequiredException:
-                    # Prompt for passphrase if key is encrypted
-                    passphrase = custom_simpledialog("Enter passphrase for the private key:", title="Passphrase", is_password=True)
-                    if key_type == 'OPENSSH':
-                        private_key = paramiko.Ed25519Key.from_private_key_file(key_file, password=passphrase)
-                    elif key_type == 'RSA':
-                        private_key = paramiko.RSAKey.from_private_key_file(key_file, password=passphrase)
-                    elif key_type == 'DSA':
-                        private_key = paramiko.DSSKey.from_private_key_file(key_file, password=passphrase)
-                    elif key_type == 'ECDSA':
-                        private_key = paramiko.ECDSAKey.from_private_key_file(key_file, password=passphrase)
-                    elif key_type == 'ED25519':
-                        private_key = paramiko.Ed25519Key.from_private_key_file(key_file, password=passphrase)
-                    else:
-                        raise ValueError("Unsupported key type or key format.")
-                    
-                    ssh.connect(host, port=port, username=username, pkey=private_key)
-            
-            else:
-                raise FileNotFoundError(f"Private key file not found: {key_file}")
-        
-        else:
-            # Connect using password if no key file is provided
-            ssh.connect(host, port=port, username=username, password=password)
-
-        messagebox.showinfo("Success", "Connected to the server!")
-
-        # Close all passed windows
-        for window in windows_to_close:
-            window.destroy()
-
-        fetch_directory(current_path)  # Fetch and display files from the current directory
-    
-    except paramiko.AuthenticationException:
+        return keys.load_key(key_file)
+    except paramiko.PasswordRequiredException:
+        # Prompt for passphrase if key is encrypted
+        passphrase = custom_simpledialog("Enter passphrase for the private key:", title="Passphrase", is_password=True)
+        return keys.load_key(key_file, passphrase)
+
+def show_connection_error(e):
+    if isinstance(e, paramiko.AuthenticationException):
         messagebox.showerror("Authentication Error", "Authentication failed, please verify your credentials.")
-    except paramiko.SSHException as e:
+    elif isinstance(e, paramiko.SSHException):
         messagebox.showerror("SSH Error", f"SSH error occurred: {str(e)}")
-    except FileNotFoundError as e:
+    elif isinstance(e, FileNotFoundError):
         messagebox.showerror("File Error", str(e))
-    except ValueError as e:
+    elif isinstance(e, ValueError):
         messagebox.showerror("Key Error", str(e))
-    except Exception as e:
+    else:
         messagebox.showerror("Connection Error", str(e))
 
+def is_session_alive(session):
+    transport = session['ssh'].get_transport()
+    return transport is not None and transport.is_active()
+
+def close_session(session):
+    if session['sftp']:
+        session['sftp'].close()
+    session['ssh'].close()
+
+def is_session_shared(session):
+    # Saved connections resolving to the same user, host and port share one session
+    return session['ssh'] is ssh or any(other is session for other in connection_pool.values())
+
+def find_live_session(host_key):
+    for session in connection_pool.values():
+        if session['host_key'] == host_key and is_session_alive(session):
+            return session
+    return None
+
+def drop_pooled_connection(conn_id):
+    """Closes the pooled session of a connection, e.g. after its details were edited or deleted."""
+    session = connection_pool.pop(int(conn_id), None)
+    if session and not is_session_shared(session):
+        close_session(session)
+
+def add_to_pool(conn_id, session):
+    connection_pool[conn_id] = session
+    connection_pool.move_to_end(conn_id)
+    # Evict the least recently used sessions, the active one is always the most recent
+    while len(connection_pool) > MAX_POOLED_CONNECTIONS:
+        evicted_id, evicted = connection_pool.popitem(last=False)
+        if not is_session_shared(evicted):
+            close_session(evicted)
+
+def activate_session(session, conn_id, windows_to_close):
+    global ssh, sftp, current_host, current_conn_id
+    # Unpooled sessions are closed when replaced, pooled ones stay open for switching back
+    previous = {'ssh': ssh, 'sftp': sftp}
+    ssh, sftp, current_host = session['ssh'], session['sftp'], session['host_key']
+    current_conn_id = conn_id
+    if previous['ssh'] and previous['ssh'] is not ssh and not any(
+            other['ssh'] is previous['ssh'] for other in connection_pool.values()):
+        close_session(previous)
+    if use_remote_helper:
+        # Until it answers, and on hosts without python3, listings keep going through exec and SFTP
+        run_in_background(helper.start_helper, ssh, on_error=lambda error: None, status=None)
+
+    messagebox.showinfo("Success", "Connected to the server!")
+
+    # Close all passed windows
+    for window in windows_to_close:
+        window.destroy()
+
+    fetch_directory(current_path)  # Fetch and display files from the current directory
+
+def connect_ssh(host, port, username, password, key_file=None, windows_to_close=[], conn_id=None):
+    if conn_id is not None:
+        conn_id = int(conn_id)
+        session = connection_pool.get(conn_id)
+        if session and is_session_alive(session):
+            # Reuse the open transport, no TCP, key exchange or authentication needed
+            connection_pool.move_to_end(conn_id)
+            activate_session(session, conn_id, windows_to_close)
+            return
+        if session:
+            drop_pooled_connection(conn_id)
+
+    try:
+        hops = resolve_target(host, port, username, key_file, use_ssh_config)
+        # Like ControlMaster: any live session to the same user, host and port is reused
+        session = find_live_session(hops[-1]['key'])
+        if session:
+            if conn_id is not None:
+                add_to_pool(conn_id, session)
+            activate_session(session, conn_id, windows_to_close)
+            return
+        # Key files are loaded on the main loop since an encrypted key needs the passphrase dialog
+        private_keys = [load_private_key(hop['key_file']) if hop['key_file'] else None for hop in hops]
+    except Exception as e:
+        show_connection_error(e)
+        return
+
+    def on_connected(result):
+        client, sftp_client = result
+        session = {'ssh': client, 'sftp': sftp_client, 'host_key': hops[-1]['key']}
+        if conn_id is not None:
+            add_to_pool(conn_id, session)
+        activate_session(session, conn_id, windows_to_close)
+
+    via = ''.join(f" via {hop['host']}" for hop in hops[:-1])
+    run_in_background(
+        open_ssh_chain, hops, password, private_keys, True, use_ssh_agent,
+        on_success=on_connected, on_error=show_connection_error, status=f"Connecting to {hops[-1]['host']}{via}..."
+    )
+
+def open_local():
+    # The machine the application runs on, browsed and changed without SSH
+    if isinstance(ssh, local.LocalClient):
+        return
+    activate_session({'ssh': local.LocalClient(), 'sftp': None, 'host_key': local.LOCAL_HOST_KEY}, None, [])
+
 def add_connection(edit=False, conn_id=None):
     def save_connection():
         host = host_entry.get()
@@ -240,6 +428,7 @@ def add_connection(edit=False, conn_id=None):
                 SET host = ?, port = ?, username = ?, password = ?, key_file = ?
                 WHERE id = ?
             ''', (host, port, username, password, key_file, conn_id))
+            drop_pooled_connection(conn_id)  # Reconnect with the new details next time
         else:
             # Insert new connection
             cursor.execute('''
@@ -316,6 +505,7 @@ def manage_connections():
         if confirm:
             cursor.execute("DELETE FROM connections WHERE id = ?", (conn_id,))
             conn.commit()
+            drop_pooled_connection(conn_id)
             messagebox.showinfo("Success", "Connection deleted.")
             refresh_connections()
 
@@ -327,7 +517,7 @@ def manage_connections():
             row = cursor.fetchone()
             if row:
                 # Pass the current window to close it after a successful connection
-                connect_ssh(*row, windows_to_close=[manage_window])
+                connect_ssh(*row, windows_to_close=[manage_window], conn_id=conn_id)
             else:
                 messagebox.showerror("Connection Error", "Selected connection details are missing.")
         else:
@@ -337,21 +527,87 @@ def manage_connections():
     manage_window.title("Manage Connections")
     center_window(manage_window, 800, 400)
     manage_window.minsize(width=800, height=400)  # Set minimum size for the window
+    page = {'offset': 0, 'search': None}
+
+    list_frame = ttk.Frame(manage_window)
+    list_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+    # Search box, matches host or username anywhere (by prefix for one or two characters)
+    search_frame = ttk.Frame(list_frame)
+    search_frame.pack(side=tk.TOP, fill=tk.X, padx=5, pady=5)
+    ttk.Label(search_frame, text="Search:").pack(side=tk.LEFT)
+    search_var = tk.StringVar()
+    search_entry = ttk.Entry(search_frame, textvariable=search_var)
+    search_entry.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
+
+    # Only the current page is loaded into the widget
+    paging_frame = ttk.Frame(list_frame)
+    paging_frame.pack(side=tk.BOTTOM, fill=tk.X, padx=5, pady=5)
+    previous_button = ttk.Button(paging_frame, text="Previous", command=lambda: change_page(-1))
+    previous_button.pack(side=tk.LEFT)
+    next_button = ttk.Button(paging_frame, text="Next", command=lambda: change_page(1))
+    next_button.pack(side=tk.RIGHT)
+    page_label = ttk.Label(paging_frame, text="")
+    page_label.pack(side=tk.LEFT, expand=True)
 
     # Connection List
-    tree = ttk.Treeview(manage_window, columns=('Host', 'Port', 'Username'), show='headings')
+    tree = ttk.Treeview(list_frame, columns=('Host', 'Port', 'Username'), show='headings')
     tree.heading('Host', text="Host")
     tree.heading('Port', text="Port")
     tree.heading('Username', text="Username")
     tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
 
     def refresh_connections():
+        text = search_var.get()
+        total = db.count_connections(conn, text)
+        page['offset'] = min(page['offset'], max(0, (total - 1) // db.CONNECTIONS_PAGE_SIZE * db.CONNECTIONS_PAGE_SIZE))
+        rows = db.search_connections(conn, text, db.CONNECTIONS_PAGE_SIZE, page['offset'])
         tree.delete(*tree.get_children())
-        cursor.execute("SELECT id, host, port, username FROM connections")
-        for row in cursor.fetchall():
+        for row in rows:
             tree.insert('', 'end', values=row[1:], iid=row[0])
-
+        if rows:
+            page_label.config(text=f"{page['offset'] + 1}-{page['offset'] + len(rows)} of {total}")
+        else:
+            page_label.config(text="No connections found" if text.strip() else "No saved connections")
+        previous_button.state(['!disabled' if page['offset'] > 0 else 'disabled'])
+        next_button.state(['!disabled' if page['offset'] + len(rows) < total else 'disabled'])
+
+    def change_page(step):
+        page['offset'] = max(0, page['offset'] + step * db.CONNECTIONS_PAGE_SIZE)
+        refresh_connections()
+
+    def on_search_changed(*args):
+        # Queried once typing pauses, not on every keystroke
+        if page['search'] is not None:
+            manage_window.after_cancel(page['search'])
+        page['search'] = manage_window.after(CONNECTION_SEARCH_DELAY_MS, run_search)
+
+    def run_search():
+        page['search'] = None
+        page['offset'] = 0
+        refresh_connections()
+
+    search_var.trace_add('write', on_search_changed)
     refresh_connections()
+    search_entry.focus_set()
+
+    def import_inventory(inventory_format):
+        if inventory_format == 'ssh_config':
+            path = inventory.SSH_CONFIG_PATH
+        else:
+            filetypes = [("CSV files", "*.csv")] if inventory_format == 'csv' else [("Inventory files", "*.ini *.cfg hosts")]
+            path = filedialog.askopenfilename(parent=manage_window, title="Import Connections",
+                                              filetypes=filetypes + [("All files", "*")])
+            if not path:
+                return
+        try:
+            added, skipped = db.import_connections(conn, inventory.read_inventory(path, inventory_format))
+        except (OSError, ValueError) as e:
+            messagebox.showerror("Import Error", str(e), parent=manage_window)
+            return
+        messagebox.showinfo("Import", f"Imported {added} connections, skipped {skipped} already saved.",
+                            parent=manage_window)
+        refresh_connections()
 
     # Add, Edit, Delete, and Connect buttons
     def on_add():
@@ -375,6 +631,14 @@ def manage_connections():
     add_button = ttk.Button(manage_window, text="Add Connection", command=on_add)
     add_button.pack(padx=10, pady=5, side=tk.TOP, fill=tk.X)
 
+    import_button = ttk.Menubutton(manage_window, text="Import")
+    import_menu = tk.Menu(import_button, tearoff=0)
+    import_menu.add_command(label="~/.ssh/config", command=lambda: import_inventory('ssh_config'))
+    import_menu.add_command(label="CSV File...", command=lambda: import_inventory('csv'))
+    import_menu.add_command(label="Ansible Inventory...", command=lambda: import_inventory('ansible'))
+    import_button['menu'] = import_menu
+    import_button.pack(padx=10, pady=5, side=tk.TOP, fill=tk.X)
+
     edit_button = ttk.Button(manage_window, text="Edit Connection", command=on_edit)
     edit_button.pack(padx=10, pady=5, side=tk.TOP, fill=tk.X)
 
@@ -385,94 +649,1389 @@ def manage_connections():
     connect_button.pack(padx=10, pady=10, side=tk.BOTTOM, fill=tk.X)
 
 
-def fetch_directory(path):
-    global ssh, current_path
-    current_path = path  # Update current path
-    if ssh:
+def audit_hosts():
+    """Audits all (or the selected) saved connections concurrently and stores the findings."""
+    cancel_event = threading.Event()
+    state = {'executor': None, 'run_id': None, 'pending': 0, 'shown': 0}
+
+    def start_audit():
+        roots = roots_entry.get().split()
+        if not roots:
+            messagebox.showerror("Input Error", "Please enter at least one root directory.", parent=audit_window)
+            return
+        selected = [int(iid) for iid in hosts_tree.selection()] or [int(iid) for iid in hosts_tree.get_children()]
+        if not selected:
+            messagebox.showwarning("Selection Error", "There are no saved connections to audit.", parent=audit_window)
+            return
+        rows = db.get_connection_rows(conn, selected)
+
+        cancel_event.clear()
+        state['run_id'] = db.start_audit_run(conn, roots, len(rows))
+        state['pending'] = len(rows)
+        state['shown'] = 0
+        state['executor'] = ThreadPoolExecutor(max_workers=int(workers_spinbox.get() or AUDIT_WORKERS))
+        results_tree.delete(*results_tree.get_children())
+        start_button.state(['disabled'])
+        stop_button.state(['!disabled'])
+        update_audit_status()
+
+        for row in rows:
+            # Reuse live pooled sessions, the rest get their own short-lived connection
+            session = connection_pool.get(row[0])
+            pooled_client = session['ssh'] if session and is_session_alive(session) else None
+            state['executor'].submit(run_audit_host, row, roots, pooled_client)
+
+    def run_audit_host(row, roots, pooled_client):
+        if cancel_event.is_set():
+            post_to_ui(on_host_done, row, [], "Cancelled")
+            return
+        try:
+            findings = audit_host(row, roots, pooled_client, cancel_event, use_ssh_config, use_ssh_agent)
+        except Exception as e:
+            post_to_ui(on_host_done, row, [], str(e) or type(e).__name__)
+        else:
+            post_to_ui(on_host_done, row, findings, None)
+
+    def on_host_done(row, findings, error):
+        conn_id, host = row[0], row[1]
+        if error:
+            findings = [('error', '', '', error)]
+        db.record_audit_findings(conn, state['run_id'], conn_id, host, findings)
+
+        state['pending'] -= 1
+        if state['pending'] == 0:
+            state['executor'].shutdown(wait=False)
+        if not audit_window.winfo_exists():
+            return
+        for finding in findings[:AUDIT_DISPLAY_LIMIT - state['shown']]:
+            results_tree.insert('', 'end', values=(host,) + finding)
+        state['shown'] = min(AUDIT_DISPLAY_LIMIT, state['shown'] + len(findings))
+        if state['pending'] == 0:
+            start_button.state(['!disabled'])
+            stop_button.state(['disabled'])
+        update_audit_status()
+
+    def update_audit_status():
+        status = f"Run {state['run_id']}: {state['pending']} hosts remaining, {state['shown']} findings shown"
+        if state['shown'] >= AUDIT_DISPLAY_LIMIT:
+            status += " (display limit reached, all findings are saved)"
+        audit_status_label.config(text=status)
+
+    def stop_audit():
+        cancel_event.set()
+        stop_button.state(['disabled'])
+
+    def on_close():
+        stop_audit()
+        audit_window.destroy()
+
+    audit_window = tk.Toplevel(root)
+    audit_window.title("Audit Hosts")
+    center_window(audit_window, 1000, 700)
+    audit_window.protocol("WM_DELETE_WINDOW", on_close)
+
+    options_frame = ttk.Frame(audit_window, padding="10")
+    options_frame.pack(side=tk.TOP, fill=tk.X)
+    ttk.Label(options_frame, text="Roots:").pack(side=tk.LEFT, padx=(0, 5))
+    roots_entry = ttk.Entry(options_frame, width=40)
+    roots_entry.insert(0, "/")
+    roots_entry.pack(side=tk.LEFT, padx=(0, 10))
+    ttk.Label(options_frame, text="Workers:").pack(side=tk.LEFT, padx=(0, 5))
+    workers_spinbox = ttk.Spinbox(options_frame, from_=1, to=128, width=5)
+    workers_spinbox.set(AUDIT_WORKERS)
+    workers_spinbox.pack(side=tk.LEFT, padx=(0, 10))
+    start_button = ttk.Button(options_frame, text="Start Audit", command=start_audit)
+    start_button.pack(side=tk.LEFT, padx=5)
+    stop_button = ttk.Button(options_frame, text="Stop", command=stop_audit)
+    stop_button.pack(side=tk.LEFT, padx=5)
+    stop_button.state(['disabled'])
+
+    audit_status_label = ttk.Label(audit_window, text="Select hosts to audit, or none to audit all of them.")
+    audit_status_label.pack(side=tk.TOP, fill=tk.X, padx=10)
+
+    panes = ttk.PanedWindow(audit_window, orient=tk.HORIZONTAL)
+    panes.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+
+    # Saved connections, multi-select a subset or leave empty to audit every host
+    hosts_tree = ttk.Treeview(panes, columns=('Host', 'Username'), show='headings')
+    hosts_tree.heading('Host', text="Host")
+    hosts_tree.heading('Username', text="Username")
+    cursor.execute("SELECT id, host, username FROM connections")
+    for row in cursor.fetchall():
+        hosts_tree.insert('', 'end', values=row[1:], iid=row[0])
+    panes.add(hosts_tree, weight=1)
+
+    results_tree = ttk.Treeview(panes, columns=('Host', 'Category', 'Mode', 'Owner', 'Path'), show='headings')
+    for column in ('Host', 'Category', 'Mode', 'Owner', 'Path'):
+        results_tree.heading(column, text=column)
+    panes.add(results_tree, weight=3)
+
+def search_permissions():
+    """Runs a permission query as one server-side find and streams the matches into a table."""
+    if not ssh:
+        messagebox.showwarning("Connection Error", "Please connect to a server first.")
+        return
+    state = {'cancel_event': None, 'shown': 0}
+
+    def start_search():
+        query = {
+            'mode': mode_entry.get().strip(),
+            'owner': owner_entry.get().strip(),
+            'group': group_entry.get().strip(),
+            'type': SEARCH_TYPE_OPTIONS[type_combobox.get()],
+            'name': name_entry.get().strip(),
+            'newer': newer_entry.get().strip(),
+            'older': older_entry.get().strip(),
+        }
+        search_root = root_entry.get().strip() or '/'
         try:
-            # Execute command to list files
-            stdin, stdout, stderr = ssh.exec_command(f'ls -l {path}')
-            
-            # Read and decode the output
-            files = stdout.read().decode().strip().split('\n')
-            errors = stderr.read().decode().strip()
+            build_search_command(search_root, query)
+            limit = int(limit_spinbox.get())
+        except ValueError as e:
+            messagebox.showerror("Input Error", str(e), parent=search_window)
+            return
+
+        cancel_event = threading.Event()
+        state['cancel_event'] = cancel_event
+        state['shown'] = 0
+        results_tree.delete(*results_tree.get_children())
+        search_button.state(['disabled'])
+        stop_button.state(['!disabled'])
+        search_status_label.config(text=f"Searching {search_root}...")
+
+        def on_results(batch):
+            post_to_ui(show_results, cancel_event, batch)
+
+        def on_done(result):
+            count, errors, truncated = result
+            status = f"{count} matches"
+            if truncated:
+                status += f" (limit of {limit} reached)"
             if errors:
+                status += f", {errors} unreadable paths skipped"
+            finish_search(status)
+
+        run_in_background(
+            search_tree, ssh, search_root, query, on_results, limit, cancel_event,
+            on_success=on_done,
+            on_error=lambda e: finish_search(f"Search failed: {e}"),
+            cancel_event=cancel_event,
+            status=None
+        )
+
+    def show_results(cancel_event, batch):
+        if cancel_event.is_set() or not search_window.winfo_exists():
+            return
+        for result in batch:
+            results_tree.insert('', 'end', values=(
+                result['path'],
+                format(result['mode'], 'o'),
+                result['owner'],
+                result['group'],
+                result['type'],
+                result['size'],
+                time.strftime('%Y-%m-%d %H:%M', time.localtime(result['mtime'])),
+            ))
+        state['shown'] += len(batch)
+        search_status_label.config(text=f"{state['shown']} matches so far...")
+
+    def finish_search(status):
+        if not search_window.winfo_exists():
+            return
+        search_button.state(['!disabled'])
+        stop_button.state(['disabled'])
+        search_status_label.config(text=status)
+
+    def stop_search():
+        if state['cancel_event']:
+            state['cancel_event'].set()
+        finish_search(f"Stopped, {state['shown']} matches shown.")
+
+    def on_result_double_click(event):
+        # Open the directory that holds the match in the main view
+        iid = results_tree.identify_row(event.y)
+        if iid:
+            path = results_tree.item(iid, 'values')[0]
+            fetch_directory(os.path.dirname(path.rstrip('/')) or '/')
+
+    def on_close():
+        if state['cancel_event']:
+            state['cancel_event'].set()
+        search_window.destroy()
+
+    search_window = tk.Toplevel(root)
+    search_window.title("Search Permissions")
+    center_window(search_window, 1000, 700)
+    search_window.protocol("WM_DELETE_WINDOW", on_close)
+
+    # Every field is optional, the filled ones are combined with AND
+    query_frame = ttk.Frame(search_window, padding="10")
+    query_frame.pack(side=tk.TOP, fill=tk.X)
+    fields = [
+        ("Root:", 0, 0), ("Mode (777, -002, /6000):", 0, 2),
+        ("Owner (name or uid):", 1, 0), ("Group (name or gid):", 1, 2),
+        ("Name glob:", 2, 0), ("Type:", 2, 2),
+        ("Modified after (YYYY-MM-DD):", 3, 0), ("Modified before:", 3, 2),
+    ]
+    for text, row, column in fields:
+        ttk.Label(query_frame, text=text).grid(row=row, column=column, padx=5, pady=3, sticky=tk.W)
+    root_entry = ttk.Entry(query_frame, width=30)
+    root_entry.insert(0, current_path)
+    root_entry.grid(row=0, column=1, padx=5, pady=3)
+    mode_entry = ttk.Entry(query_frame, width=30)
+    mode_entry.grid(row=0, column=3, padx=5, pady=3)
+    owner_entry = ttk.Entry(query_frame, width=30)
+    owner_entry.grid(row=1, column=1, padx=5, pady=3)
+    group_entry = ttk.Entry(query_frame, width=30)
+    group_entry.grid(row=1, column=3, padx=5, pady=3)
+    name_entry = ttk.Entry(query_frame, width=30)
+    name_entry.grid(row=2, column=1, padx=5, pady=3)
+    type_combobox = ttk.Combobox(query_frame, values=list(SEARCH_TYPE_OPTIONS), state='readonly', width=28)
+    type_combobox.current(0)
+    type_combobox.grid(row=2, column=3, padx=5, pady=3)
+    newer_entry = ttk.Entry(query_frame, width=30)
+    newer_entry.grid(row=3, column=1, padx=5, pady=3)
+    older_entry = ttk.Entry(query_frame, width=30)
+    older_entry.grid(row=3, column=3, padx=5, pady=3)
+
+    buttons_frame = ttk.Frame(search_window, padding=(10, 0))
+    buttons_frame.pack(side=tk.TOP, fill=tk.X)
+    ttk.Label(buttons_frame, text="Limit:").pack(side=tk.LEFT, padx=(0, 5))
+    limit_spinbox = ttk.Spinbox(buttons_frame, from_=1, to=1000000, increment=1000, width=8)
+    limit_spinbox.set(SEARCH_LIMIT)
+    limit_spinbox.pack(side=tk.LEFT, padx=(0, 10))
+    search_button = ttk.Button(buttons_frame, text="Search", command=start_search)
+    search_button.pack(side=tk.LEFT, padx=5)
+    stop_button = ttk.Button(buttons_frame, text="Cancel", command=stop_search)
+    stop_button.pack(side=tk.LEFT, padx=5)
+    stop_button.state(['disabled'])
+
+    search_status_label = ttk.Label(search_window, text="Filtering runs on the server, only matches are transferred.")
+    search_status_label.pack(side=tk.TOP, fill=tk.X, padx=10, pady=(5, 0))
+
+    columns = ('Path', 'Mode', 'Owner', 'Group', 'Type', 'Size', 'Modified')
+    results_frame = ttk.Frame(search_window)
+    results_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+    results_scrollbar = ttk.Scrollbar(results_frame, orient=tk.VERTICAL)
+    results_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+    results_tree = ttk.Treeview(results_frame, columns=columns, show='headings', yscrollcommand=results_scrollbar.set)
+    results_scrollbar.config(command=results_tree.yview)
+    for column in columns:
+        results_tree.heading(column, text=column)
+        results_tree.column(column, width=400 if column == 'Path' else 80)
+    results_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+    results_tree.bind('<Double-1>', on_result_double_click)
+
+def fetch_directory(path, use_cache=True, background=False):
+    """Lists path into the file view. Background refreshes skip the cached paint and the progress
+    indicator, and only transfer the listing when the directory mtime changed."""
+    global listing_cancel_event
+    if ssh:
+        # A new listing supersedes the one still running
+        if listing_cancel_event:
+            listing_cancel_event.set()
+
+        cache_key = (current_host, path)
+        if not use_cache:
+            cached = None
+        elif background:
+            cached = listing_cache.peek(cache_key)
+        else:
+            cached = listing_cache.get(cache_key)
+        if cached and not background:
+            # Show the cached listing right away, revalidate only once it has aged
+            show_listing(path, cached['entries'])
+            if time.time() - cached['checked_at'] < CACHE_REVALIDATE_SECONDS:
+                return
+
+        def on_listed(result):
+            entries, errors, mtime = result
+            if errors and background:
+                # Quiet like on_failed, a directory that went away keeps its last listing on screen
+                if mtime is None:
+                    return
+            elif errors:
                 messagebox.showerror("Fetch Error", errors)
+            if mtime is not None and not errors:
+                listing_cache.put(cache_key, {'mtime': mtime, 'entries': entries, 'checked_at': time.time()})
+            if not cached or cached['entries'] is not entries:
+                show_listing(path, entries)
+
+        def on_failed(e):
+            if not background:
+                messagebox.showerror("Fetch Error", str(e))
+
+        cancel_event = threading.Event()
+        listing_cancel_event = cancel_event
+        run_in_background(
+            list_directory, ssh, sftp, path, cached, cancel_event,
+            on_success=on_listed,
+            on_error=on_failed,
+            cancel_event=cancel_event,
+            cancellable=not background,
+            status=None if background else f"Listing {path}..."
+        )
 
-            # Add the "../" entry manually at the start
-            files.insert(0, '../')
-            
-            update_file_list(files)
-        except Exception as e:
-            messagebox.showerror("Fetch Error", str(e))
+def auto_refresh():
+    # Only when idle, a refresh must never cancel a listing or race a change the user started.
+    # A running watcher already delivers the changes.
+    if ssh and not running_tasks and not watch_cancel_event:
+        fetch_directory(current_path, background=True)
+    root.after(AUTO_REFRESH_MS, auto_refresh)
 
-def update_file_list(files):
-    file_listbox.delete(*file_listbox.get_children())
-    
-    if not files:
+def show_listing(path, entries):
+    global current_path, shown_listing, prefetch_generation
+    current_path = path  # Update current path
+    # Re-listing the directory on screen keeps the scroll position and the selection
+    keep_view = shown_listing == (current_host, path)
+    shown_listing = (current_host, path)
+    update_file_list(entries, keep_view)
+    if any('acl' not in entry for entry in entries):
+        load_extended_attributes(path, entries)
+    if not keep_view:
+        prefetch_generation += 1
+        schedule_prefetch(path, entries, prefetch_depth, prefetch_generation)
+        if watch_var.get():
+            start_watch()
+
+def schedule_prefetch(path, entries, depth, generation):
+    """Queues listings of the subdirectories of path, depth levels down, on the prefetch workers."""
+    if not prefetch_enabled or not ssh or depth < 1:
         return
-    
-    for file in files:
-        parts = file.split(maxsplit=8)
-        if len(parts) >= 9:
-            name = parts[-1]
-            size = parts[4]
-            permissions = parts[0]
-            try:
-                # Convert permissions to octal
-                octal_permissions = get_octal_permissions(name)
-            except ValueError:
-                octal_permissions = 'N/A'
-            file_listbox.insert('', 'end', values=(name, size, permissions, octal_permissions))
+    directories = [entry for entry in entries if entry['type'] == 'directory'][:PREFETCH_MAX_DIRECTORIES]
+    for entry in directories:
+        child = os.path.join(path, entry['name'])
+        if listing_cache.peek((current_host, child)) is None:
+            prefetch_executor.submit(prefetch_listing, generation, current_host, ssh, sftp is not None, child, depth)
+
+def prefetch_sftp(client):
+    """SFTP session of the calling prefetch worker, opened on first use. paramiko's SFTPClient is
+    not safe to use from several threads, so the foreground session is never shared."""
+    session = getattr(prefetch_sessions, 'session', None)
+    if session is None or session[0] is not client:
+        if session is not None:
+            session[1].close()
+        prefetch_sessions.session = session = (client, client.open_sftp())
+    return session[1]
+
+def prefetch_listing(generation, host, client, use_sftp, path, depth):
+    # Low priority: wait while user initiated work runs, give up once the user has moved on
+    while running_tasks and generation == prefetch_generation:
+        time.sleep(0.05)
+    if generation != prefetch_generation:
+        return
+    try:
+        entries, errors, mtime = list_directory(client, prefetch_sftp(client) if use_sftp else None, path)
+    except Exception:
+        return  # Unreadable directories are simply not prefetched
+    if mtime is not None and not errors:
+        post_to_ui(store_prefetched, generation, host, path, entries, mtime, depth)
+
+def store_prefetched(generation, host, path, entries, mtime, depth):
+    if generation != prefetch_generation:
+        return
+    if listing_cache.peek((host, path)) is None:
+        listing_cache.put((host, path), {'mtime': mtime, 'entries': entries, 'checked_at': time.time()}, prefetched=True)
+    if host == current_host:
+        schedule_prefetch(path, entries, depth - 1, generation)
+
+def configure_prefetch(enabled, depth, workers):
+    global prefetch_enabled, prefetch_depth, prefetch_workers, prefetch_executor, prefetch_generation
+    prefetch_enabled, prefetch_depth = enabled, depth
+    prefetch_generation += 1  # Drop whatever is still queued
+    if workers != prefetch_workers:
+        prefetch_executor.shutdown(wait=False, cancel_futures=True)
+        prefetch_executor = ThreadPoolExecutor(max_workers=workers)
+        prefetch_workers = workers
+
+def load_extended_attributes(directory, entries, names=None):
+    """Fills the ACL and Capabilities columns of entries with one remote command for the whole
+    directory, or for names only when just a few rows changed. Cached listings share the entry
+    dictionaries, so they keep the result too."""
+    for entry in entries:
+        entry['acl'] = entry['capabilities'] = None  # Unknown until loaded, also marks the request as sent
+
+    def on_loaded(result):
+        acls, capabilities = result
+        for entry in entries:
+            entry['acl'] = None if acls is None else acls.get(entry['name'], [])
+            entry['capabilities'] = None if capabilities is None else capabilities.get(entry['name'], '')
+        if directory == current_path:
+            schedule_render()
+        if directory in tree_listings:
+            refresh_tree_rows(directory)
+
+    run_in_background(
+        fetch_extended_attributes, ssh, directory, names,
+        on_success=on_loaded,
+        on_error=lambda e: None,  # The columns simply stay empty
+        status=None
+    )
+
+def invalidate_listing(path, recursive=False):
+    """Drops a cached listing, needed after our own changes since chmod leaves the directory mtime alone."""
+    listing_cache.pop((current_host, path))
+    if recursive:
+        prefix = path.rstrip('/') + '/'
+        for key in listing_cache.keys():
+            if key[0] == current_host and key[1].startswith(prefix):
+                listing_cache.pop(key)
+        invalidate_tree(path)
+
+SORT_KEYS = {
+    'Name': lambda entry: entry['name'],
+    'Size': lambda entry: entry['size'],
+    'Permissions': lambda entry: entry['mode'],
+    'Octal Permissions': lambda entry: stat.S_IMODE(entry['mode']),
+    'Owner': lambda entry: entry['owner'],
+    'Group': lambda entry: entry['group'],
+    'ACL': lambda entry: ','.join(entry.get('acl') or ()),
+    'Capabilities': lambda entry: entry.get('capabilities') or '',
+}
+
+def update_file_list(entries, keep_view=False):
+    global current_entries, current_index, view_offset
+    current_entries = entries
+    current_index = {entry['name']: i for i, entry in enumerate(entries)}
+    if not keep_view:
+        view_offset = 0
+        selected_names.clear()
+        reset_tree()
+    apply_view()
+
+def view_order(entries, keep_directories=False):
+    """Applies the filter box and the sort column to entries."""
+    pattern = filter_var.get().strip().lower()
+    if pattern:
+        if any(char in pattern for char in '*?['):
+            matches = lambda name: fnmatch.fnmatchcase(name, pattern)
         else:
-            file_listbox.insert('', 'end', values=(file, '', '', ''))
+            matches = lambda name: pattern in name
+        entries = [
+            entry for entry in entries
+            if matches(entry['name'].lower()) or (keep_directories and entry['type'] == 'directory')
+        ]
+    return sorted(entries, key=SORT_KEYS[sort_column], reverse=sort_reverse)
+
+def apply_view():
+    """Filters and sorts current_entries into view_entries and redraws the visible window."""
+    global view_entries
+    if tree_var.get():
+        render_tree()
+        return
 
-def get_octal_permissions(filename):
-    try:
-        # Execute the stat command to get file permissions in octal format
-        stdin, stdout, stderr = ssh.exec_command(f'stat -c %a {os.path.join(current_path, filename)}')
-        permissions = stdout.read().decode().strip()
-        
-        if permissions:
-            return permissions
+    # Add the "../" entry manually at the start
+    with instrumentation.span('apply_view', 'ui', entries=len(current_entries)):
+        view_entries = [PARENT_ENTRY] + view_order(current_entries)
+    schedule_render()
+
+def sort_view(column):
+    global sort_column, sort_reverse
+    sort_reverse = not sort_reverse if column == sort_column else False
+    sort_column = column
+    for name in SORT_KEYS:
+        arrow = (' \u25bc' if sort_reverse else ' \u25b2') if name == sort_column else ''
+        file_listbox.heading(name, text=name + arrow)
+        if name == 'Name':
+            file_listbox.heading('#0', text=name + arrow)
+    apply_view()
+
+def schedule_render(delay=None):
+    global render_pending
+    if not render_pending:
+        render_pending = True
+        if delay is None:
+            root.after_idle(render_view)
         else:
-            return 'N/A'
-    except Exception as e:
-        return 'N/A'
+            root.after(delay, render_view)
+
+def visible_row_count():
+    row_height = int(ttk.Style().lookup('Treeview', 'rowheight') or 20)
+    return max(1, (file_listbox.winfo_height() - HEADING_HEIGHT) // row_height)
+
+def entry_values(entry):
+    if entry is PARENT_ENTRY:
+        return (entry['name'],) + ('',) * (len(SORT_KEYS) - 1)
+    return (
+        entry['name'],
+        entry['size'],
+        stat.filemode(entry['mode']),
+        get_octal_permissions(entry['mode']),
+        entry['owner'],
+        entry['group'],
+        ','.join(entry.get('acl') or ()),
+        entry.get('capabilities') or '',
+    )
+
+def render_view():
+    """Shows view_entries[view_offset:] in the pooled rows, plus a small buffer below the fold."""
+    global render_pending
+    render_pending = False
+    if tree_var.get():
+        return  # The tree holds real rows and scrolls natively
+    with instrumentation.span('render', 'ui'):
+        fill_rows()
+
+def fill_rows():
+    global view_offset
+    visible = visible_row_count()
+    total = len(view_entries)
+    view_offset = max(0, min(view_offset, total - visible))
+    window = view_entries[view_offset:view_offset + visible + VIEW_BUFFER_ROWS]
+
+    # Grow the row pool lazily in chunks so first paint stays bounded
+    missing = len(window) - len(row_items)
+    for _ in range(min(missing, ROW_CHUNK_SIZE)):
+        row_items.append(file_listbox.insert('', 'end'))
+    if missing > ROW_CHUNK_SIZE:
+        schedule_render(delay=1)
+    if len(row_items) > len(window):
+        file_listbox.delete(*row_items[len(window):])
+        del row_items[len(window):]
+
+    row_entries.clear()
+    selection = []
+    for iid, entry in zip(row_items, window):
+        file_listbox.item(iid, values=entry_values(entry))
+        row_entries[iid] = entry
+        if entry['name'] in selected_names:
+            selection.append(iid)
+    file_listbox.selection_set(selection)
+    file_listbox.yview_moveto(0)
+
+    if total:
+        view_scrollbar.set(view_offset / total, min(1.0, (view_offset + visible) / total))
+    else:
+        view_scrollbar.set(0.0, 1.0)
+
+def scroll_view_to(offset):
+    global view_offset
+    view_offset = max(0, min(offset, len(view_entries) - visible_row_count()))
+    schedule_render()
+
+def on_view_scroll(*args):
+    """Scrollbar command, maps scrollbar positions onto view_entries."""
+    visible = visible_row_count()
+    if args[0] == 'moveto':
+        scroll_view_to(int(float(args[1]) * len(view_entries)))
+    elif args[0] == 'scroll':
+        step = visible if args[2] == 'pages' else 1
+        scroll_view_to(view_offset + int(args[1]) * step)
+
+def on_mouse_wheel(event):
+    if tree_var.get():
+        return None
+    if event.num == 4 or event.delta > 0:
+        scroll_view_to(view_offset - 3)
+    else:
+        scroll_view_to(view_offset + 3)
+    return 'break'
+
+def on_row_click(event):
+    # A plain click starts a new selection, including rows scrolled out of the window
+    if not event.state & (0x0001 | 0x0004):  # Shift, Control
+        selected_names.clear()
+
+def on_select(event):
+    if tree_var.get():
+        return
+    selection = set(file_listbox.selection())
+    for iid, entry in row_entries.items():
+        if iid in selection:
+            selected_names.add(entry['name'])
+        else:
+            selected_names.discard(entry['name'])
+
+def on_arrow_key(event, step):
+    """Moves the selection through view_entries, scrolling the window when it leaves the screen."""
+    if tree_var.get():
+        return None
+    focus = file_listbox.focus()
+    position = view_offset + row_items.index(focus) if focus in row_entries else view_offset - step
+    position = max(0, min(position + step, len(view_entries) - 1))
+    visible = visible_row_count()
+    if position < view_offset:
+        scroll_view_to(position)
+    elif position >= view_offset + visible:
+        scroll_view_to(position - visible + 1)
+    selected_names.clear()
+    selected_names.add(view_entries[position]['name'])
+    render_view()
+    if 0 <= position - view_offset < len(row_items):
+        file_listbox.focus(row_items[position - view_offset])
+    return 'break'
+
+def selected_entries():
+    """Returns the selected entries of the current directory, excluding "../"."""
+    return [entry for entry in view_entries if entry['name'] in selected_names and entry is not PARENT_ENTRY]
+
+def selected_items():
+    """Returns (directory, entry) pairs for the selection in either view, excluding "../".
+    The flat view only holds current_path, the tree may select entries of several directories."""
+    if tree_var.get():
+        items = [tree_items.get(iid) for iid in file_listbox.selection()]
+        return [item for item in items if item and item[1] is not PARENT_ENTRY]
+    return [(current_path, entry) for entry in selected_entries()]
+
+def selected_directory_entries():
+    """Returns (directory, entries) for the selection, directory is None when it spans several."""
+    items = selected_items()
+    directories = {directory for directory, entry in items}
+    directory = directories.pop() if len(directories) == 1 else (None if directories else current_path)
+    return directory, [entry for _, entry in items]
 
 def on_double_click(event):
-    item = file_listbox.selection()
-    if item:
-        filename = file_listbox.item(item, 'values')[0]
-        
+    if tree_var.get():
+        # Directories expand in place, only "../" navigates
+        item = tree_items.get(file_listbox.identify_row(event.y))
+        if item and item[1] is PARENT_ENTRY:
+            navigate_up()
+        return
+    entry = row_entries.get(file_listbox.identify_row(event.y))
+    if entry:
         # Check if the selected item is "../"
-        if filename == "../":
+        if entry is PARENT_ENTRY:
             navigate_up()
         else:
             # Normal behavior: open the selected directory or do other actions
-            path = os.path.join(current_path, filename)
+            path = os.path.join(current_path, entry['name'])
             fetch_directory(path)
 
+def set_tree_mode():
+    """Switches file_listbox between the virtualized flat view and the lazily expanded tree."""
+    file_listbox.delete(*file_listbox.get_children())
+    row_items.clear()
+    row_entries.clear()
+    selected_names.clear()
+    reset_tree()
+    if tree_var.get():
+        file_listbox.configure(show='tree headings', displaycolumns=tuple(SORT_KEYS)[1:],
+                               yscrollcommand=view_scrollbar.set)
+        view_scrollbar.configure(command=file_listbox.yview)
+    else:
+        file_listbox.configure(show='headings', displaycolumns='#all', yscrollcommand='')
+        view_scrollbar.configure(command=on_view_scroll)
+    apply_view()
+
+def reset_tree():
+    global tree_generation
+    tree_generation += 1
+    tree_listings.clear()
+    tree_items.clear()
+    tree_nodes.clear()
+    tree_open.clear()
+
+def render_tree():
+    """Rebuilds the tree from the loaded listings, expanded directories stay open."""
+    selection = [tree_items[iid] for iid in file_listbox.selection() if iid in tree_items]
+    tree_listings[current_path] = current_entries
+    with instrumentation.span('render_tree', 'ui', directories=len(tree_listings)):
+        fill_tree_node('', current_path)
+    iid = file_listbox.insert('', 0, text=PARENT_ENTRY['name'], values=entry_values(PARENT_ENTRY))
+    tree_items[iid] = (current_path, PARENT_ENTRY)
+    paths = (posixpath.join(directory, entry['name']) for directory, entry in selection)
+    file_listbox.selection_set([tree_nodes[path] for path in paths if path in tree_nodes])
+
+def fill_tree_node(parent, directory):
+    """Inserts the loaded listing of directory under the parent item, recursing into loaded
+    subdirectories. Directories not listed yet get a placeholder child so they can be expanded."""
+    forget_tree_children(parent)
+    entries = view_order(tree_listings[directory], keep_directories=True)
+    for entry in entries[:TREE_MAX_CHILDREN]:
+        path = posixpath.join(directory, entry['name'])
+        iid = file_listbox.insert(parent, 'end', text=entry['name'], values=entry_values(entry), open=path in tree_open)
+        tree_items[iid] = (directory, entry)
+        tree_nodes[path] = iid
+        if entry['type'] != 'directory':
+            continue
+        if path in tree_listings:
+            fill_tree_node(iid, path)
+        else:
+            file_listbox.insert(iid, 'end', text=TREE_PLACEHOLDER)
+    if len(entries) > TREE_MAX_CHILDREN:
+        file_listbox.insert(parent, 'end', text=f"{len(entries) - TREE_MAX_CHILDREN} more entries, open {directory} in the flat view")
+
+def forget_tree_children(iid):
+    for child in file_listbox.get_children(iid):
+        forget_tree_children(child)
+        item = tree_items.pop(child, None)
+        if item:
+            tree_nodes.pop(posixpath.join(item[0], item[1]['name']), None)
+    file_listbox.delete(*file_listbox.get_children(iid))
+
+def refresh_tree_rows(directory):
+    for entry in tree_listings[directory]:
+        iid = tree_nodes.get(posixpath.join(directory, entry['name']))
+        if iid:
+            file_listbox.item(iid, values=entry_values(entry))
+
+def on_tree_open(event):
+    """Lists a directory the first time it is expanded."""
+    item = tree_items.get(file_listbox.focus())
+    if not item or item[1] is PARENT_ENTRY:
+        return
+    path = posixpath.join(item[0], item[1]['name'])
+    tree_open.add(path)
+    if path in tree_listings:
+        load_tree_attributes(path)
+    else:
+        load_tree(path)
+
+def on_tree_close(event):
+    item = tree_items.get(file_listbox.focus())
+    if item:
+        tree_open.discard(posixpath.join(item[0], item[1]['name']))
+
+def load_tree(path, depth=1):
+    """Loads path into the tree, depth levels deep. A single level comes from the listing cache
+    when possible, deeper loads stream every directory into the tree as its listing arrives,
+    TREE_WORKERS listings at a time over the active connection."""
+    if not ssh:
+        return
+    generation, host = tree_generation, current_host
+    if depth == 1:
+        cached = listing_cache.get((host, path))
+        if cached:
+            show_tree_listing(generation, host, path, cached['entries'], '', None)
+            return
+
+        def on_listed(result):
+            entries, errors, mtime = result
+            show_tree_listing(generation, host, path, entries, errors, None if errors else mtime)
+
+        run_in_background(
+            list_directory, ssh, sftp, path,
+            on_success=on_listed,
+            on_error=lambda e: show_tree_listing(generation, host, path, None, str(e), None),
+            status=f"Listing {path}..."
+        )
+        return
+
+    def on_listing(listed_path, entries, errors, mtime):
+        post_to_ui(show_tree_listing, generation, host, listed_path, entries, errors, None if errors else mtime, True)
+
+    def on_loaded(result):
+        listed, failed, truncated = result
+        summary = f"{listed} directories loaded under {path}"
+        if failed:
+            summary += f", {failed} unreadable"
+        if truncated:
+            summary += f", stopped at {TREE_MAX_DIRECTORIES}"
+        update_status(summary)
+
+    run_in_background(
+        list_tree, ssh, path, on_listing, depth, sftp is not None,
+        on_success=on_loaded, cancellable=True, status=f"Expanding {path}..."
+    )
+
+def show_tree_listing(generation, host, path, entries, errors, mtime, expand=False):
+    """Puts one arriving listing into the tree, stale ones from before a reset are dropped."""
+    if mtime is not None:
+        listing_cache.put((host, path), {'mtime': mtime, 'entries': entries, 'checked_at': time.time()})
+    if generation != tree_generation:
+        return
+    iid = tree_nodes.get(path)
+    if entries is None or (errors and not entries):
+        tree_open.discard(path)
+        if iid:
+            file_listbox.item(iid, open=False)
+        update_status(f"Cannot list {path}: {errors}")
+        return
+    if path == current_path:
+        return  # The top level is current_entries, fetch_directory keeps it current
+    if expand:
+        tree_open.add(path)
+    tree_listings[path] = entries
+    if iid:
+        fill_tree_node(iid, path)
+        file_listbox.item(iid, open=path in tree_open)
+    # A subtree load would queue one ACL command per directory, those wait until a directory is opened
+    if not expand:
+        load_tree_attributes(path)
+
+def load_tree_attributes(directory):
+    entries = tree_listings[directory]
+    if any('acl' not in entry for entry in entries):
+        load_extended_attributes(directory, entries)
+
+def invalidate_tree(path):
+    """Forgets listings loaded under path, the directories are listed again when expanded."""
+    prefix = path.rstrip('/') + '/'
+    for directory in [directory for directory in tree_listings if directory.startswith(prefix)]:
+        del tree_listings[directory]
+    tree_open.difference_update([directory for directory in tree_open if directory.startswith(prefix)])
+    iid = tree_nodes.get(path)
+    if iid and path in tree_listings:
+        fill_tree_node(iid, path)
+
+def expand_subtree():
+    """Loads the selected directory, or the current one, TREE_EXPAND_DEPTH levels deep."""
+    if not ssh:
+        messagebox.showwarning("Connection Error", "Please connect to a server first.")
+        return
+    directories = [posixpath.join(directory, entry['name'])
+                   for directory, entry in selected_items() if entry['type'] == 'directory']
+    if not tree_var.get():
+        tree_var.set(True)
+        set_tree_mode()
+    load_tree(directories[0] if directories else current_path, TREE_EXPAND_DEPTH)
+
+def update_directory_entries(directory, entries, removed=()):
+    """Hands fresh entries of directory to whichever view shows it, otherwise drops its cached listing."""
+    if directory == current_path:
+        update_entries(entries, removed)
+    elif directory in tree_listings:
+        update_tree_entries(directory, entries, removed)
+    else:
+        invalidate_listing(directory)
+
+def update_tree_entries(directory, entries, removed=()):
+    """Patches a loaded tree listing in place, the listing cache shares the same list."""
+    listing = tree_listings[directory]
+    positions = {entry['name']: i for i, entry in enumerate(listing)}
+    for entry in entries:
+        position = positions.get(entry['name'])
+        if position is None:
+            listing.append(entry)
+        else:
+            listing[position] = entry
+    if removed:
+        removed = set(removed)
+        listing[:] = [entry for entry in listing if entry['name'] not in removed]
+    iid = tree_nodes.get(directory)
+    if iid:
+        fill_tree_node(iid, directory)
+    stale = [entry for entry in entries if 'acl' not in entry]
+    if stale:
+        load_extended_attributes(directory, stale, [entry['name'] for entry in stale])
+
+def update_entries(entries, removed=()):
+    """Replaces entries of the current directory by name, drops removed names and redraws the
+    view in place, keeping the scroll position and the selection."""
+    global current_entries, current_index
+    for entry in entries:
+        position = current_index.get(entry['name'])
+        if position is None:
+            current_index[entry['name']] = len(current_entries)
+            current_entries.append(entry)
+        else:
+            current_entries[position] = entry
+    if removed:
+        removed = set(removed)
+        current_entries = [entry for entry in current_entries if entry['name'] not in removed]
+        current_index = {entry['name']: i for i, entry in enumerate(current_entries)}
+        selected_names.difference_update(removed)
+    cached = listing_cache.peek((current_host, current_path))
+    if cached:
+        cached['entries'] = current_entries
+    apply_view()
+    # Fresh stat results carry no ACLs, and chmod rewrites the ACL mask
+    stale = [entry for entry in entries if 'acl' not in entry]
+    if stale:
+        load_extended_attributes(current_path, stale, [entry['name'] for entry in stale])
+
+def refresh_entries(names, quiet=False, directory=None):
+    """Re-stats only the touched names of a directory, the current one by default, and updates their rows."""
+    directory = directory or current_path
+
+    def on_refreshed(result):
+        entries, missing = result
+        update_directory_entries(directory, entries, missing)
+
+    run_in_background(
+        stat_entries, ssh, directory, names,
+        on_success=on_refreshed,
+        on_error=(lambda e: None) if quiet else None,
+        status=None if quiet else "Refreshing..."
+    )
+
+def start_watch():
+    """Starts watching the current directory, replacing the watcher of the previous one."""
+    global watch_cancel_event
+    stop_watch()
+    if not ssh:
+        return
+    cancel_event = threading.Event()
+    watch_cancel_event = cancel_event
+    client, host, directory = ssh, current_host, posixpath.normpath(current_path)
+    recursive = watch_recursive_var.get()
+
+    def on_changes(method, paths):
+        post_to_ui(apply_watch_changes, cancel_event, host, directory, method, paths)
+
+    def task():
+        # Runs for as long as the watch lasts, so it gets its own thread instead of a pool worker
+        try:
+            watch_directory(client, directory, on_changes, recursive, cancel_event=cancel_event)
+        except TaskCancelled:
+            return
+        except Exception as e:
+            post_to_ui(watch_stopped, cancel_event, str(e))
+        else:
+            post_to_ui(watch_stopped, cancel_event, "The remote watcher exited.")
+
+    threading.Thread(target=task, daemon=True).start()
+
+def stop_watch():
+    global watch_cancel_event
+    if watch_cancel_event:
+        watch_cancel_event.set()
+        watch_cancel_event = None
+
+def toggle_watch():
+    if watch_var.get():
+        start_watch()
+    else:
+        stop_watch()
+        update_status("")
+
+def watch_stopped(cancel_event, reason):
+    global watch_cancel_event
+    if cancel_event is not watch_cancel_event:
+        return
+    watch_cancel_event = None
+    watch_var.set(False)
+    update_status(f"Watch stopped: {reason}")
+
+def apply_watch_changes(cancel_event, host, directory, method, paths):
+    """Applies a batch of watched changes: touched rows of the current directory are re-stat'ed,
+    cached listings of touched subdirectories are dropped."""
+    if cancel_event.is_set():
+        return
+    if not paths:
+        update_status(f"Watching {directory} ({method})")
+        return
+    names = set()
+    tree_names = {}  # Loaded tree directory -> touched names
+    relist = False
+    for path in paths:
+        listing_cache.pop((host, path))
+        if path == directory:
+            relist = True
+            continue
+        parent, name = posixpath.split(path)
+        if parent == directory:
+            names.add(name)
+        else:
+            listing_cache.pop((host, parent))
+            if parent in tree_listings:
+                tree_names.setdefault(parent, set()).add(name)
+    if host != current_host or directory != posixpath.normpath(current_path):
+        return
+    for parent, touched in tree_names.items():
+        refresh_entries(sorted(touched), quiet=True, directory=parent)
+    # A relist would cancel a listing the user started, touched rows can always be re-stat'ed
+    if relist and not running_tasks:
+        fetch_directory(current_path, background=True)
+    elif names:
+        refresh_entries(sorted(names), quiet=True)
+
 def change_permissions():
-    selected_item = file_listbox.selection()
-    if selected_item:
-        filename = file_listbox.item(selected_item, 'values')[0]
-        path = os.path.join(current_path, filename)
+    directory, entries = selected_directory_entries()
+    if directory is None:
+        messagebox.showwarning("Selection Error", "Please select entries of a single directory.")
+    elif entries:
+        names = [entry['name'] for entry in entries]
+        label = names[0] if len(names) == 1 else f"{len(names)} items"
         new_permissions = custom_simpledialog(
-            prompt=f"Enter new permissions for {filename} (e.g., 755):",
+            prompt=f"Enter new permissions for {label} (e.g., 755):",
             title="Permissions",
             is_password=False
         )
-        if new_permissions:
-            try:
-                ssh.exec_command(f'chmod {new_permissions} {path}')
-                fetch_directory(current_path)  # Refresh file list
-                messagebox.showinfo("Success", f"Permissions changed for {filename}.")
-            except Exception as e:
-                messagebox.showerror("Error", str(e))
+        if new_permissions and not MODE_PATTERN.match(new_permissions):
+            messagebox.showerror("Input Error", f"Invalid permissions: {new_permissions}")
+        elif new_permissions:
+            def on_changed(result):
+                changed, errors, exit_status = result
+                update_directory_entries(directory, changed)  # Refresh only the touched rows
+                if exit_status != 0:
+                    messagebox.showerror("Error", errors or f"chmod exited with status {exit_status}.")
+                    return
+                messagebox.showinfo("Success", f"Permissions changed for {label}.")
+
+            run_in_background(
+                chmod_entries, ssh, directory, new_permissions, names,
+                on_success=on_changed, status=f"Changing permissions of {label}..."
+            )
     else:
         messagebox.showwarning("Selection Error", "Please select a file or directory to change permissions.")
 
+def edit_acl():
+    """Applies one setfacl operation to every selected entry, batched per command line."""
+    directory, entries = selected_directory_entries()
+    if directory is None:
+        messagebox.showwarning("Selection Error", "Please select entries of a single directory.")
+        return
+    if not entries:
+        messagebox.showwarning("Selection Error", "Please select a file or directory to edit its ACL.")
+        return
+    names = [entry['name'] for entry in entries]
+    entries_by_name = set(names)
+    label = names[0] if len(names) == 1 else f"{len(names)} items"
+
+    dialog = tk.Toplevel(root)
+    dialog.title("Edit ACL")
+    center_window(dialog, 500, 230)
+
+    ttk.Label(dialog, text="Entries:").grid(row=0, column=0, padx=5, pady=5, sticky=tk.W)
+    ttk.Label(dialog, text=label).grid(row=0, column=1, padx=5, pady=5, sticky=tk.W)
+
+    operations = {"Modify (-m)": 'modify', "Remove entries (-x)": 'remove', "Remove all (-b)": 'remove-all'}
+    ttk.Label(dialog, text="Operation:").grid(row=1, column=0, padx=5, pady=5, sticky=tk.W)
+    operation_combobox = ttk.Combobox(dialog, values=list(operations), state='readonly', width=28)
+    operation_combobox.current(0)
+    operation_combobox.grid(row=1, column=1, padx=5, pady=5, sticky=tk.W)
+
+    # ACL entries in setfacl syntax, e.g. u:alice:rwX,g:developers:rX or d:u:alice:rwX
+    ttk.Label(dialog, text="ACL entries:").grid(row=2, column=0, padx=5, pady=5, sticky=tk.W)
+    spec_entry = ttk.Entry(dialog, width=30)
+    spec_entry.grid(row=2, column=1, padx=5, pady=5, sticky=tk.W)
+
+    recursive_var = tk.BooleanVar(value=False)
+    ttk.Checkbutton(dialog, text="Apply to directory contents (-R)", variable=recursive_var).grid(
+        row=3, column=1, padx=5, pady=5, sticky=tk.W)
+
+    def apply():
+        operation = operations[operation_combobox.get()]
+        spec = spec_entry.get().strip()
+        recursive = recursive_var.get()
+        if operation != 'remove-all' and not spec:
+            messagebox.showerror("Input Error", "Please enter the ACL entries.", parent=dialog)
+            return
+        dialog.destroy()
+
+        def on_applied(result):
+            errors, exit_status = result
+            if recursive:
+                for name in names:
+                    invalidate_listing(os.path.join(directory, name), recursive=True)
+            listing = current_entries if directory == current_path else tree_listings.get(directory, ())
+            changed = [entry for entry in listing if entry['name'] in entries_by_name]
+            if changed:
+                load_extended_attributes(directory, changed, names)
+            if exit_status != 0:
+                messagebox.showerror("Error", errors or f"setfacl exited with status {exit_status}.")
+
+        run_in_background(
+            setfacl_entries, ssh, directory, operation, spec, names, recursive,
+            on_success=on_applied, status=f"Updating ACL of {label}..."
+        )
+
+    ttk.Button(dialog, text="Apply", command=apply).grid(row=4, column=1, padx=5, pady=10, sticky=tk.E)
+
+def change_permissions_recursive():
+    items = selected_items()
+    path = posixpath.join(items[0][0], items[0][1]['name']) if items else current_path
+
+    def apply():
+        file_mode = file_mode_entry.get().strip()
+        dir_mode = dir_mode_entry.get().strip()
+        if not file_mode and not dir_mode:
+            messagebox.showerror("Input Error", "Please enter a file mode, a directory mode or both.", parent=dialog)
+            return
+        for mode in (file_mode, dir_mode):
+            if mode and not MODE_PATTERN.match(mode):
+                messagebox.showerror("Input Error", f"Invalid permissions: {mode}", parent=dialog)
+                return
+        dialog.destroy()
+
+        def on_done(result):
+            processed, errors, error_sample, exit_status, elapsed = result
+            invalidate_listing(path, recursive=True)
+            parent = posixpath.dirname(path)
+            if path == current_path:
+                fetch_directory(current_path, use_cache=False)  # Every row may have changed
+            elif parent == current_path or parent in tree_listings:
+                refresh_entries([posixpath.basename(path)], directory=parent)
+            else:
+                invalidate_listing(parent)
+            summary = f"{processed} entries processed in {elapsed:.1f}s under {path}."
+            if errors or exit_status != 0:
+                messagebox.showerror("Error", f"{summary}\n{errors} errors:\n" + '\n'.join(error_sample))
+            else:
+                messagebox.showinfo("Success", summary)
+
+        def on_progress(processed, errors, rate):
+            post_to_ui(update_status, f"{processed} entries ({rate:.0f}/s), {errors} errors")
+
+        run_in_background(
+            chmod_recursive, ssh, path, file_mode, dir_mode, on_progress,
+            on_success=on_done, cancellable=True, status=f"Changing permissions under {path}..."
+        )
+
+    if not ssh:
+        messagebox.showwarning("Connection Error", "Please connect to a server first.")
+        return
+
+    dialog = tk.Toplevel(root)
+    dialog.title("Recursive Permissions")
+    center_window(dialog, 500, 200)
+
+    ttk.Label(dialog, text="Path:").grid(row=0, column=0, padx=5, pady=5, sticky=tk.W)
+    ttk.Label(dialog, text=path).grid(row=0, column=1, padx=5, pady=5, sticky=tk.W)
+
+    # Modes accept octal (644) or symbolic clauses (u=rwX,g=rX), empty leaves that type untouched
+    ttk.Label(dialog, text="File mode:").grid(row=1, column=0, padx=5, pady=5, sticky=tk.W)
+    file_mode_entry = ttk.Entry(dialog, width=30)
+    file_mode_entry.insert(0, "644")
+    file_mode_entry.grid(row=1, column=1, padx=5, pady=5)
+
+    ttk.Label(dialog, text="Directory mode:").grid(row=2, column=0, padx=5, pady=5, sticky=tk.W)
+    dir_mode_entry = ttk.Entry(dialog, width=30)
+    dir_mode_entry.insert(0, "755")
+    dir_mode_entry.grid(row=2, column=1, padx=5, pady=5)
+
+    apply_button = ttk.Button(dialog, text="Apply Recursively", command=apply)
+    apply_button.grid(row=3, column=1, padx=5, pady=10, sticky=tk.E)
+
+def stage_changes():
+    """Stages a mode and/or owner change for the selected entries, in any number of directories."""
+    items = selected_items()
+    if not items:
+        messagebox.showwarning("Selection Error", "Please select the files or directories to stage changes for.")
+        return
+    label = items[0][1]['name'] if len(items) == 1 else f"{len(items)} items"
+
+    dialog = tk.Toplevel(root)
+    dialog.title("Stage Changes")
+    center_window(dialog, 450, 200)
+
+    ttk.Label(dialog, text="Entries:").grid(row=0, column=0, padx=5, pady=5, sticky=tk.W)
+    ttk.Label(dialog, text=label).grid(row=0, column=1, padx=5, pady=5, sticky=tk.W)
+
+    # Empty fields leave that attribute alone
+    ttk.Label(dialog, text="Mode:").grid(row=1, column=0, padx=5, pady=5, sticky=tk.W)
+    mode_entry = ttk.Entry(dialog, width=30)
+    mode_entry.grid(row=1, column=1, padx=5, pady=5)
+    ttk.Label(dialog, text="Owner (user:group):").grid(row=2, column=0, padx=5, pady=5, sticky=tk.W)
+    owner_entry = ttk.Entry(dialog, width=30)
+    owner_entry.grid(row=2, column=1, padx=5, pady=5)
+
+    def stage():
+        mode = mode_entry.get().strip()
+        owner = owner_entry.get().strip()
+        if not mode and not owner:
+            messagebox.showerror("Input Error", "Please enter a mode, an owner or both.", parent=dialog)
+            return
+        if mode and not MODE_PATTERN.match(mode):
+            messagebox.showerror("Input Error", f"Invalid permissions: {mode}", parent=dialog)
+            return
+        if owner:
+            try:
+                changes.validate_owner(owner)
+            except ValueError as e:
+                messagebox.showerror("Input Error", str(e), parent=dialog)
+                return
+        dialog.destroy()
+        by_directory = {}
+        for directory, entry in items:
+            by_directory.setdefault(directory, []).append(entry['name'])
+        for directory, names in by_directory.items():
+            pending_changes.stage(directory, names, mode or None, owner or None)
+        update_status(f"{len(pending_changes)} changes pending")
+
+    ttk.Button(dialog, text="Stage", command=stage).grid(row=3, column=1, padx=5, pady=10, sticky=tk.E)
+
+def show_fresh_states(paths, states):
+    """Hands re-stat'ed paths to whichever view shows their directory, gone paths are dropped."""
+    by_directory = {}
+    for path in paths:
+        directory, name = posixpath.split(path)
+        entries, removed = by_directory.setdefault(directory, ([], []))
+        if path in states:
+            entries.append(states[path])
+        else:
+            removed.append(name)
+    for directory, (entries, removed) in by_directory.items():
+        update_directory_entries(directory, entries, removed)
+
+def show_pending_changes():
+    """Pending changes with a dry-run preview, journaled apply and rollback of applied batches."""
+    state = {'rows': {}}  # path -> (current state, status) from the last dry run or apply
+
+    def refresh_changes():
+        if not changes_window.winfo_exists():
+            return
+        changes_tree.delete(*changes_tree.get_children())
+        for change in list(pending_changes)[:PENDING_DISPLAY_LIMIT]:
+            current, status = state['rows'].get(change['path'], (None, ''))
+            changes_tree.insert('', 'end', iid=change['path'], values=(
+                change['path'], changes.describe_mode(current), change['mode'] or '',
+                changes.describe_owner(current), change['owner'] or '', status,
+            ))
+        status = f"{len(pending_changes)} changes pending"
+        if len(pending_changes) > PENDING_DISPLAY_LIMIT:
+            status += f" ({PENDING_DISPLAY_LIMIT} shown)"
+        changes_status_label.config(text=status)
+
+    def refresh_history():
+        if not changes_window.winfo_exists():
+            return
+        history_tree.delete(*history_tree.get_children())
+        for row in db.get_change_batches(conn):
+            history_tree.insert('', 'end', iid=row[0], values=row)
+
+    def connected():
+        if not ssh:
+            messagebox.showwarning("Connection Error", "Please connect to a server first.", parent=changes_window)
+        return ssh is not None
+
+    def dry_run():
+        staged = list(pending_changes)
+        if not staged or not connected():
+            return
+
+        def on_previewed(result):
+            rows, states = result
+            state['rows'] = {change['path']: (current, status) for change, current, status in rows}
+            refresh_changes()
+
+        run_in_background(
+            changes.preview_changes, ssh, staged,
+            on_success=on_previewed, status=f"Checking {len(staged)} changes..."
+        )
+
+    def apply():
+        staged = list(pending_changes)
+        if not staged or not connected():
+            return
+        if not messagebox.askyesno("Apply Changes", f"Apply {len(staged)} changes on {current_host}?",
+                                   parent=changes_window):
+            return
+        client, host = ssh, current_host
+
+        def on_captured(result):
+            rows, states = result
+            # The old modes and owners are journaled before anything is changed
+            batch_id = db.start_change_batch(conn, host, changes.journal_rows(staged, states))
+            refresh_history()
+            run_in_background(
+                changes.apply_changes, client, staged, states,
+                on_success=lambda result: on_applied(batch_id, states, result),
+                status=f"Applying {len(staged)} changes..."
+            )
+
+        def on_applied(batch_id, before, result):
+            statuses, after, errors = result
+            db.finish_change_batch(conn, batch_id, statuses)
+            pending_changes.unstage([path for path, status in statuses.items() if status in ('applied', 'skipped')])
+            state['rows'] = {path: (after.get(path), status) for path, status in statuses.items()}
+            if host == current_host:
+                show_fresh_states([path for path in statuses if path in before], after)
+            refresh_changes()
+            refresh_history()
+            failed = [path for path, status in statuses.items() if status in ('failed', 'missing')]
+            if failed or errors:
+                messagebox.showerror("Apply Changes", f"Batch {batch_id}: {len(failed)} changes did not apply, "
+                                     "they stay pending.\n" + (errors or '\n'.join(failed[:ERROR_SAMPLE_SIZE])))
+            else:
+                messagebox.showinfo("Apply Changes", f"Batch {batch_id}: {len(statuses)} changes applied.")
+
+        run_in_background(
+            changes.preview_changes, client, staged,
+            on_success=on_captured, status=f"Checking {len(staged)} changes..."
+        )
+
+    def remove_selected():
+        pending_changes.unstage(changes_tree.selection())
+        refresh_changes()
+
+    def clear():
+        pending_changes.clear()
+        state['rows'] = {}
+        refresh_changes()
+
+    def rollback():
+        selection = history_tree.selection()
+        if not selection:
+            messagebox.showwarning("Selection Error", "Please select a batch to roll back.", parent=changes_window)
+            return
+        batch_id = int(selection[0])
+        host, status = db.get_change_batch(conn, batch_id)
+        if host != current_host:
+            messagebox.showwarning("Rollback", f"Batch {batch_id} was applied on {host}, connect to it first.",
+                                   parent=changes_window)
+            return
+        rows = db.get_change_journal(conn, batch_id)
+        if not messagebox.askyesno("Rollback", f"Restore the old mode and owner of {len(rows)} entries "
+                                   f"changed by batch {batch_id}?", parent=changes_window):
+            return
+
+        def on_rolled_back(result):
+            restored, after, errors = result
+            db.set_change_batch_status(conn, batch_id, 'rollback failed' if errors else 'rolled back')
+            if host == current_host:
+                show_fresh_states([row[0] for row in rows], after)
+            refresh_history()
+            if errors:
+                messagebox.showerror("Rollback", f"{restored} entries restored with errors:\n{errors}")
+            else:
+                messagebox.showinfo("Rollback", f"{restored} entries restored.")
+
+        run_in_background(
+            changes.rollback_changes, ssh, rows,
+            on_success=on_rolled_back, status=f"Rolling back batch {batch_id}..."
+        )
+
+    changes_window = tk.Toplevel(root)
+    changes_window.title("Pending Changes")
+    center_window(changes_window, 1000, 700)
+
+    buttons_frame = ttk.Frame(changes_window, padding="10")
+    buttons_frame.pack(side=tk.TOP, fill=tk.X)
+    ttk.Button(buttons_frame, text="Dry Run", command=dry_run).pack(side=tk.LEFT, padx=5)
+    ttk.Button(buttons_frame, text="Apply", command=apply).pack(side=tk.LEFT, padx=5)
+    ttk.Button(buttons_frame, text="Remove Selected", command=remove_selected).pack(side=tk.LEFT, padx=5)
+    ttk.Button(buttons_frame, text="Clear", command=clear).pack(side=tk.LEFT, padx=5)
+
+    changes_status_label = ttk.Label(changes_window, text="")
+    changes_status_label.pack(side=tk.TOP, fill=tk.X, padx=10)
+
+    panes = ttk.PanedWindow(changes_window, orient=tk.VERTICAL)
+    panes.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+
+    change_columns = ('Path', 'Current Mode', 'New Mode', 'Current Owner', 'New Owner', 'Status')
+    changes_tree = ttk.Treeview(panes, columns=change_columns, show='headings')
+    for column in change_columns:
+        changes_tree.heading(column, text=column)
+        changes_tree.column(column, width=350 if column == 'Path' else 110)
+    panes.add(changes_tree, weight=3)
+
+    # Applied batches, newest first, each can be rolled back from its journal
+    history_frame = ttk.Frame(panes)
+    history_columns = ('Batch', 'Applied', 'Host', 'Status', 'Changes')
+    history_tree = ttk.Treeview(history_frame, columns=history_columns, show='headings', selectmode='browse')
+    for column in history_columns:
+        history_tree.heading(column, text=column)
+        history_tree.column(column, width=200 if column in ('Applied', 'Host') else 90)
+    history_tree.pack(side=tk.TOP, fill=tk.BOTH, expand=True)
+    ttk.Button(history_frame, text="Rollback", command=rollback).pack(side=tk.TOP, pady=(5, 0), anchor='e')
+    panes.add(history_frame, weight=1)
+
+    refresh_changes()
+    refresh_history()
+
+def snapshot_current_directory():
+    """Captures a recursive permission snapshot of the current directory next to connections.db."""
+    if not ssh:
+        messagebox.showwarning("Connection Error", "Please connect to a server first.")
+        return
+    directory = snapshot.snapshot_directory(db.DATABASE_PATH)
+    os.makedirs(directory, exist_ok=True)
+    label = current_path.strip('/').replace('/', '_') or 'root'
+    output = os.path.join(directory, f"{current_host.split('@')[-1].split(':')[0]}-{label}-{time.strftime('%Y%m%d-%H%M%S')}.snap")
+
+    def on_done(result):
+        count, errors, elapsed = result
+        messagebox.showinfo("Snapshot", f"{count} entries saved to {output} in {elapsed:.1f}s ({errors} errors).")
+
+    cancel_event = threading.Event()
+    run_in_background(
+        snapshot.take_snapshot, ssh, current_path, output, {'host': current_host}, cancel_event,
+        on_success=on_done, cancel_event=cancel_event, cancellable=True,
+        status=f"Snapshotting {current_path}..."
+    )
+
 def navigate_up():
     global current_path
     # Go up one directory level
@@ -510,7 +2069,7 @@ def show_help():
 def show_settings():
     settings_window = tk.Toplevel(root)
     settings_window.title("Settings")
-    center_window(settings_window, 300, 200)
+    center_window(settings_window, 420, 590)
 
     # Light/Dark Mode toggle
     def switch_theme():
@@ -522,55 +2081,277 @@ def show_settings():
     theme_button = ttk.Button(settings_window, text="Switch Theme", command=switch_theme)
     theme_button.pack(pady=10)
 
-# Main Window
-root = tk.Tk()
-root.title("Permissions Manager")
-root.geometry('1200x900')
-
-frame = ttk.Frame(root)
-frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
-
-# Create a container frame to add padding
-listbox_frame = ttk.Frame(frame)
-listbox_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=(0, 10))
-
-# Create the Treeview inside the container frame
-file_listbox = ttk.Treeview(listbox_frame, columns=('Name', 'Size', 'Permissions', 'Octal Permissions'), show='headings')
-file_listbox.heading('Name', text="Name")
-file_listbox.heading('Size', text="Size")
-file_listbox.heading('Permissions', text="Permissions")
-file_listbox.heading('Octal Permissions', text="Octal Permissions")
-file_listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-file_listbox.bind('<Double-1>', on_double_click)  # Bind double-click event to navigation
-
-change_permissions_button = ttk.Button(frame, text="Change Permissions", command=change_permissions)
-change_permissions_button.pack(side=tk.TOP, pady=(0, 5), anchor='w')
-
-# navigate_up_button = ttk.Button(frame, text="Up", command=navigate_up)
-# navigate_up_button.pack(side=tk.BOTTOM, pady=5)
-
-menubar = tk.Menu(root)
-root.config(menu=menubar)
-
-file_menu = tk.Menu(menubar, tearoff=0)
-menubar.add_cascade(label="File", menu=file_menu)
-file_menu.add_command(label="Manage Connections", command=manage_connections)
-file_menu.add_separator()
-file_menu.add_command(label="Exit", command=root.quit)
-
-settings_menu = tk.Menu(menubar, tearoff=0)
-menubar.add_cascade(label="Settings", menu=settings_menu)
-settings_menu.add_command(label="Settings", command=show_settings)
-
-help_menu = tk.Menu(menubar, tearoff=0)
-menubar.add_cascade(label="Help", menu=help_menu)
-help_menu.add_command(label="Help", command=show_help)
-help_menu.add_command(label="About", command=show_about)
-
-# Example of initial theme setup
-set_theme(current_theme)
-
-root.mainloop()
-
-# Close database connection on exit
-conn.close()
+    # Prefetching of subdirectory listings
+    prefetch_frame = ttk.LabelFrame(settings_window, text="Prefetch", padding="10")
+    prefetch_frame.pack(fill=tk.X, padx=10, pady=5)
+    enabled_var = tk.BooleanVar(value=prefetch_enabled)
+    ttk.Checkbutton(prefetch_frame, text="Prefetch subdirectories", variable=enabled_var).grid(
+        row=0, column=0, columnspan=2, sticky=tk.W)
+    ttk.Label(prefetch_frame, text="Depth:").grid(row=1, column=0, padx=5, pady=5, sticky=tk.W)
+    depth_spinbox = ttk.Spinbox(prefetch_frame, from_=1, to=3, width=5)
+    depth_spinbox.set(prefetch_depth)
+    depth_spinbox.grid(row=1, column=1, padx=5, pady=5, sticky=tk.W)
+    ttk.Label(prefetch_frame, text="Concurrency:").grid(row=2, column=0, padx=5, pady=5, sticky=tk.W)
+    workers_spinbox = ttk.Spinbox(prefetch_frame, from_=1, to=8, width=5)
+    workers_spinbox.set(prefetch_workers)
+    workers_spinbox.grid(row=2, column=1, padx=5, pady=5, sticky=tk.W)
+
+    def apply_prefetch():
+        configure_prefetch(enabled_var.get(), int(depth_spinbox.get()), int(workers_spinbox.get()))
+
+    ttk.Button(prefetch_frame, text="Apply", command=apply_prefetch).grid(row=3, column=1, padx=5, pady=5, sticky=tk.E)
+
+    # Authentication and key handling
+    connections_frame = ttk.LabelFrame(settings_window, text="Connections", padding="10")
+    connections_frame.pack(fill=tk.X, padx=10, pady=5)
+    agent_var = tk.BooleanVar(value=use_ssh_agent)
+    config_var = tk.BooleanVar(value=use_ssh_config)
+    helper_var = tk.BooleanVar(value=use_remote_helper)
+    ttk.Checkbutton(connections_frame, text="Use ssh-agent", variable=agent_var).grid(
+        row=0, column=0, columnspan=2, sticky=tk.W)
+    ttk.Checkbutton(connections_frame, text="Read ~/.ssh/config (aliases, ProxyJump)", variable=config_var).grid(
+        row=1, column=0, columnspan=2, sticky=tk.W)
+    ttk.Checkbutton(connections_frame, text="Use a remote python3 helper for listings", variable=helper_var).grid(
+        row=2, column=0, columnspan=2, sticky=tk.W)
+    ttk.Label(connections_frame, text="Forget keys after idle minutes (0 = never):").grid(
+        row=3, column=0, padx=5, pady=5, sticky=tk.W)
+    idle_spinbox = ttk.Spinbox(connections_frame, from_=0, to=1440, width=5)
+    idle_spinbox.set(0 if keys.key_cache.idle_timeout is None else keys.key_cache.idle_timeout // 60)
+    idle_spinbox.grid(row=3, column=1, padx=5, pady=5, sticky=tk.W)
+
+    def apply_connections():
+        global use_ssh_agent, use_ssh_config, use_remote_helper
+        use_ssh_agent, use_ssh_config = agent_var.get(), config_var.get()
+        if helper_var.get() != use_remote_helper:
+            use_remote_helper = helper_var.get()
+            if ssh and use_remote_helper:
+                run_in_background(helper.start_helper, ssh, on_error=lambda error: None, status=None)
+            elif ssh and not isinstance(ssh, local.LocalClient):
+                helper.stop_helper(ssh)
+        minutes = int(idle_spinbox.get())
+        keys.key_cache.idle_timeout = minutes * 60 if minutes else None
+
+    ttk.Button(connections_frame, text="Forget Keys", command=keys.key_cache.clear).grid(
+        row=4, column=0, padx=5, pady=5, sticky=tk.W)
+    ttk.Button(connections_frame, text="Apply", command=apply_connections).grid(
+        row=4, column=1, padx=5, pady=5, sticky=tk.E)
+
+    # Listing cache counters, refreshed while the window is open
+    cache_label = ttk.Label(settings_window, text="", justify=tk.LEFT)
+    cache_label.pack(fill=tk.X, padx=10, pady=5)
+
+    def update_cache_stats():
+        if not settings_window.winfo_exists():
+            return
+        stats = listing_cache.stats()
+        cache_label.config(text=(
+            f"Cached listings: {stats['items']} ({stats['bytes'] / 1048576:.1f} MiB)\n"
+            f"Hits: {stats['hits']} (prefetched: {stats['prefetch_hits']}), misses: {stats['misses']}\n"
+            f"Hit rate: {stats['hit_rate']:.0%}, evictions: {stats['evictions']}"
+        ))
+        settings_window.after(1000, update_cache_stats)
+
+    update_cache_stats()
+
+def show_diagnostics():
+    """Latency histograms, channels per user action and bytes on the wire, refreshed live."""
+    diagnostics_window = tk.Toplevel(root)
+    diagnostics_window.title("Diagnostics")
+    center_window(diagnostics_window, 800, 600)
+
+    totals_label = ttk.Label(diagnostics_window, text="", padding="10")
+    totals_label.pack(side=tk.TOP, fill=tk.X)
+
+    panes = ttk.PanedWindow(diagnostics_window, orient=tk.VERTICAL)
+    panes.pack(fill=tk.BOTH, expand=True, padx=10)
+
+    operation_columns = ('Operation', 'Count', 'Mean (ms)', 'p50 (ms)', 'p95 (ms)', 'Max (ms)')
+    operations_tree = ttk.Treeview(panes, columns=operation_columns, show='headings')
+    for column in operation_columns:
+        operations_tree.heading(column, text=column)
+        operations_tree.column(column, width=220 if column == 'Operation' else 90)
+    panes.add(operations_tree, weight=2)
+
+    action_columns = ('Action', 'Count', 'Channels', 'Channels per action')
+    actions_tree = ttk.Treeview(panes, columns=action_columns, show='headings')
+    for column in action_columns:
+        actions_tree.heading(column, text=column)
+    panes.add(actions_tree, weight=1)
+
+    def refresh():
+        if not diagnostics_window.winfo_exists():
+            return
+        stats = instrumentation.recorder.snapshot()
+        totals_label.config(text=(
+            f"SSH channels opened: {stats['channels']}    "
+            f"Received: {stats['bytes_in'] / 1024:.1f} KiB    Sent: {stats['bytes_out'] / 1024:.1f} KiB    "
+            f"Trace events: {stats['trace_events']}"
+        ))
+        operations_tree.delete(*operations_tree.get_children())
+        for name, summary in sorted(stats['operations'].items(), key=lambda item: -item[1]['count'] * item[1]['mean_ms']):
+            operations_tree.insert('', 'end', values=(
+                name, summary['count'], f"{summary['mean_ms']:.2f}", f"{summary['p50_ms']:g}",
+                f"{summary['p95_ms']:g}", f"{summary['max_ms']:.2f}",
+            ))
+        actions_tree.delete(*actions_tree.get_children())
+        for name, counts in sorted(stats['actions'].items()):
+            per_action = counts['channels'] / counts['count'] if counts['count'] else counts['channels']
+            actions_tree.insert('', 'end', values=(name, counts['count'], counts['channels'], f"{per_action:.1f}"))
+        diagnostics_window.after(1000, refresh)
+
+    def export_trace():
+        path = filedialog.asksaveasfilename(
+            parent=diagnostics_window, title="Export Trace", defaultextension='.json',
+            initialfile=f"permissions-manager-trace-{time.strftime('%Y%m%d-%H%M%S')}.json",
+            filetypes=[("Chrome trace", '*.json')]
+        )
+        if path:
+            count = instrumentation.recorder.export_trace(path)
+            messagebox.showinfo("Export Trace", f"{count} events written to {path}.\n"
+                                "Open it in chrome://tracing or ui.perfetto.dev.", parent=diagnostics_window)
+
+    buttons_frame = ttk.Frame(diagnostics_window, padding="10")
+    buttons_frame.pack(side=tk.BOTTOM, fill=tk.X)
+    ttk.Button(buttons_frame, text="Export Trace", command=export_trace).pack(side=tk.LEFT, padx=5)
+    ttk.Button(buttons_frame, text="Reset", command=instrumentation.recorder.reset).pack(side=tk.LEFT, padx=5)
+
+    refresh()
+
+if __name__ == '__main__':
+    # SQLite Database setup
+    conn = db.open_database()
+    cursor = conn.cursor()
+
+    # Load saved theme
+    cursor.execute("SELECT theme FROM settings WHERE id = 1")
+    row = cursor.fetchone()
+    current_theme = row[0] if row else 'light'
+
+    # Main Window
+    root = tk.Tk()
+    root.title("Permissions Manager")
+    root.geometry('1200x900')
+
+    frame = ttk.Frame(root)
+    frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+
+    # Create a container frame to add padding
+    listbox_frame = ttk.Frame(frame)
+    listbox_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=(0, 10))
+
+    # Filter box, matched against names in memory (substring or glob)
+    filter_frame = ttk.Frame(listbox_frame)
+    filter_frame.pack(side=tk.TOP, fill=tk.X, pady=(0, 5))
+    ttk.Label(filter_frame, text="Filter:").pack(side=tk.LEFT, padx=(0, 5))
+    filter_var = tk.StringVar()
+    filter_var.trace_add('write', lambda *args: apply_view())
+    ttk.Entry(filter_frame, textvariable=filter_var).pack(side=tk.LEFT, fill=tk.X, expand=True)
+
+    # The scrollbar spans view_entries, not the Treeview items
+    view_scrollbar = ttk.Scrollbar(listbox_frame, orient=tk.VERTICAL, command=on_view_scroll)
+    view_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+    # Create the Treeview inside the container frame
+    file_listbox = ttk.Treeview(listbox_frame, columns=tuple(SORT_KEYS), show='headings')
+    for column in SORT_KEYS:
+        file_listbox.heading(column, text=column, command=lambda column=column: sort_view(column))
+        file_listbox.column(column, width=200 if column in ('Name', 'ACL') else 90)
+    # The tree column stands in for Name in tree mode
+    file_listbox.heading('#0', text='Name', command=lambda: sort_view('Name'))
+    file_listbox.column('#0', width=280)
+    file_listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+    file_listbox.bind('<Double-1>', on_double_click)  # Bind double-click event to navigation
+    file_listbox.bind('<Button-1>', on_row_click)
+    file_listbox.bind('<<TreeviewSelect>>', on_select)
+    file_listbox.bind('<MouseWheel>', on_mouse_wheel)
+    file_listbox.bind('<Button-4>', on_mouse_wheel)
+    file_listbox.bind('<Button-5>', on_mouse_wheel)
+    file_listbox.bind('<Up>', lambda event: on_arrow_key(event, -1))
+    file_listbox.bind('<Down>', lambda event: on_arrow_key(event, 1))
+    file_listbox.bind('<Configure>', lambda event: schedule_render())
+    file_listbox.bind('<<TreeviewOpen>>', on_tree_open)
+    file_listbox.bind('<<TreeviewClose>>', on_tree_close)
+
+    change_permissions_button = ttk.Button(frame, text="Change Permissions", command=change_permissions)
+    change_permissions_button.pack(side=tk.TOP, pady=(0, 5), anchor='w')
+
+    stage_changes_button = ttk.Button(frame, text="Stage Changes", command=stage_changes)
+    stage_changes_button.pack(side=tk.TOP, pady=(0, 5), anchor='w')
+
+    pending_changes_button = ttk.Button(frame, text="Pending Changes", command=show_pending_changes)
+    pending_changes_button.pack(side=tk.TOP, pady=(0, 5), anchor='w')
+
+    recursive_permissions_button = ttk.Button(frame, text="Recursive Permissions", command=change_permissions_recursive)
+    recursive_permissions_button.pack(side=tk.TOP, pady=(0, 5), anchor='w')
+
+    edit_acl_button = ttk.Button(frame, text="Edit ACL", command=edit_acl)
+    edit_acl_button.pack(side=tk.TOP, pady=(0, 5), anchor='w')
+
+    expand_subtree_button = ttk.Button(frame, text="Expand Subtree", command=expand_subtree)
+    expand_subtree_button.pack(side=tk.TOP, pady=(0, 5), anchor='w')
+
+    # Progress indicator for background operations
+    progress_bar = ttk.Progressbar(frame, mode='indeterminate', length=150)
+    progress_bar.pack(side=tk.TOP, pady=(10, 5), anchor='w')
+    status_label = ttk.Label(frame, text="", wraplength=150)
+    status_label.pack(side=tk.TOP, pady=(0, 5), anchor='w')
+    cancel_button = ttk.Button(frame, text="Cancel", command=cancel_operation)
+    cancel_button.pack(side=tk.TOP, pady=(0, 5), anchor='w')
+    cancel_button.state(['disabled'])
+
+    # Hierarchical view whose directories are listed when expanded
+    tree_var = tk.BooleanVar(value=False)
+    ttk.Checkbutton(frame, text="Tree view", variable=tree_var, command=set_tree_mode).pack(
+        side=tk.TOP, pady=(10, 0), anchor='w')
+
+    # Live updates from a remote inotifywait (or a polling fallback) instead of periodic refreshes
+    watch_var = tk.BooleanVar(value=False)
+    watch_recursive_var = tk.BooleanVar(value=False)
+    ttk.Checkbutton(frame, text="Watch for changes", variable=watch_var, command=toggle_watch).pack(
+        side=tk.TOP, pady=(10, 0), anchor='w')
+    ttk.Checkbutton(frame, text="Include subdirectories", variable=watch_recursive_var,
+                    command=lambda: watch_var.get() and start_watch()).pack(side=tk.TOP, pady=(0, 5), anchor='w')
+
+    # navigate_up_button = ttk.Button(frame, text="Up", command=navigate_up)
+    # navigate_up_button.pack(side=tk.BOTTOM, pady=5)
+
+    menubar = tk.Menu(root)
+    root.config(menu=menubar)
+
+    file_menu = tk.Menu(menubar, tearoff=0)
+    menubar.add_cascade(label="File", menu=file_menu)
+    file_menu.add_command(label="Manage Connections", command=manage_connections)
+    file_menu.add_command(label="Open Local Filesystem", command=open_local)
+    file_menu.add_command(label="Audit Hosts", command=audit_hosts)
+    file_menu.add_command(label="Search Permissions", command=search_permissions)
+    file_menu.add_command(label="Pending Changes", command=show_pending_changes)
+    file_menu.add_command(label="Snapshot Current Directory", command=snapshot_current_directory)
+    file_menu.add_separator()
+    file_menu.add_command(label="Exit", command=root.quit)
+
+    settings_menu = tk.Menu(menubar, tearoff=0)
+    menubar.add_cascade(label="Settings", menu=settings_menu)
+    settings_menu.add_command(label="Settings", command=show_settings)
+    settings_menu.add_command(label="Diagnostics", command=show_diagnostics)
+
+    help_menu = tk.Menu(menubar, tearoff=0)
+    menubar.add_cascade(label="Help", menu=help_menu)
+    help_menu.add_command(label="Help", command=show_help)
+    help_menu.add_command(label="About", command=show_about)
+
+    # Example of initial theme setup
+    set_theme(current_theme)
+
+    root.after(UI_POLL_MS, process_ui_queue)
+    root.after(AUTO_REFRESH_MS, auto_refresh)
+    root.mainloop()
+
+    # Abandon pending remote work and close database connection on exit
+    for session in connection_pool.values():
+        close_session(session)
+    if ssh and not any(session['ssh'] is ssh for session in connection_pool.values()):
+        close_session({'ssh': ssh, 'sftp': sftp})
+    stop_watch()
+    executor.shutdown(wait=False, cancel_futures=True)
+    prefetch_executor.shutdown(wait=False, cancel_futures=True)
+    conn.close()
@@ -0,0 +1,8 @@
+"""Permissions Manager, manage GNU/Linux file permissions over SSH.
+
+The Tk application lives in main.py, the reusable pieces live here:
+core for SSH, listing and chmod, db for the connections.db schema, and a
+command line interface run with `python -m permissions_manager`.
+"""
+
+__version__ = '1.0'
@@ -0,0 +1,474 @@
+"""Headless command line interface, run with `python -m permissions_manager`.
+
+Every command prints JSON on stdout. Imports are kept lazy so that `--help` and argument
+errors never pay for paramiko, and nothing here needs a display.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+from permissions_manager import changes, core, helper, instrumentation, local
+
+
+PASSWORD_VARIABLE = 'PERMISSIONS_MANAGER_PASSWORD'
+PASSPHRASE_VARIABLE = 'PERMISSIONS_MANAGER_PASSPHRASE'
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m permissions_manager', description=__doc__.splitlines()[0])
+    parser.add_argument('--db', default=None, help="connections database (default: connections.db)")
+    parser.add_argument('--trace', metavar='FILE', help="write a Chrome trace of the remote calls to FILE")
+    target = parser.add_argument_group('connection')
+    target.add_argument('-c', '--connection', type=int, help="id of a saved connection")
+    target.add_argument('--host', help="host to connect to instead of a saved connection")
+    target.add_argument('--port', type=int, default=22)
+    target.add_argument('--user', help="user name, defaults to ~/.ssh/config or the local user")
+    target.add_argument('--key', help="private key file")
+    target.add_argument('--password', help=f"password, prefer the {PASSWORD_VARIABLE} environment variable")
+    target.add_argument('--no-ssh-config', action='store_true', help="ignore ~/.ssh/config (aliases, ProxyJump)")
+    target.add_argument('--no-agent', action='store_true', help="do not offer ssh-agent keys")
+    target.add_argument('--local', action='store_true', help="manage the local filesystem instead of a host")
+    target.add_argument('--helper', action='store_true',
+                        help="run listings, stats and chmods through a persistent python3 helper on the host")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    list_parser = commands.add_parser('list', help="list a directory with its permissions")
+    list_parser.add_argument('path')
+    list_parser.add_argument('--acl', action='store_true', help="include ACL entries and file capabilities")
+
+    chmod_parser = commands.add_parser('chmod', help="change permissions of one or more paths")
+    chmod_parser.add_argument('-R', '--recursive', action='store_true',
+                              help="apply MODE to files and --dir-mode to directories under each path")
+    chmod_parser.add_argument('--dir-mode', help="directory mode for --recursive (default: MODE)")
+    chmod_parser.add_argument('mode')
+    chmod_parser.add_argument('paths', nargs='+')
+
+    apply_parser = commands.add_parser('apply', help="change mode and/or owner of paths as one journaled batch "
+                                                     "that can be rolled back")
+    apply_parser.add_argument('--mode', help="octal or symbolic mode")
+    apply_parser.add_argument('--owner', help="user, user:group or :group")
+    apply_parser.add_argument('--dry-run', action='store_true', help="only show the current and new values")
+    apply_parser.add_argument('paths', nargs='+')
+
+    journal_parser = commands.add_parser('journal', help="list applied batches, or the entries of one batch")
+    journal_parser.add_argument('batch', type=int, nargs='?')
+
+    rollback_parser = commands.add_parser('rollback', help="restore the old mode and owner of a journaled batch")
+    rollback_parser.add_argument('batch', type=int)
+
+    import_parser = commands.add_parser('import', help="save the hosts of an inventory as connections, skipping known ones")
+    import_parser.add_argument('format', choices=('ssh_config', 'csv', 'ansible'))
+    import_parser.add_argument('path', nargs='?', help="inventory file (default for ssh_config: ~/.ssh/config)")
+
+    connections_parser = commands.add_parser('connections', help="list saved connections matching a search")
+    connections_parser.add_argument('search', nargs='?', default='')
+    connections_parser.add_argument('--limit', type=int, default=200)
+    connections_parser.add_argument('--offset', type=int, default=0)
+
+    audit_parser = commands.add_parser('audit', help="audit saved connections for risky permissions")
+    audit_parser.add_argument('--ids', type=int, nargs='*', default=[], help="connection ids (default: all)")
+    audit_parser.add_argument('--roots', nargs='+', default=['/'])
+    audit_parser.add_argument('--workers', type=int, default=16)
+
+    snapshot_parser = commands.add_parser('snapshot', help="capture a recursive permission snapshot of a root")
+    snapshot_parser.add_argument('root')
+    snapshot_parser.add_argument('-o', '--output', help="snapshot file (default: snapshots/ next to the database)")
+
+    diff_parser = commands.add_parser('diff', help="compare two snapshots, one JSON object per line")
+    diff_parser.add_argument('old')
+    diff_parser.add_argument('new')
+    diff_parser.add_argument('--restore', action='store_true',
+                             help="print the chmod/chown commands that restore OLD instead of the differences")
+
+    setfacl_parser = commands.add_parser('setfacl', help="modify or remove ACL entries of one or more paths")
+    acl_operation = setfacl_parser.add_mutually_exclusive_group(required=True)
+    acl_operation.add_argument('-m', '--modify', metavar='SPEC', help="add or change entries, e.g. u:alice:rwX")
+    acl_operation.add_argument('-x', '--remove', metavar='SPEC', help="remove entries, e.g. u:alice")
+    acl_operation.add_argument('-b', '--remove-all', action='store_true', help="remove all extended entries")
+    setfacl_parser.add_argument('-R', '--recursive', action='store_true')
+    setfacl_parser.add_argument('paths', nargs='+')
+
+    search_parser = commands.add_parser('search', help="find entries by permission attributes on the server, "
+                                                       "one JSON object per line")
+    search_parser.add_argument('root')
+    search_parser.add_argument('--mode', help="find -perm syntax: 777 exact, -002 all bits set, /6000 any bit set")
+    search_parser.add_argument('--owner', help="user name or uid")
+    search_parser.add_argument('--group', help="group name or gid")
+    search_parser.add_argument('--type', choices=list(core.SEARCH_TYPES), help="find -type letter")
+    search_parser.add_argument('--name', help="name glob, e.g. '*.conf'")
+    search_parser.add_argument('--newer', help="modified after YYYY-MM-DD[ HH:MM]")
+    search_parser.add_argument('--older', help="modified before YYYY-MM-DD[ HH:MM]")
+    search_parser.add_argument('--limit', type=int, default=core.SEARCH_LIMIT)
+
+    watch_parser = commands.add_parser('watch', help="stream changes under a directory, one JSON object per line")
+    watch_parser.add_argument('path')
+    watch_parser.add_argument('-r', '--recursive', action='store_true', help="include subdirectories")
+    watch_parser.add_argument('--interval', type=int, default=core.WATCH_INTERVAL_SECONDS,
+                              help="scan interval when the server has no inotifywait")
+    return parser
+
+def open_database(args):
+    from permissions_manager import db
+    return db.open_database(args.db or db.DATABASE_PATH)
+
+def connection_details(args):
+    """Resolves the connection options to (host, port, username, password, key_file)."""
+    if args.local:
+        return local.LOCAL_HOST_KEY, None, None, None, None
+    if args.connection is not None:
+        from permissions_manager import db
+        conn = open_database(args)
+        try:
+            row = db.get_connection_details(conn, args.connection)
+        finally:
+            conn.close()
+        if row is None:
+            raise SystemExit(f"No saved connection with id {args.connection}.")
+        return row
+    if not args.host:
+        raise SystemExit("Either --connection or --host is required.")
+    username = args.user  # Resolved through ~/.ssh/config, then the local user
+    password = args.password or os.environ.get(PASSWORD_VARIABLE)
+    return args.host, args.port, username, password, args.key
+
+def connect(args):
+    if args.local:
+        return local.LocalClient(), None
+    host, port, username, password, key_file = connection_details(args)
+    client, sftp_client = core.connect_target(host, port, username, password, key_file,
+                                              os.environ.get(PASSPHRASE_VARIABLE),
+                                              use_config=not args.no_ssh_config, allow_agent=not args.no_agent)
+    if args.helper and helper.start_helper(client) is None:
+        print("python3 is not available on the host, falling back to exec and SFTP.", file=sys.stderr)
+    return client, sftp_client
+
+def host_key(args):
+    """user@host:port of the target, the key change batches are journaled under."""
+    if args.local:
+        return local.LOCAL_HOST_KEY
+    host, port, username, password, key_file = connection_details(args)
+    return core.resolve_target(host, port, username, key_file, not args.no_ssh_config)[-1]['key']
+
+def entry_to_json(entry):
+    return {
+        'name': entry['name'],
+        'size': entry['size'],
+        'type': entry['type'],
+        'permissions': core.stat.filemode(entry['mode']),
+        'mode': core.get_octal_permissions(entry['mode']),
+        'owner': entry['owner'],
+        'group': entry['group'],
+    }
+
+def group_by_directory(paths):
+    """Groups paths by parent directory so each directory costs one remote command, not one per path."""
+    by_directory = {}
+    for path in paths:
+        directory, name = os.path.split(path.rstrip('/') or '/')
+        by_directory.setdefault(directory or '.', []).append(name)
+    return by_directory
+
+def command_list(args):
+    client, sftp_client = connect(args)
+    try:
+        entries, errors, mtime = core.list_directory(client, sftp_client, args.path)
+        if args.acl:
+            acls, capabilities = core.fetch_extended_attributes(client, args.path)
+    finally:
+        client.close()
+    records = [entry_to_json(entry) for entry in entries]
+    if args.acl:
+        for record in records:
+            record['acl'] = None if acls is None else acls.get(record['name'], [])
+            record['capabilities'] = None if capabilities is None else capabilities.get(record['name'], '')
+    return {'path': args.path, 'entries': records, 'errors': errors}, bool(errors)
+
+def command_chmod(args):
+    modes = [args.mode] + ([args.dir_mode] if args.dir_mode else [])
+    for mode in modes:
+        if not core.MODE_PATTERN.match(mode):
+            raise SystemExit(f"Invalid permissions: {mode}")
+
+    client, sftp_client = connect(args)
+    results = []
+    failed = False
+    try:
+        if args.recursive:
+            for path in args.paths:
+                processed, errors, error_sample, exit_status, elapsed = core.chmod_recursive(
+                    client, path, args.mode, args.dir_mode or args.mode
+                )
+                failed = failed or bool(errors) or exit_status != 0
+                results.append({'path': path, 'processed': processed, 'errors': errors,
+                                'error_sample': error_sample, 'elapsed': round(elapsed, 3)})
+        else:
+            # One remote command per directory (and ARG_MAX chunk), not one per path
+            for directory, names in group_by_directory(args.paths).items():
+                entries, errors, exit_status = core.chmod_entries(client, directory, args.mode, names)
+                failed = failed or exit_status != 0
+                results.append({'directory': directory, 'entries': [entry_to_json(entry) for entry in entries],
+                                'errors': errors})
+    finally:
+        client.close()
+    return results, failed
+
+def change_to_json(change, state, status):
+    return {
+        'path': change['path'],
+        'mode': changes.describe_mode(state),
+        'new_mode': change['mode'],
+        'owner': changes.describe_owner(state),
+        'new_owner': change['owner'],
+        'status': status,
+    }
+
+def command_apply(args):
+    from permissions_manager import db
+
+    if not args.mode and not args.owner:
+        raise SystemExit("Either --mode or --owner is required.")
+    if args.mode and not core.MODE_PATTERN.match(args.mode):
+        raise SystemExit(f"Invalid permissions: {args.mode}")
+    if args.owner:
+        changes.validate_owner(args.owner)
+    pending = changes.PendingChanges()
+    for directory, names in group_by_directory(args.paths).items():
+        pending.stage(directory, names, args.mode, args.owner)
+    staged = list(pending)
+
+    client, sftp_client = connect(args)
+    try:
+        rows, states = changes.preview_changes(client, staged)
+        if args.dry_run:
+            return [change_to_json(*row) for row in rows], False
+        conn = open_database(args)
+        try:
+            # The old modes and owners are journaled before anything is changed
+            batch_id = db.start_change_batch(conn, host_key(args), changes.journal_rows(staged, states))
+            statuses, after, errors = changes.apply_changes(client, staged, states)
+            db.finish_change_batch(conn, batch_id, statuses)
+        finally:
+            conn.close()
+    finally:
+        client.close()
+    results = [change_to_json(change, after.get(change['path']), statuses[change['path']]) for change in staged]
+    failed = any(result['status'] in ('failed', 'missing') for result in results)
+    return {'batch': batch_id, 'changes': results, 'errors': errors}, failed or bool(errors)
+
+def command_journal(args):
+    from permissions_manager import db
+
+    conn = open_database(args)
+    try:
+        if args.batch is None:
+            batches = db.get_change_batches(conn)
+            return [{'batch': row[0], 'created_at': row[1], 'host': row[2], 'status': row[3], 'changes': row[4]}
+                    for row in batches], False
+        rows = db.get_change_journal(conn, args.batch)
+    finally:
+        conn.close()
+    return [{'path': path, 'old_mode': format(core.stat.S_IMODE(mode), '04o'), 'old_uid': uid, 'old_gid': gid}
+            for path, mode, uid, gid in rows], False
+
+def command_rollback(args):
+    from permissions_manager import db
+
+    conn = open_database(args)
+    try:
+        batch = db.get_change_batch(conn, args.batch)
+        if batch is None:
+            raise SystemExit(f"No change batch with id {args.batch}.")
+        if batch[0] != host_key(args):
+            raise SystemExit(f"Batch {args.batch} was applied on {batch[0]}.")
+        rows = db.get_change_journal(conn, args.batch)
+        client, sftp_client = connect(args)
+        try:
+            restored, after, errors = changes.rollback_changes(client, rows)
+        finally:
+            client.close()
+        db.set_change_batch_status(conn, args.batch, 'rollback failed' if errors else 'rolled back')
+    finally:
+        conn.close()
+    return {'batch': args.batch, 'restored': restored, 'errors': errors}, bool(errors)
+
+def command_import(args):
+    from permissions_manager import db, inventory
+
+    if args.format != 'ssh_config' and not args.path:
+        raise SystemExit(f"A path is required for {args.format} inventories.")
+    conn = open_database(args)
+    try:
+        added, skipped = db.import_connections(conn, inventory.read_inventory(args.path, args.format))
+    finally:
+        conn.close()
+    return {'added': added, 'skipped': skipped}, False
+
+def command_connections(args):
+    from permissions_manager import db
+
+    conn = open_database(args)
+    try:
+        total = db.count_connections(conn, args.search)
+        rows = db.search_connections(conn, args.search, args.limit, args.offset)
+    finally:
+        conn.close()
+    return {'total': total, 'connections': [
+        {'id': conn_id, 'host': host, 'port': port, 'username': username} for conn_id, host, port, username in rows
+    ]}, False
+
+def command_audit(args):
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    from permissions_manager import db
+
+    conn = open_database(args)
+    try:
+        rows = db.get_connection_rows(conn, args.ids)
+        run_id = db.start_audit_run(conn, args.roots, len(rows))
+        hosts = []
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            futures = {executor.submit(core.audit_host, row, args.roots, None, None, not args.no_ssh_config,
+                                       not args.no_agent): row for row in rows}
+            # sqlite stays on this thread, workers only scan
+            for future in as_completed(futures):
+                row = futures[future]
+                try:
+                    findings = future.result()
+                    error = None
+                except Exception as e:
+                    findings = [('error', '', '', str(e) or type(e).__name__)]
+                    error = findings[0][3]
+                db.record_audit_findings(conn, run_id, row[0], row[1], findings)
+                hosts.append({'id': row[0], 'host': row[1], 'findings': len(findings) if not error else 0,
+                              'error': error})
+    finally:
+        conn.close()
+    return {'run_id': run_id, 'hosts': hosts}, any(host['error'] for host in hosts)
+
+def command_snapshot(args):
+    from permissions_manager import db, snapshot
+
+    host, port, username, password, key_file = connection_details(args)
+    output = args.output
+    if not output:
+        directory = snapshot.snapshot_directory(args.db or db.DATABASE_PATH)
+        os.makedirs(directory, exist_ok=True)
+        label = args.root.strip('/').replace('/', '_') or 'root'
+        output = os.path.join(directory, f"{host}-{label}-{time.strftime('%Y%m%d-%H%M%S')}.snap")
+
+    client, sftp_client = connect(args)
+    try:
+        count, errors, elapsed = snapshot.take_snapshot(
+            client, args.root, output, {'host': host, 'port': port, 'username': username}
+        )
+    finally:
+        client.close()
+    return {'file': output, 'entries': count, 'errors': errors, 'elapsed': round(elapsed, 3)}, False
+
+def command_diff(args):
+    from permissions_manager import snapshot
+
+    differences = snapshot.diff_snapshots(snapshot.read_snapshot(args.old), snapshot.read_snapshot(args.new))
+    output = sys.stdout.buffer
+    if args.restore:
+        root = snapshot.read_snapshot_metadata(args.new)['root']
+        for command in snapshot.restore_commands(root, differences):
+            output.write(command.encode(errors='surrogateescape') + b'\n')
+        return None, False
+
+    # Streamed as JSON lines so millions of differences never sit in memory
+    for change, name, old, new in differences:
+        record = {'change': change, 'path': name.decode(errors='replace')}
+        for label, values in (('old', old), ('new', new)):
+            if values:
+                record[label] = {'mode': format(values[1], '04o'), 'uid': values[2], 'gid': values[3],
+                                 'type': values[4].decode(), 'mtime': values[5]}
+        output.write(json.dumps(record).encode() + b'\n')
+    return None, False
+
+def command_setfacl(args):
+    if args.modify:
+        operation, spec = 'modify', args.modify
+    elif args.remove:
+        operation, spec = 'remove', args.remove
+    else:
+        operation, spec = 'remove-all', ''
+
+    client, sftp_client = connect(args)
+    results = []
+    try:
+        for directory, names in group_by_directory(args.paths).items():
+            errors, exit_status = core.setfacl_entries(client, directory, operation, spec, names, args.recursive)
+            acls, capabilities = core.fetch_extended_attributes(client, directory, names)
+            results.append({'directory': directory, 'errors': errors, 'exit_status': exit_status,
+                            'acl': None if acls is None else {name: acls.get(name, []) for name in names}})
+    finally:
+        client.close()
+    return results, any(result['exit_status'] for result in results)
+
+def command_search(args):
+    query = {key: getattr(args, key) for key in ('mode', 'owner', 'group', 'type', 'name', 'newer', 'older')}
+    core.build_search_command(args.root, query)  # Reject bad input before connecting
+
+    def on_results(batch):
+        for result in batch:
+            print(json.dumps(dict(result, mode=format(result['mode'], '04o'))))
+        sys.stdout.flush()
+
+    client, sftp_client = connect(args)
+    try:
+        count, errors, truncated = core.search_tree(client, args.root, query, on_results, args.limit)
+    finally:
+        client.close()
+    print(json.dumps({'matches': count, 'errors': errors, 'truncated': truncated}), file=sys.stderr)
+    return None, False
+
+def command_watch(args):
+    def on_changes(method, paths):
+        print(json.dumps({'method': method, 'paths': paths}), flush=True)
+
+    client, sftp_client = connect(args)
+    try:
+        core.watch_directory(client, args.path, on_changes, args.recursive, args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        client.close()
+    return None, False
+
+COMMANDS = {
+    'list': command_list,
+    'chmod': command_chmod,
+    'apply': command_apply,
+    'journal': command_journal,
+    'rollback': command_rollback,
+    'import': command_import,
+    'connections': command_connections,
+    'audit': command_audit,
+    'snapshot': command_snapshot,
+    'diff': command_diff,
+    'setfacl': command_setfacl,
+    'search': command_search,
+    'watch': command_watch,
+}
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        with instrumentation.action(args.command):
+            result, failed = COMMANDS[args.command](args)
+    except core.TaskCancelled:
+        return 130
+    except Exception as e:
+        print(json.dumps({'error': str(e)}), file=sys.stderr)
+        return 1
+    finally:
+        if args.trace:
+            instrumentation.recorder.export_trace(args.trace)
+    if result is not None:
+        json.dump(result, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
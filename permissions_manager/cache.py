@@ -0,0 +1,83 @@
+"""Bounded LRU cache for directory listings."""
+import time
+from collections import OrderedDict
+
+
+# Rough per-entry footprint of a listing entry dictionary, on top of its name
+ENTRY_OVERHEAD_BYTES = 400
+
+def estimate_listing_size(entries):
+    return sum(ENTRY_OVERHEAD_BYTES + len(entry['name']) for entry in entries)
+
+class ListingCache:
+    """Least recently used cache of listings keyed by (host, path), capped by an estimated memory
+    size and expiring items whose last check is older than ttl seconds.
+    Items are dictionaries holding at least 'entries' and 'checked_at'. Hit, miss and eviction
+    counters are kept for tuning. Not thread-safe, use it from one thread only."""
+
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.items = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.prefetch_hits = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def keys(self):
+        return list(self.items)
+
+    def peek(self, key):
+        """Returns a live item without touching counters or the LRU order."""
+        item = self.items.get(key)
+        if item is not None and time.time() - item['checked_at'] > self.ttl:
+            self.pop(key)
+            return None
+        return item
+
+    def get(self, key):
+        item = self.peek(key)
+        if item is None:
+            self.misses += 1
+            return None
+        self.items.move_to_end(key)
+        self.hits += 1
+        if item.pop('prefetched', False):
+            self.prefetch_hits += 1
+        return item
+
+    def put(self, key, item, prefetched=False):
+        self.pop(key)
+        item.setdefault('checked_at', time.time())
+        item['size'] = estimate_listing_size(item['entries'])
+        if prefetched:
+            item['prefetched'] = True
+        self.items[key] = item
+        self.size += item['size']
+        while self.size > self.max_bytes and len(self.items) > 1:
+            evicted_key, evicted = self.items.popitem(last=False)
+            self.size -= evicted['size']
+            self.evictions += 1
+
+    def pop(self, key, default=None):
+        item = self.items.pop(key, None)
+        if item is None:
+            return default
+        self.size -= item['size']
+        return item
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'items': len(self.items),
+            'bytes': self.size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'prefetch_hits': self.prefetch_hits,
+            'evictions': self.evictions,
+        }
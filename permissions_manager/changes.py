@@ -0,0 +1,237 @@
+"""Pending permission changes: staging, dry-run preview, batched apply and rollback.
+
+Mode and ownership edits are staged per path, across any number of directories. Applying them
+costs three remote round-trips whatever their number: one stat of every target, whose old mode
+and owner the caller writes to the change journal before anything is touched, the chown/chmod
+commands coalesced per directory and target value and packed into as few remote commands as the
+size limit allows, and a final stat that tells which changes took. A journaled batch is rolled
+back the same way. Nothing in here touches sqlite, callers keep the database on their own thread.
+"""
+import re
+import stat
+import shlex
+import posixpath
+from collections import OrderedDict
+
+from permissions_manager.core import (
+    COMMAND_SIZE_LIMIT, chunk_arguments, get_file_type, get_octal_permissions, run_remote_command,
+)
+from permissions_manager.instrumentation import timed
+from permissions_manager.snapshot import restore_commands
+
+
+# Full path, size, raw mode, owner and group names and numeric ids, all NUL-terminated
+STAT_FORMAT = '%n\\0%s\\0%f\\0%U\\0%G\\0%u\\0%g\\0'
+STAT_FIELDS = 7
+
+# user, user:group or :group, names or numeric ids
+OWNER_PATTERN = re.compile(r'^([A-Za-z0-9_][A-Za-z0-9_.-]*\$?)?(:[A-Za-z0-9_][A-Za-z0-9_.-]*)?$')
+
+class PendingChanges:
+    """Staged changes keyed by path, in staging order. Each change is a dictionary with 'path',
+    'directory', 'name', 'mode' and 'owner', where an unset mode or owner is None. Staging a path
+    again merges into its change, so the queue holds at most one change per path."""
+
+    def __init__(self):
+        self.changes = OrderedDict()
+
+    def __len__(self):
+        return len(self.changes)
+
+    def __iter__(self):
+        return iter(list(self.changes.values()))
+
+    def stage(self, directory, names, mode=None, owner=None):
+        for name in names:
+            path = posixpath.join(directory, name)
+            change = self.changes.setdefault(path, {
+                'path': path, 'directory': directory, 'name': name, 'mode': None, 'owner': None,
+            })
+            if mode:
+                change['mode'] = mode
+            if owner:
+                change['owner'] = owner
+
+    def unstage(self, paths):
+        for path in paths:
+            self.changes.pop(path, None)
+
+    def clear(self):
+        self.changes.clear()
+
+def validate_owner(owner):
+    if not owner or not OWNER_PATTERN.match(owner):
+        raise ValueError(f"Invalid owner: {owner}")
+
+def parse_stat_output(output):
+    """Parses STAT_FORMAT records into {path: entry}, entries carry 'uid' and 'gid' as well."""
+    fields = output.split(b'\0')
+    states = {}
+    for i in range(0, len(fields) - STAT_FIELDS + 1, STAT_FIELDS):
+        path, size, raw_mode, owner, group, uid, gid = fields[i:i + STAT_FIELDS]
+        path = path.decode(errors='surrogateescape')
+        mode = int(raw_mode, 16)
+        states[path] = {
+            'name': posixpath.basename(path),
+            'size': int(size),
+            'mode': mode,
+            'owner': owner.decode(errors='replace'),
+            'group': group.decode(errors='replace'),
+            'type': get_file_type(mode),
+            'uid': int(uid),
+            'gid': int(gid),
+        }
+    return states
+
+@timed('stat_paths')
+def stat_paths(client, paths, cancel_event=None):
+    """Stats absolute paths of any directories, one remote command per chunk. Paths that do not
+    exist are missing from the result."""
+    states = {}
+    for chunk in chunk_arguments(paths, COMMAND_SIZE_LIMIT - 200):
+        command = f"stat --printf '{STAT_FORMAT}' -- {' '.join(chunk)}"
+        output, errors, exit_status = run_remote_command(client, command, cancel_event)
+        states.update(parse_stat_output(output))
+    return states
+
+def owner_matches(owner, state):
+    user, _, group = owner.partition(':')
+    if user and user not in (state['owner'], str(state['uid'])):
+        return False
+    return not group or group in (state['group'], str(state['gid']))
+
+def mode_matches(mode, state):
+    # Symbolic clauses depend on the old mode, they are trusted once the command went through
+    return not mode.isdigit() or stat.S_IMODE(state['mode']) == int(mode, 8)
+
+def change_status(change, state, before=None):
+    """Status of a change against a stat result: 'missing', 'skipped' when only a symlink mode was
+    asked for (chmod would change the target), then 'unchanged' when comparing the state before
+    applying, and 'applied' or 'failed' when comparing the state after."""
+    if state is None:
+        return 'missing'
+    if stat.S_ISLNK(state['mode']) and not change['owner']:
+        return 'skipped'
+    matches = (not change['mode'] or stat.S_ISLNK(state['mode']) or mode_matches(change['mode'], state)) and \
+        (not change['owner'] or owner_matches(change['owner'], state))
+    if before is None:
+        # A symbolic mode can only be checked once applied
+        return 'unchanged' if matches and (not change['mode'] or change['mode'].isdigit()) else 'change'
+    return 'applied' if matches else 'failed'
+
+@timed('preview_changes')
+def preview_changes(client, changes, cancel_event=None):
+    """Dry run: stats every target without changing anything. Returns (rows, states) where rows
+    are (change, state, status) and states feed journal_rows and apply_changes."""
+    states = stat_paths(client, [change['path'] for change in changes], cancel_event)
+    return [(change, states.get(change['path']), change_status(change, states.get(change['path'])))
+            for change in changes], states
+
+def journal_rows(changes, states):
+    """(path, old_mode, old_uid, old_gid, new_mode, new_owner) rows for the change journal."""
+    return [
+        (change['path'], states[change['path']]['mode'], states[change['path']]['uid'],
+         states[change['path']]['gid'], change['mode'], change['owner'])
+        for change in changes if change['path'] in states
+    ]
+
+def build_change_commands(changes, states):
+    """Yields one command per directory and target value. Ownership goes first since chown clears
+    the setuid and setgid bits, symlinks are left to chown -h only."""
+    by_directory = OrderedDict()
+    for change in changes:
+        state = states.get(change['path'])
+        if state is None:
+            continue
+        groups = by_directory.setdefault(change['directory'], OrderedDict())
+        if change['owner']:
+            groups.setdefault(('chown -h --', change['owner']), []).append(change['name'])
+        if change['mode'] and not stat.S_ISLNK(state['mode']):
+            groups.setdefault(('chmod --', change['mode']), []).append(change['name'])
+    for directory, groups in by_directory.items():
+        budget = COMMAND_SIZE_LIMIT - len(directory) - 200
+        for (operation, value), names in sorted(groups.items(), key=lambda item: not item[0][0].startswith('chown')):
+            for chunk in chunk_arguments(names, budget):
+                yield f"cd {shlex.quote(directory)} && {operation} {shlex.quote(value)} {' '.join(chunk)}"
+
+def pack_commands(commands, limit=COMMAND_SIZE_LIMIT):
+    """Joins commands into as few scripts as fit the command size limit. Every command runs
+    whatever happened to the previous ones, failures show up on stderr."""
+    script, size = [], 0
+    for command in commands:
+        if script and size + len(command) + 2 > limit:
+            yield '; '.join(script)
+            script, size = [], 0
+        script.append(command)
+        size += len(command) + 2
+    if script:
+        yield '; '.join(script)
+
+def run_scripts(client, commands, cancel_event=None):
+    errors = []
+    for script in pack_commands(commands):
+        output, script_errors, exit_status = run_remote_command(client, script, cancel_event)
+        if script_errors:
+            errors.append(script_errors.strip())
+    return '\n'.join(errors)
+
+@timed('apply_changes')
+def apply_changes(client, changes, states, cancel_event=None):
+    """Applies changes whose targets were stat'ed into states, in packed per-directory batches,
+    then stats them again. Returns (statuses, after, errors) with statuses per path."""
+    errors = run_scripts(client, build_change_commands(changes, states), cancel_event)
+    after = stat_paths(client, [change['path'] for change in changes if change['path'] in states])
+    statuses = {
+        change['path']: change_status(change, after.get(change['path']), states.get(change['path']))
+        if change['path'] in states else 'missing'
+        for change in changes
+    }
+    return statuses, after, errors
+
+@timed('rollback_changes')
+def rollback_changes(client, rows, cancel_event=None):
+    """Puts journaled (path, old_mode, old_uid, old_gid) rows back in one packed batch, skipping
+    paths that no longer exist or already match. Every entry is stat'ed again afterwards and only
+    counted as restored once it matches the journal, the others are reported in errors.
+    Returns (restored, after, errors)."""
+    current = stat_paths(client, [row[0] for row in rows], cancel_event)
+    by_directory, changed = OrderedDict(), set()
+    for path, old_mode, old_uid, old_gid in rows:
+        state = current.get(path)
+        if state is None:
+            continue
+        directory, name = posixpath.split(path)
+        file_type = b'l' if stat.S_ISLNK(old_mode) else b'f'
+        old = (name, stat.S_IMODE(old_mode), old_uid, old_gid, file_type)
+        new = (name, stat.S_IMODE(state['mode']), state['uid'], state['gid'], file_type)
+        if old != new:
+            by_directory.setdefault(directory, []).append(('changed', name.encode(errors='surrogateescape'), old, new))
+            changed.add(path)
+    commands = [command for directory, differences in by_directory.items()
+                for command in restore_commands(directory, differences)]
+    errors = [run_scripts(client, commands, cancel_event)] if commands else []
+    after = stat_paths(client, [row[0] for row in rows if row[0] in current])
+    restored = 0
+    for path, old_mode, old_uid, old_gid in rows:
+        if path not in current:
+            continue
+        state = after.get(path)
+        if state is None:
+            errors.append(f"{path}: gone during rollback")
+        elif not journal_matches(state, old_mode, old_uid, old_gid):
+            errors.append(f"{path}: is {describe_mode(state)} {state['uid']}:{state['gid']}, expected "
+                          f"{get_octal_permissions(old_mode)} {old_uid}:{old_gid}")
+        elif path in changed:
+            restored += 1
+    return restored, after, '\n'.join(error for error in errors if error)
+
+def journal_matches(state, old_mode, old_uid, old_gid):
+    # Symlink modes are never changed, only their ownership is compared
+    same_mode = stat.S_ISLNK(old_mode) or stat.S_IMODE(state['mode']) == stat.S_IMODE(old_mode)
+    return same_mode and (state['uid'], state['gid']) == (old_uid, old_gid)
+
+def describe_mode(state):
+    return '' if state is None else get_octal_permissions(state['mode'])
+
+def describe_owner(state):
+    return '' if state is None else f"{state['owner']}:{state['group']}"
@@ -0,0 +1,814 @@
+"""SSH, listing and chmod logic shared by the Tk application and the command line interface.
+
+Nothing in here imports tkinter, and paramiko is only imported once a connection is opened,
+so the module is cheap to import from scripts and cron jobs.
+"""
+import os
+import re
+import getpass
+import posixpath
+import stat
+import shlex
+import socket
+import threading
+import time
+import weakref
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from permissions_manager.instrumentation import action, count_channels, open_counting_socket, recorder, span, timed
+
+CHANNEL_POLL_SECONDS = 0.2
+CHANNEL_CHUNK_SIZE = 32768
+KEEPALIVE_SECONDS = 30
+PROGRESS_INTERVAL_SECONDS = 0.5
+ERROR_SAMPLE_SIZE = 20
+# The whole command line reaches the remote shell as one sh -c argument, which Linux caps at 128 KiB
+COMMAND_SIZE_LIMIT = 120000
+
+DEFAULT_SSH_PORT = 22
+SSH_CONFIG_PATH = '~/.ssh/config'
+ssh_config_cache = {}  # path -> (mtime, paramiko.SSHConfig)
+
+# Jump host clients shared by the sessions tunnelling through them, keyed by hop chain
+jump_clients = {}
+jump_lock = threading.Lock()
+
+# Remote helper processes per client, registered by helper.start_helper (and local.LocalClient)
+remote_helpers = weakref.WeakKeyDictionary()
+
+# Octal modes or chmod symbolic clauses such as u=rwX,g=rX,o-w
+MODE_PATTERN = re.compile(r'^([0-7]{3,4}|[ugoa]*[-+=][rwxXst]*(,[ugoa]*[-+=][rwxXst]*)*)$')
+
+# Separator-safe listing: one stat record per entry, fields and records NUL-terminated
+LISTING_FORMAT = '%n\\0%s\\0%f\\0%U\\0%G\\0'
+LISTING_FIELDS = 5
+
+# Tree loading: listings in flight at once, each on its own channel of the shared transport
+TREE_WORKERS = 4
+TREE_MAX_DIRECTORIES = 1000
+
+AUDIT_FIELDS = 4
+
+# Remote watch mode
+WATCH_INTERVAL_SECONDS = 2  # Scan interval of the polling fallback
+WATCH_HEARTBEAT_SECONDS = 5
+WATCH_BATCH_SECONDS = 0.3
+
+# Server-side search: path, permission bits, owner, group, type letter, size and mtime
+SEARCH_FORMAT = '%p\\0%m\\0%u\\0%g\\0%y\\0%s\\0%T@\\0'
+SEARCH_FIELDS = 7
+SEARCH_LIMIT = 10000
+SEARCH_MODE_PATTERN = re.compile(r'^[-/]?[0-7]{1,4}$')
+SEARCH_DATE_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}( \d{2}:\d{2}(:\d{2})?)?$')
+SEARCH_TYPES = 'fdlpsbc'
+
+class TaskCancelled(Exception):
+    """Raised inside a worker when the user cancelled the running operation."""
+
+class HelperClosed(Exception):
+    """Raised when the remote helper went away, callers fall back to the exec and SFTP paths."""
+
+def active_helper(client):
+    helper = remote_helpers.get(client)
+    return helper if helper is not None and helper.alive else None
+
+def stream_command_output(channel, on_stdout, on_stderr, cancel_event=None):
+    """Feeds stdout and stderr chunks of an exec channel to the callbacks as they arrive and
+    returns the exit status. Closes the channel and raises TaskCancelled when cancel_event is set."""
+    channel.settimeout(CHANNEL_POLL_SECONDS)
+    while True:
+        if cancel_event is not None and cancel_event.is_set():
+            channel.close()
+            raise TaskCancelled()
+        while channel.recv_stderr_ready():
+            on_stderr(channel.recv_stderr(CHANNEL_CHUNK_SIZE))
+        try:
+            data = channel.recv(CHANNEL_CHUNK_SIZE)
+        except socket.timeout:
+            on_stdout(b'')  # Lets streaming callers report progress while the remote side is quiet
+            continue
+        if not data:
+            break
+        on_stdout(data)
+    exit_status = channel.recv_exit_status()
+    while channel.recv_stderr_ready():
+        on_stderr(channel.recv_stderr(CHANNEL_CHUNK_SIZE))
+    return exit_status
+
+def read_command_output(channel, cancel_event=None):
+    """Drains stdout and stderr of an exec channel and returns (stdout, stderr, exit_status)."""
+    output, errors = [], []
+    exit_status = stream_command_output(channel, output.append, errors.append, cancel_event)
+    return b''.join(output), b''.join(errors).decode(errors='replace').strip(), exit_status
+
+def start_command(client, command):
+    """Opens an exec channel running command and returns it, timed as channel setup."""
+    with span('channel_setup'):
+        stdin, stdout, stderr = client.exec_command(command)
+    return stdout.channel
+
+def run_remote_command(client, command, cancel_event=None):
+    return read_command_output(start_command(client, command), cancel_event)
+
+def read_private_key(key_file, passphrase=None):
+    """Loads a private key from disk, raises paramiko.PasswordRequiredException for encrypted keys
+    when no passphrase is given."""
+    import io
+    import paramiko
+
+    key_file = os.path.expanduser(key_file.strip())
+    if not os.path.isfile(key_file):
+        raise FileNotFoundError(f"Private key file not found: {key_file}")
+
+    # Read once, the type is sniffed from the header and the key parsed from memory
+    with open(key_file, 'r') as f:
+        key_data = f.read()
+    if 'OPENSSH PRIVATE KEY' in key_data:
+        # The OpenSSH container holds any key type, each parser rejects the others
+        key_classes = [paramiko.Ed25519Key, paramiko.ECDSAKey, paramiko.RSAKey]
+    elif 'RSA' in key_data:
+        key_classes = [paramiko.RSAKey]
+    elif 'EC PRIVATE KEY' in key_data:
+        key_classes = [paramiko.ECDSAKey]
+    elif 'DSA' in key_data and hasattr(paramiko, 'DSSKey'):  # Dropped from recent paramiko releases
+        key_classes = [paramiko.DSSKey]
+    else:
+        raise ValueError("Unsupported key format.")
+
+    for key_class in key_classes:
+        try:
+            return key_class.from_private_key(io.StringIO(key_data), password=passphrase)
+        except paramiko.PasswordRequiredException:
+            raise
+        except paramiko.SSHException as e:
+            error = e
+    raise ValueError(f"Unsupported key format: {error}")
+
+def open_ssh_client(host, port, username, password, private_key, with_sftp=True, sock=None, allow_agent=True):
+    """Connects and returns (client, sftp_client), sftp_client is None without an SFTP subsystem.
+    sock is an already open channel to tunnel through, e.g. a direct-tcpip channel of a jump host."""
+    import paramiko
+
+    client = paramiko.SSHClient()
+    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    if sock is None:
+        # Our own socket, so the instrumentation counts the bytes on the wire
+        with span('tcp_connect'):
+            sock = open_counting_socket(host, port)
+    with span('ssh_handshake'):  # Key exchange and authentication
+        if private_key:
+            client.connect(host, port=port, username=username, pkey=private_key, sock=sock, allow_agent=allow_agent)
+        else:
+            # Connect using password if no key file is provided
+            client.connect(host, port=port, username=username, password=password, sock=sock,
+                           allow_agent=allow_agent)
+    count_channels(client.get_transport())
+
+    # Keepalives stop idle pooled sessions from being dropped by firewalls and bastions
+    client.get_transport().set_keepalive(KEEPALIVE_SECONDS)
+
+    if not with_sftp:
+        return client, None
+
+    # Keep one SFTP session open for browsing, fall back to exec listings without it
+    try:
+        with span('sftp_open'):
+            sftp_client = client.open_sftp()
+    except (paramiko.SSHException, EOFError):
+        sftp_client = None
+    return client, sftp_client
+
+def load_ssh_config(path=SSH_CONFIG_PATH):
+    """Returns the parsed ~/.ssh/config, or None without one. Parsed again only after it changed."""
+    import paramiko
+
+    path = os.path.expanduser(path)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    cached = ssh_config_cache.get(path)
+    if cached is None or cached[0] != mtime:
+        cached = ssh_config_cache[path] = (mtime, paramiko.SSHConfig.from_path(path))
+    return cached[1]
+
+def parse_jump(jump):
+    """Splits a ProxyJump hop of the form [user@]host[:port]."""
+    username, separator, address = jump.rpartition('@')
+    host, separator, port = address.partition(':')
+    return host, int(port) if port else None, username or None
+
+def resolve_target(host, port=None, username=None, key_file=None, use_config=True):
+    """Resolves host through ~/.ssh/config and returns the hops to connect through, jump hosts
+    first and the target last. Each hop is {'host', 'port', 'username', 'key_file', 'key'} where
+    key is 'user@hostname:port'. Values given here win, the config fills in the rest: HostName
+    for aliases, User, the first IdentityFile, Port when port is None or 22, and ProxyJump."""
+    config = load_ssh_config() if use_config else None
+
+    def resolve(alias, port, username, key_file):
+        options = config.lookup(alias) if config else {}
+        if port in (None, DEFAULT_SSH_PORT):
+            port = int(options.get('port', port or DEFAULT_SSH_PORT))
+        hostname = options.get('hostname', alias)
+        username = username or options.get('user') or getpass.getuser()
+        if not key_file and options.get('identityfile'):
+            candidate = os.path.expanduser(options['identityfile'][0])
+            key_file = candidate if os.path.isfile(candidate) else None
+        return {'host': hostname, 'port': port, 'username': username, 'key_file': key_file,
+                'key': f'{username}@{hostname}:{port}'}, options.get('proxyjump')
+
+    target, proxy_jump = resolve(host, port, username, key_file)
+    hops = []
+    if proxy_jump and proxy_jump.lower() != 'none':
+        for jump in proxy_jump.split(','):
+            jump_host, jump_port, jump_user = parse_jump(jump.strip())
+            hops.append(resolve(jump_host, jump_port, jump_user, None)[0])
+    return hops + [target]
+
+def acquire_jump(chain_key, hop, private_key, sock, allow_agent):
+    """Returns a connected client for a jump host, shared by every session tunnelling through it."""
+    with jump_lock:
+        shared = jump_clients.get(chain_key)
+        if shared and shared['client'].get_transport() and shared['client'].get_transport().is_active():
+            shared['users'] += 1
+            return shared['client']
+    client, _ = open_ssh_client(hop['host'], hop['port'], hop['username'], None, private_key,
+                                with_sftp=False, sock=sock, allow_agent=allow_agent)
+    with jump_lock:
+        jump_clients[chain_key] = {'client': client, 'users': 1}
+    return client
+
+def release_jump(chain_key, client):
+    with jump_lock:
+        shared = jump_clients.get(chain_key)
+        if shared and shared['client'] is client:
+            shared['users'] -= 1
+            if shared['users'] > 0:
+                return
+            del jump_clients[chain_key]
+    client.close()
+
+def open_ssh_chain(hops, password, private_keys, with_sftp=True, allow_agent=True):
+    """Connects to the last of hops (see resolve_target) through the others, one direct-tcpip
+    channel per jump, and returns (client, sftp_client). Jump host transports are shared between
+    sessions and closed with the last client using them. The password is only sent to the target,
+    jump hosts authenticate with keys or the agent."""
+    sock = None
+    jumps = []
+    try:
+        for index, (hop, private_key) in enumerate(zip(hops[:-1], private_keys[:-1])):
+            chain_key = ' > '.join(jump['key'] for jump in hops[:index + 1])
+            jump = acquire_jump(chain_key, hop, private_key, sock, allow_agent)
+            jumps.append((chain_key, jump))
+            following = hops[index + 1]
+            with span('jump_channel'):
+                sock = jump.get_transport().open_channel(
+                    'direct-tcpip', (following['host'], following['port']), ('127.0.0.1', 0)
+                )
+        target = hops[-1]
+        client, sftp_client = open_ssh_client(target['host'], target['port'], target['username'], password,
+                                              private_keys[-1], with_sftp, sock, allow_agent)
+    except Exception:
+        for chain_key, jump in reversed(jumps):
+            release_jump(chain_key, jump)
+        raise
+
+    if jumps:
+        close = client.close
+
+        def close_with_jumps():
+            close()
+            for chain_key, jump in reversed(jumps):
+                release_jump(chain_key, jump)
+
+        client.close = close_with_jumps
+    return client, sftp_client
+
+def connect_target(host, port, username, password, key_file, passphrase=None, with_sftp=True, use_config=True,
+                   allow_agent=True):
+    """Non-interactive connect for workers and the command line: resolves host through
+    ~/.ssh/config and takes keys from the key cache, so only the first use parses them."""
+    from permissions_manager.keys import load_key
+
+    hops = resolve_target(host, port, username, key_file, use_config)
+    private_keys = [load_key(hop['key_file'], passphrase) if hop['key_file'] else None for hop in hops]
+    return open_ssh_chain(hops, password, private_keys, with_sftp, allow_agent)
+
+def build_listing_command(path, known_mtime=None):
+    """Builds a single remote command that prints the directory mtime and then stats every entry.
+    With known_mtime the entries are skipped when the directory has not changed since."""
+    quoted = shlex.quote(path)
+    command = f"mtime=$(stat -c %Y -- {quoted}) || exit 1; printf '%s\\0' \"$mtime\"; "
+    if known_mtime is not None:
+        command += f'[ "$mtime" = {int(known_mtime)} ] && exit 0; '
+    return command + f"find {quoted} -mindepth 1 -maxdepth 1 -exec stat --printf '{LISTING_FORMAT}' -- {{}} +"
+
+def parse_listing(output):
+    """Parses NUL separated stat records into entry dictionaries."""
+    fields = output.split(b'\0')
+    entries = []
+    for i in range(0, len(fields) - LISTING_FIELDS + 1, LISTING_FIELDS):
+        name, size, raw_mode, owner, group = fields[i:i + LISTING_FIELDS]
+        mode = int(raw_mode, 16)
+        entries.append({
+            'name': os.path.basename(name.decode(errors='replace').rstrip('/')),
+            'size': int(size),
+            'mode': mode,
+            'owner': owner.decode(errors='replace'),
+            'group': group.decode(errors='replace'),
+            'type': get_file_type(mode),
+        })
+    entries.sort(key=lambda entry: entry['name'])
+    return entries
+
+def get_file_type(mode):
+    if stat.S_ISDIR(mode):
+        return 'directory'
+    if stat.S_ISLNK(mode):
+        return 'symlink'
+    if stat.S_ISREG(mode):
+        return 'file'
+    return 'special'
+
+def get_octal_permissions(mode):
+    # Permission bits (including setuid, setgid and sticky) in octal notation
+    return format(stat.S_IMODE(mode), 'o')
+
+def entry_from_attributes(attr):
+    """Builds an entry dictionary from a paramiko SFTPAttributes object."""
+    # Owner and group names are only available from the ls-style long name
+    fields = (attr.longname or '').split(None, 4)
+    if len(fields) == 5:
+        owner, group = fields[2], fields[3]
+    else:
+        owner, group = str(attr.st_uid), str(attr.st_gid)
+    return {
+        'name': attr.filename,
+        'size': attr.st_size,
+        'mode': attr.st_mode,
+        'owner': owner,
+        'group': group,
+        'type': get_file_type(attr.st_mode),
+    }
+
+@timed('list_directory')
+def list_directory(client, sftp_client, path, cached=None, cancel_event=None):
+    """Returns (entries, errors, mtime) for a remote directory, runs on a worker thread.
+    When the cached listing is still current (same directory mtime) it is returned as is."""
+    helper = active_helper(client)
+    if helper is not None:
+        try:
+            return helper.list_directory(path, cached, cancel_event)
+        except HelperClosed:
+            pass
+
+    if sftp_client is None:
+        # List and stat every entry in one round-trip, or only check the mtime of a cached directory
+        command = build_listing_command(path, cached['mtime'] if cached else None)
+        output, errors, exit_status = run_remote_command(client, command, cancel_event)
+        raw_mtime, separator, records = output.partition(b'\0')
+        mtime = int(raw_mtime) if separator else None
+        if cached and mtime == cached['mtime']:
+            return cached['entries'], errors, mtime
+        return parse_listing(records), errors, mtime
+
+    with span('sftp_stat'):
+        mtime = sftp_client.stat(path).st_mtime
+    if cached and cached['mtime'] == mtime:
+        return cached['entries'], '', mtime
+    if cancel_event is not None and cancel_event.is_set():
+        raise TaskCancelled()
+    with span('sftp_listdir'):
+        attributes = sftp_client.listdir_attr(path)
+    entries = [entry_from_attributes(attr) for attr in attributes]
+    entries.sort(key=lambda entry: entry['name'])
+    return entries, '', mtime
+
+@timed('list_tree')
+def list_tree(client, root, on_listing, depth=1, use_sftp=True, workers=TREE_WORKERS,
+              max_directories=TREE_MAX_DIRECTORIES, cancel_event=None):
+    """Lists root and its subdirectories breadth first, depth levels deep (root being level one),
+    with up to workers listings in flight. Every worker lists over its own channel of the client
+    transport, an SFTP session of its own or one exec channel per directory, so the listings run in
+    parallel over a single connection. on_listing(path, entries, errors, mtime) is called from
+    this thread as each listing arrives, parents before their children, entries is None when the
+    directory could not be listed. Symlinks are not followed.
+    Returns (listed, failed, truncated), truncated when max_directories cut the walk short.
+    With a remote helper the walk runs on the remote side and streams back over its channel."""
+    helper = active_helper(client)
+    if helper is not None:
+        try:
+            return helper.walk(root, on_listing, depth, max_directories, cancel_event)
+        except HelperClosed:
+            pass
+
+    local = threading.local()
+    sessions = []
+    caller_action = recorder.current_action()
+
+    def list_one(path):
+        with action(caller_action):
+            sftp_client = None
+            if use_sftp:
+                sftp_client = getattr(local, 'sftp', None)
+                if sftp_client is None:
+                    with span('sftp_open'):
+                        sftp_client = local.sftp = client.open_sftp()
+                    sessions.append(sftp_client)
+            return list_directory(client, sftp_client, path, cancel_event=cancel_event)
+
+    pool = ThreadPoolExecutor(max_workers=workers)
+    pending = {pool.submit(list_one, root): (root, 1)}
+    submitted, failed, truncated = 1, 0, False
+    try:
+        while pending:
+            done, _ = wait(pending, timeout=CHANNEL_POLL_SECONDS, return_when=FIRST_COMPLETED)
+            if cancel_event is not None and cancel_event.is_set():
+                raise TaskCancelled()
+            for future in done:
+                path, level = pending.pop(future)
+                try:
+                    entries, errors, mtime = future.result()
+                except Exception as e:
+                    failed += 1
+                    on_listing(path, None, str(e), None)
+                    continue
+                on_listing(path, entries, errors, mtime)
+                if level >= depth:
+                    continue
+                for entry in entries:
+                    if entry['type'] != 'directory':
+                        continue
+                    if submitted >= max_directories:
+                        truncated = True
+                        break
+                    child = posixpath.join(path, entry['name'])
+                    pending[pool.submit(list_one, child)] = (child, level + 1)
+                    submitted += 1
+    finally:
+        # Queued listings are dropped, closing the sessions stops the ones in flight
+        pool.shutdown(wait=False, cancel_futures=True)
+        for session in sessions:
+            session.close()
+    return submitted - failed, failed, truncated
+
+@timed('stat_entries')
+def stat_entries(client, directory, names, cancel_event=None):
+    """Stats only the given names of a directory, one remote command per chunk.
+    Returns (entries, missing) where missing lists the names that no longer exist."""
+    helper = active_helper(client)
+    if helper is not None:
+        try:
+            return helper.stat_entries(directory, names, cancel_event)
+        except HelperClosed:
+            pass
+
+    entries = []
+    for chunk in chunk_arguments(names, COMMAND_SIZE_LIMIT - len(directory) - 200):
+        command = f"cd {shlex.quote(directory)} && stat --printf '{LISTING_FORMAT}' -- {' '.join(chunk)}"
+        output, errors, exit_status = run_remote_command(client, command, cancel_event)
+        entries.extend(parse_listing(output))
+    found = {entry['name'] for entry in entries}
+    return entries, [name for name in names if name not in found]
+
+def chunk_arguments(names, budget=COMMAND_SIZE_LIMIT):
+    """Yields lists of shell-quoted names whose joined length stays below budget."""
+    chunk, size = [], 0
+    for name in names:
+        quoted = shlex.quote(name)
+        if chunk and size + len(quoted) + 1 > budget:
+            yield chunk
+            chunk, size = [], 0
+        chunk.append(quoted)
+        size += len(quoted) + 1
+    if chunk:
+        yield chunk
+
+@timed('chmod_entries')
+def chmod_entries(client, directory, mode, names):
+    """Applies mode to names in directory with one remote command per chunk, each command also
+    stats the touched entries. Returns (entries, errors, exit_status) with the fresh entries."""
+    helper = active_helper(client)
+    # The helper takes octal modes, symbolic clauses are left to chmod itself
+    if helper is not None and mode.isdigit():
+        try:
+            return helper.chmod_entries(directory, mode, names)
+        except HelperClosed:
+            pass
+
+    entries, errors, exit_status = [], [], 0
+    # The arguments appear twice in the command, once for chmod and once for stat
+    for chunk in chunk_arguments(names, (COMMAND_SIZE_LIMIT - len(directory) - 200) // 2):
+        arguments = ' '.join(chunk)
+        command = (
+            f"cd {shlex.quote(directory)} && {{ chmod -- {mode} {arguments}; status=$?; "
+            f"stat --printf '{LISTING_FORMAT}' -- {arguments}; exit $status; }}"
+        )
+        output, chunk_errors, chunk_status = run_remote_command(client, command)
+        entries.extend(parse_listing(output))
+        if chunk_errors:
+            errors.append(chunk_errors)
+        exit_status = exit_status or chunk_status
+    return entries, '\n'.join(errors), exit_status
+
+def build_recursive_chmod_command(path, file_mode, dir_mode):
+    """Builds one find invocation that applies dir_mode to directories and file_mode to everything
+    else (symlinks excluded). Every entry prints one line so progress can be counted from stdout."""
+    branches = []
+    if dir_mode:
+        branches.append(f"\\( -type d -printf 'd\\n' -exec chmod -- {dir_mode} {{}} + \\)")
+    if file_mode:
+        branches.append(f"\\( ! -type d ! -type l -printf 'f\\n' -exec chmod -- {file_mode} {{}} + \\)")
+    return f"find {shlex.quote(path)} " + ' -o '.join(branches)
+
+@timed('chmod_recursive')
+def chmod_recursive(client, path, file_mode, dir_mode, on_progress=None, cancel_event=None):
+    """Runs the recursive chmod server-side, calling on_progress(processed, errors, rate) at most
+    every PROGRESS_INTERVAL_SECONDS. Returns (processed, error_count, error_sample, exit_status, elapsed)."""
+    # The local backend walks and changes the tree itself, for octal modes
+    recursive = getattr(active_helper(client), 'chmod_recursive', None)
+    if recursive is not None and all(not mode or mode.isdigit() for mode in (file_mode, dir_mode)):
+        return recursive(path, file_mode, dir_mode, on_progress, cancel_event)
+    channel = start_command(client, build_recursive_chmod_command(path, file_mode, dir_mode))
+    started = time.monotonic()
+    counters = {'processed': 0, 'errors': 0, 'reported': started}
+    error_sample = []
+
+    def on_stdout(data):
+        counters['processed'] += data.count(b'\n')
+        now = time.monotonic()
+        if on_progress and now - counters['reported'] >= PROGRESS_INTERVAL_SECONDS:
+            counters['reported'] = now
+            on_progress(counters['processed'], counters['errors'], counters['processed'] / max(now - started, 1e-6))
+
+    def on_stderr(data):
+        lines = data.decode(errors='replace').splitlines()
+        counters['errors'] += len(lines)
+        error_sample.extend(lines[:ERROR_SAMPLE_SIZE - len(error_sample)])
+
+    exit_status = stream_command_output(channel, on_stdout, on_stderr, cancel_event)
+    return counters['processed'], counters['errors'], error_sample, exit_status, time.monotonic() - started
+
+def build_extended_attributes_command(directory, arguments=None):
+    """Builds one command printing the extended ACLs (getfacl -s skips entries that only have the
+    base ACL) and then, after a NUL, the file capabilities of a whole directory or only of the
+    shell-quoted arguments. A section reads 'unavailable' when the tool is not installed."""
+    if arguments is None:
+        targets = "find . -mindepth 1 -maxdepth 1 -exec {} {{}} +"
+    else:
+        targets = "{} " + ' '.join(arguments).replace('{', '{{').replace('}', '}}')
+    sections = []
+    for tool, command in (('getfacl', 'getfacl -s -p'), ('getcap', 'getcap')):
+        sections.append(
+            f"if command -v {tool} >/dev/null 2>&1; then {targets.format(command)} 2>/dev/null; "
+            "else echo unavailable; fi"
+        )
+    return f"cd {shlex.quote(directory)} || exit 1; {sections[0]}; printf '\\0'; {sections[1]}"
+
+def unescape_acl_name(name):
+    # getfacl writes whitespace, backslashes and control characters as \ooo octal escapes
+    raw = re.sub(rb'\\([0-7]{3})', lambda match: bytes((int(match.group(1), 8),)), name)
+    return os.path.basename(raw.decode(errors='replace'))
+
+def parse_extended_attributes(output):
+    """Returns (acls, capabilities): name -> list of extended ACL entries and name -> capability
+    text. Either is None when the server lacks the tool."""
+    acl_output, separator, capability_output = output.partition(b'\0')
+    acls = capabilities = None
+    if acl_output.strip() != b'unavailable':
+        acls = {}
+        name = None
+        for line in acl_output.split(b'\n'):
+            if line.startswith(b'# file: '):
+                name = unescape_acl_name(line[8:])
+                acls[name] = []
+            elif name is not None and line and not line.startswith(b'#'):
+                entry = line.decode(errors='replace')
+                # user::, group:: and other:: mirror the mode bits already shown
+                if entry.split(':', 2)[:2] not in (['user', ''], ['group', ''], ['other', '']):
+                    acls[name].append(entry)
+    if capability_output.strip() != b'unavailable':
+        capabilities = {}
+        for line in capability_output.decode(errors='replace').splitlines():
+            # Older libcap prints 'file = caps', newer 'file caps'
+            name, separator, text = line.rpartition(' = ') if ' = ' in line else line.rpartition(' ')
+            if separator:
+                capabilities[os.path.basename(name)] = text
+    return acls, capabilities
+
+@timed('fetch_extended_attributes')
+def fetch_extended_attributes(client, directory, names=None, cancel_event=None):
+    """Collects ACLs and capabilities of a directory (or only of names) in one remote command per
+    chunk. Returns (acls, capabilities) as parse_extended_attributes does."""
+    if names is None:
+        output, errors, exit_status = run_remote_command(
+            client, build_extended_attributes_command(directory), cancel_event
+        )
+        return parse_extended_attributes(output)
+    acls, capabilities = {}, {}
+    # The ./ prefix keeps names starting with a dash from being read as options, and the
+    # arguments appear twice in the command, once per tool
+    paths = ['./' + name for name in names]
+    for chunk in chunk_arguments(paths, COMMAND_SIZE_LIMIT // 2 - len(directory) - 400):
+        output, errors, exit_status = run_remote_command(
+            client, build_extended_attributes_command(directory, chunk), cancel_event
+        )
+        chunk_acls, chunk_capabilities = parse_extended_attributes(output)
+        if chunk_acls is None or acls is None:
+            acls = None
+        else:
+            acls.update(chunk_acls)
+        if chunk_capabilities is None or capabilities is None:
+            capabilities = None
+        else:
+            capabilities.update(chunk_capabilities)
+    return acls, capabilities
+
+@timed('setfacl_entries')
+def setfacl_entries(client, directory, operation, spec, names, recursive=False):
+    """Runs setfacl over names in directory, one remote command per chunk. operation is 'modify'
+    (-m spec), 'remove' (-x spec) or 'remove-all' (-b). Returns (errors, exit_status)."""
+    options = {'modify': f"-m {shlex.quote(spec)}", 'remove': f"-x {shlex.quote(spec)}", 'remove-all': '-b'}[operation]
+    if recursive:
+        options = '-R ' + options
+    errors, exit_status = [], 0
+    for chunk in chunk_arguments(names, COMMAND_SIZE_LIMIT - len(directory) - len(options) - 200):
+        command = f"cd {shlex.quote(directory)} && setfacl {options} -- {' '.join(chunk)}"
+        output, chunk_errors, chunk_status = run_remote_command(client, command)
+        if chunk_errors:
+            errors.append(chunk_errors)
+        exit_status = exit_status or chunk_status
+    return '\n'.join(errors), exit_status
+
+def build_watch_command(path, recursive=False, interval=WATCH_INTERVAL_SECONDS):
+    """Builds a long-running watcher that prints its method ('inotify' or 'poll') and then one
+    'EVENTS path' line per change. inotifywait is used when installed, otherwise a find loop
+    reports entries whose ctime moved past a stamp file (chmod and chown only touch the ctime).
+    Both print an empty heartbeat line regularly, a write to the closed channel ends the watcher."""
+    quoted = shlex.quote(path)
+    depth = '' if recursive else '-maxdepth 1 '
+    return (
+        "trap '' PIPE; "
+        "if command -v inotifywait >/dev/null 2>&1; then "
+        "echo inotify; "
+        f"inotifywait -m -q {'-r ' if recursive else ''}-e attrib,close_write,create,delete,moved_from,moved_to "
+        f"--format '%e %w%f' -- {quoted} & pid=$!; "
+        f"while kill -0 $pid 2>/dev/null && printf '\\n'; do sleep {WATCH_HEARTBEAT_SECONDS}; done; "
+        "kill $pid 2>/dev/null; "
+        "else "
+        'stamp=$(mktemp) && next=$(mktemp) || exit 1; '
+        'trap \'rm -f "$stamp" "$next"; exit 143\' TERM HUP; '
+        "echo poll; "
+        f"while printf '\\n'; do sleep {interval}; touch \"$next\"; "
+        f"find {quoted} {depth}-cnewer \"$stamp\" -printf 'CHANGED %p\\n'; "
+        'mv -f "$next" "$stamp"; done; '
+        'rm -f "$stamp" "$next"; '
+        "fi"
+    )
+
+def watch_directory(client, path, on_changes, recursive=False, interval=WATCH_INTERVAL_SECONDS, cancel_event=None):
+    """Streams changes under path until cancelled or the remote watcher exits, runs on a worker.
+    on_changes(method, paths) is first called with no paths once the method is known, then with
+    batches of changed paths. A batch containing path itself means entries may have gone and the
+    directory needs re-listing, the polling fallback cannot name deleted entries."""
+    channel = start_command(client, build_watch_command(path, recursive, interval))
+    state = {'pending': b'', 'method': None, 'paths': set(), 'flushed': time.monotonic()}
+    errors = []
+
+    def on_stdout(data):
+        lines = (state['pending'] + data).split(b'\n')
+        state['pending'] = lines.pop()
+        for line in lines:
+            if not line:
+                continue  # Heartbeat
+            if state['method'] is None:
+                state['method'] = line.decode()
+                on_changes(state['method'], [])
+                continue
+            events, separator, changed = line.partition(b' ')
+            if separator:
+                state['paths'].add(posixpath.normpath(changed.decode(errors='replace')))
+        # Bursts (a recursive chmod, an unpacked archive) are coalesced into one batch
+        now = time.monotonic()
+        if state['paths'] and (not data or now - state['flushed'] >= WATCH_BATCH_SECONDS):
+            on_changes(state['method'], sorted(state['paths']))
+            state['paths'] = set()
+            state['flushed'] = now
+
+    exit_status = stream_command_output(channel, on_stdout, errors.append, cancel_event)
+    if exit_status:
+        message = b''.join(errors).decode(errors='replace').strip()
+        raise RuntimeError(message or f"Watcher exited with status {exit_status}")
+    return exit_status
+
+def build_audit_command(roots):
+    """Builds one find pass reporting world-writable entries, setuid/setgid files and entries
+    owned by no user. Records are category, mode, owner and path, all NUL-terminated."""
+    quoted = ' '.join(shlex.quote(root) for root in roots)
+    return (
+        f"find {quoted} -xdev "
+        "\\( -perm -0002 ! -type l -printf 'world-writable\\0%m\\0%U\\0%p\\0' \\) , "
+        "\\( -type f -perm /6000 -printf 'setid\\0%m\\0%U\\0%p\\0' \\) , "
+        "\\( -nouser -printf 'nouser\\0%m\\0%U\\0%p\\0' \\)"
+    )
+
+def parse_audit_output(output):
+    fields = output.split(b'\0')
+    findings = []
+    for i in range(0, len(fields) - AUDIT_FIELDS + 1, AUDIT_FIELDS):
+        findings.append(tuple(field.decode(errors='replace') for field in fields[i:i + AUDIT_FIELDS]))
+    return findings
+
+@timed('audit_host')
+def audit_host(row, roots, pooled_client, cancel_event=None, use_config=True, allow_agent=True):
+    """Scans one host and returns a list of (category, mode, owner, path), runs on an audit worker.
+    use_config and allow_agent apply when the host has no pooled session, as in connect_target."""
+    conn_id, host, port, username, password, key_file = row
+    client = pooled_client
+    if client is None:
+        # Encrypted keys cannot prompt from a worker, uncached ones fail with PasswordRequiredException
+        client, _ = connect_target(host, port, username, password, key_file, with_sftp=False,
+                                   use_config=use_config, allow_agent=allow_agent)
+    try:
+        output, errors, exit_status = run_remote_command(client, build_audit_command(roots), cancel_event)
+    finally:
+        if client is not pooled_client:
+            client.close()
+    return parse_audit_output(output)
+
+def build_search_command(root, query):
+    """Compiles a query into one find expression so filtering runs on the server. query keys, all
+    optional: mode (find -perm syntax: 777 exact, -022 all bits, /6000 any bit), owner and group
+    (names or numeric ids), type (find -type letter), name (glob) and newer/older (dates)."""
+    tests = []
+    mode = query.get('mode')
+    if mode:
+        if not SEARCH_MODE_PATTERN.match(mode):
+            raise ValueError(f"Invalid mode: {mode}")
+        tests.append(f"-perm {mode}")
+    for key, by_name, by_id in (('owner', '-user', '-uid'), ('group', '-group', '-gid')):
+        value = query.get(key)
+        if value:
+            tests.append(f"{by_id if value.isdigit() else by_name} {shlex.quote(value)}")
+    file_type = query.get('type')
+    if file_type:
+        if file_type not in SEARCH_TYPES:
+            raise ValueError(f"Invalid type: {file_type}")
+        tests.append(f"-type {file_type}")
+    if query.get('name'):
+        tests.append(f"-name {shlex.quote(query['name'])}")
+    for key, negate in (('newer', ''), ('older', '! ')):
+        value = query.get(key)
+        if value:
+            if not SEARCH_DATE_PATTERN.match(value):
+                raise ValueError(f"Invalid date: {value}")
+            tests.append(f"{negate}-newermt {shlex.quote(value)}")
+    return ' '.join([f"find {shlex.quote(root)}"] + tests + [f"-printf '{SEARCH_FORMAT}'"])
+
+def parse_search_record(fields):
+    path, mode, owner, group, file_type, size, mtime = (field.decode(errors='replace') for field in fields)
+    return {'path': path, 'mode': int(mode, 8), 'owner': owner, 'group': group, 'type': file_type,
+            'size': int(size), 'mtime': float(mtime)}
+
+@timed('search_tree')
+def search_tree(client, root, query, on_results, limit=SEARCH_LIMIT, cancel_event=None):
+    """Streams matches of a server-side find to on_results(batch) until limit matches arrived,
+    runs on a worker. Returns (count, error_count, truncated), truncated when the limit cut it short."""
+    channel = start_command(client, build_search_command(root, query))
+    state = {'pending': b'', 'fields': [], 'batch': [], 'count': 0, 'errors': 0, 'flushed': time.monotonic()}
+    stop_event = threading.Event()
+
+    def flush():
+        if state['batch']:
+            on_results(state['batch'])
+            state['batch'] = []
+        state['flushed'] = time.monotonic()
+
+    def on_stdout(data):
+        if cancel_event is not None and cancel_event.is_set():
+            stop_event.set()
+        parts = (state['pending'] + data).split(b'\0')
+        state['pending'] = parts.pop()
+        fields = state['fields']
+        for part in parts:
+            fields.append(part)
+            if len(fields) == SEARCH_FIELDS:
+                if state['count'] >= limit:
+                    stop_event.set()  # Closing the channel stops find on the server
+                    break
+                state['batch'].append(parse_search_record(fields))
+                state['count'] += 1
+                fields.clear()
+        if not data or time.monotonic() - state['flushed'] >= PROGRESS_INTERVAL_SECONDS:
+            flush()
+
+    def on_stderr(data):
+        state['errors'] += data.count(b'\n')
+
+    try:
+        stream_command_output(channel, on_stdout, on_stderr, stop_event)
+    except TaskCancelled:
+        if cancel_event is not None and cancel_event.is_set():
+            raise
+    flush()
+    return state['count'], state['errors'], stop_event.is_set()
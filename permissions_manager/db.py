@@ -0,0 +1,227 @@
+"""connections.db schema and the queries shared by the Tk application and the command line."""
+import sqlite3
+
+
+DATABASE_PATH = 'connections.db'
+CONNECTIONS_PAGE_SIZE = 200
+SEARCH_MIN_LENGTH = 3  # Trigrams need three characters, shorter searches match host and username prefixes
+
+SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS connections (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        host TEXT NOT NULL,
+        port INTEGER NOT NULL,
+        username TEXT NOT NULL,
+        password TEXT,
+        key_file TEXT
+    )
+    ''',
+    # Host names are case-insensitive, the same index serves duplicate checks, prefix searches and ordering
+    'CREATE INDEX IF NOT EXISTS connections_host ON connections (host COLLATE NOCASE, port, username)',
+    'CREATE INDEX IF NOT EXISTS connections_username ON connections (username COLLATE NOCASE)',
+    '''
+    CREATE TABLE IF NOT EXISTS audit_runs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        started_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        roots TEXT NOT NULL,
+        host_count INTEGER NOT NULL
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS audit_results (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        run_id INTEGER NOT NULL,
+        connection_id INTEGER,
+        host TEXT NOT NULL,
+        category TEXT NOT NULL,
+        mode TEXT,
+        owner TEXT,
+        path TEXT NOT NULL
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS audit_results_run ON audit_results (run_id, host)',
+    '''
+    CREATE TABLE IF NOT EXISTS change_batches (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        host TEXT NOT NULL,
+        status TEXT NOT NULL
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS change_journal (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        batch_id INTEGER NOT NULL,
+        path TEXT NOT NULL,
+        old_mode INTEGER NOT NULL,
+        old_uid INTEGER NOT NULL,
+        old_gid INTEGER NOT NULL,
+        new_mode TEXT,
+        new_owner TEXT,
+        status TEXT NOT NULL DEFAULT 'pending'
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS change_journal_batch ON change_journal (batch_id)',
+    '''
+    CREATE TABLE IF NOT EXISTS settings (
+        id INTEGER PRIMARY KEY,
+        theme TEXT NOT NULL
+    )
+    ''',
+]
+
+# Substring search over host and username, kept in sync with the connections table by triggers.
+# Optional, sqlite builds without FTS5 (or older than 3.34 for the trigram tokenizer) search by prefix.
+SEARCH_SCHEMA = [
+    '''
+    CREATE VIRTUAL TABLE connections_search USING fts5(
+        host, username, content='connections', content_rowid='id', tokenize='trigram'
+    )
+    ''',
+    '''
+    CREATE TRIGGER connections_search_insert AFTER INSERT ON connections BEGIN
+        INSERT INTO connections_search (rowid, host, username) VALUES (new.id, new.host, new.username);
+    END
+    ''',
+    '''
+    CREATE TRIGGER connections_search_delete AFTER DELETE ON connections BEGIN
+        INSERT INTO connections_search (connections_search, rowid, host, username)
+        VALUES ('delete', old.id, old.host, old.username);
+    END
+    ''',
+    '''
+    CREATE TRIGGER connections_search_update AFTER UPDATE OF host, username ON connections BEGIN
+        INSERT INTO connections_search (connections_search, rowid, host, username)
+        VALUES ('delete', old.id, old.host, old.username);
+        INSERT INTO connections_search (rowid, host, username) VALUES (new.id, new.host, new.username);
+    END
+    ''',
+    # Indexes the rows saved before the search table existed
+    "INSERT INTO connections_search (connections_search) VALUES ('rebuild')",
+]
+
+def open_database(path=DATABASE_PATH):
+    """Opens connections.db and creates any missing tables."""
+    conn = sqlite3.connect(path)
+    for statement in SCHEMA:
+        conn.execute(statement)
+    conn.commit()
+    if not has_search_table(conn):
+        try:
+            with conn:
+                for statement in SEARCH_SCHEMA:
+                    conn.execute(statement)
+        except sqlite3.OperationalError:
+            pass
+    return conn
+
+def has_search_table(conn):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'connections_search'").fetchone() is not None
+
+def get_connection_details(conn, conn_id):
+    """Returns (host, port, username, password, key_file) of a saved connection, or None."""
+    cursor = conn.execute("SELECT host, port, username, password, key_file FROM connections WHERE id = ?", (conn_id,))
+    return cursor.fetchone()
+
+def get_connection_rows(conn, conn_ids=None):
+    """Returns (id, host, port, username, password, key_file) rows, all of them when conn_ids is empty."""
+    query = "SELECT id, host, port, username, password, key_file FROM connections"
+    if not conn_ids:
+        return conn.execute(query).fetchall()
+    placeholders = ','.join('?' * len(conn_ids))
+    return conn.execute(f"{query} WHERE id IN ({placeholders})", list(conn_ids)).fetchall()
+
+def import_connections(conn, rows):
+    """Saves (host, port, username, password, key_file) rows in one transaction. Rows whose host,
+    port and username are already saved, or came earlier in rows, are skipped.
+    Returns (added, skipped)."""
+    seen, new_rows, skipped = set(), [], 0
+    with conn:
+        for host, port, username, password, key_file in rows:
+            target = (host.lower(), int(port), username)
+            if target in seen or conn.execute(
+                    "SELECT 1 FROM connections WHERE host = ? COLLATE NOCASE AND port = ? AND username = ?",
+                    target).fetchone():
+                skipped += 1
+                continue
+            seen.add(target)
+            new_rows.append((host, int(port), username, password, key_file))
+        conn.executemany("INSERT INTO connections (host, port, username, password, key_file) VALUES (?, ?, ?, ?, ?)",
+                         new_rows)
+    return len(new_rows), skipped
+
+def connection_filter(conn, text):
+    """WHERE clause and parameters matching text in host or username."""
+    text = text.strip()
+    if not text:
+        return '', []
+    if len(text) >= SEARCH_MIN_LENGTH and has_search_table(conn):
+        phrase = '"' + text.replace('"', '""') + '"'
+        return ' WHERE id IN (SELECT rowid FROM connections_search WHERE connections_search MATCH ?)', [phrase]
+    pattern = text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+    return " WHERE host LIKE ? ESCAPE '\\' OR username LIKE ? ESCAPE '\\'", [pattern, pattern]
+
+def search_connections(conn, text='', limit=CONNECTIONS_PAGE_SIZE, offset=0):
+    """Returns one page of (id, host, port, username) rows matching text, ordered by host."""
+    where, parameters = connection_filter(conn, text)
+    return conn.execute(
+        f"SELECT id, host, port, username FROM connections{where} ORDER BY host COLLATE NOCASE, id LIMIT ? OFFSET ?",
+        parameters + [limit, offset]).fetchall()
+
+def count_connections(conn, text=''):
+    where, parameters = connection_filter(conn, text)
+    return conn.execute(f"SELECT COUNT(*) FROM connections{where}", parameters).fetchone()[0]
+
+def start_audit_run(conn, roots, host_count):
+    cursor = conn.execute("INSERT INTO audit_runs (roots, host_count) VALUES (?, ?)", (' '.join(roots), host_count))
+    conn.commit()
+    return cursor.lastrowid
+
+def record_audit_findings(conn, run_id, conn_id, host, findings):
+    """Stores (category, mode, owner, path) findings of one host."""
+    conn.executemany('''
+        INSERT INTO audit_results (run_id, connection_id, host, category, mode, owner, path)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', [(run_id, conn_id, host) + tuple(finding) for finding in findings])
+    conn.commit()
+
+def start_change_batch(conn, host, rows):
+    """Journals (path, old_mode, old_uid, old_gid, new_mode, new_owner) rows before they are applied,
+    in one transaction, and returns the batch id."""
+    with conn:
+        cursor = conn.execute("INSERT INTO change_batches (host, status) VALUES (?, 'applying')", (host,))
+        conn.executemany('''
+            INSERT INTO change_journal (batch_id, path, old_mode, old_uid, old_gid, new_mode, new_owner)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', [(cursor.lastrowid,) + tuple(row) for row in rows])
+    return cursor.lastrowid
+
+def finish_change_batch(conn, batch_id, statuses):
+    """Records the outcome per path, the batch is 'partial' when a change failed or its path was gone."""
+    with conn:
+        conn.executemany("UPDATE change_journal SET status = ? WHERE batch_id = ? AND path = ?",
+                         [(status, batch_id, path) for path, status in statuses.items()])
+        status = 'applied' if all(status in ('applied', 'skipped') for status in statuses.values()) else 'partial'
+        conn.execute("UPDATE change_batches SET status = ? WHERE id = ?", (status, batch_id))
+
+def set_change_batch_status(conn, batch_id, status):
+    with conn:
+        conn.execute("UPDATE change_batches SET status = ? WHERE id = ?", (status, batch_id))
+
+def get_change_batches(conn, limit=100):
+    """Returns (id, created_at, host, status, change_count) rows, newest first."""
+    return conn.execute('''
+        SELECT b.id, b.created_at, b.host, b.status, COUNT(j.id)
+        FROM change_batches b LEFT JOIN change_journal j ON j.batch_id = b.id
+        GROUP BY b.id ORDER BY b.id DESC LIMIT ?
+    ''', (limit,)).fetchall()
+
+def get_change_batch(conn, batch_id):
+    """Returns (host, status) of a batch, or None."""
+    return conn.execute("SELECT host, status FROM change_batches WHERE id = ?", (batch_id,)).fetchone()
+
+def get_change_journal(conn, batch_id):
+    """Returns the (path, old_mode, old_uid, old_gid) rows a batch is rolled back from."""
+    return conn.execute("SELECT path, old_mode, old_uid, old_gid FROM change_journal WHERE batch_id = ? ORDER BY id",
+                        (batch_id,)).fetchall()
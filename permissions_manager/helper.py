@@ -0,0 +1,401 @@
+"""Optional persistent helper process on the remote host.
+
+Started once per connection over a single exec channel, the helper is a small self-contained
+Python 3 script that answers framed requests with os.scandir and os.lstat, so listings, stats and
+chmods no longer start a shell each. Frames are a (length, request id, flags) header followed by a
+JSON body, zlib-compressed above COMPRESS_THRESHOLD bytes. Listings travel as columns with owner
+and group names sent once per id, which compresses far better than ls or stat text. Requests from
+any thread are multiplexed by id over the channel and answered by threads on the remote side, so
+they can be pipelined. Hosts without python3 simply keep using the exec and SFTP paths.
+"""
+import json
+import queue
+import shlex
+import struct
+import threading
+import time
+import zlib
+
+from permissions_manager.core import (
+    CHANNEL_POLL_SECONDS, HelperClosed, TaskCancelled, get_file_type, remote_helpers,
+)
+from permissions_manager.instrumentation import span, timed
+
+
+HEADER = struct.Struct('>IIB')  # Body length, request id, flags
+COMPRESSED = 1
+MORE = 2  # More frames follow for the same request
+COMPRESS_THRESHOLD = 1024
+CANCEL_REQUEST_ID = 0  # Cancellations get no response
+HELPER_START_TIMEOUT = 10
+
+# Runs on the remote host: Python 3.5 or newer, standard library only, no f-strings
+HELPER_SOURCE = r'''
+import collections, grp, json, os, pwd, stat, struct, sys, threading, zlib
+if not hasattr(os, 'scandir'):
+    sys.exit(127)
+HEADER = struct.Struct('>IIB')
+COMPRESSED, MORE, COMPRESS_THRESHOLD = 1, 2, 1024
+stdin, stdout = sys.stdin.buffer, sys.stdout.buffer
+write_lock = threading.Lock()
+running, cancelled = set(), set()  # Request ids being handled, and those of them the client gave up on
+state_lock = threading.Lock()
+name_cache = {'users': {}, 'groups': {}}
+
+def send(rid, body, more=False):
+    data = json.dumps(body, separators=(',', ':')).encode()
+    flags = MORE if more else 0
+    if len(data) > COMPRESS_THRESHOLD:
+        data, flags = zlib.compress(data, 1), flags | COMPRESSED
+    with write_lock:
+        stdout.write(HEADER.pack(len(data), rid, flags) + data)
+        stdout.flush()
+
+def decode(name):
+    # Names that are not UTF-8 survive the round trip as lone surrogates, JSON escapes them
+    return name.decode('utf-8', 'surrogateescape')
+
+def encode(path):
+    return path.encode('utf-8', 'surrogateescape')
+
+def describe(error):
+    filename = error.filename
+    if isinstance(filename, bytes):
+        filename = decode(filename)
+    return "cannot access '%s': %s" % (filename, error.strerror) if filename else str(error)
+
+def name_of(kind, lookup, key):
+    cache = name_cache[kind]
+    if key not in cache:
+        try:
+            cache[key] = lookup(key)[0]
+        except KeyError:
+            cache[key] = str(key)
+    return cache[key]
+
+def columns():
+    return {'names': [], 'modes': [], 'sizes': [], 'uids': [], 'gids': [], 'users': {}, 'groups': {}, 'errors': []}
+
+def add(body, name, st):
+    body['names'].append(decode(name))
+    body['modes'].append(st.st_mode)
+    body['sizes'].append(st.st_size)
+    body['uids'].append(st.st_uid)
+    body['gids'].append(st.st_gid)
+    body['users'][st.st_uid] = name_of('users', pwd.getpwuid, st.st_uid)
+    body['groups'][st.st_gid] = name_of('groups', grp.getgrgid, st.st_gid)
+
+def scan(path, body, directories=None):
+    for entry in os.scandir(path):
+        try:
+            st = entry.stat(follow_symlinks=False)
+        except OSError as error:
+            body['errors'].append(describe(error))
+            continue
+        add(body, entry.name, st)
+        if directories is not None and stat.S_ISDIR(st.st_mode):
+            directories.append(entry.name)
+    return body
+
+def op_hello():
+    return {'version': 1, 'python': sys.version.split()[0]}
+
+def op_list(path, known_mtime=None):
+    path = encode(path)
+    mtime = int(os.stat(path).st_mtime)
+    if mtime == known_mtime:
+        return {'mtime': mtime, 'unchanged': True}
+    body = scan(path, columns())
+    body['mtime'] = mtime
+    return body
+
+def op_stat(directory, names):
+    directory, body = encode(directory), columns()
+    body['missing'] = []
+    for name in names:
+        try:
+            add(body, encode(name), os.lstat(os.path.join(directory, encode(name))))
+        except FileNotFoundError:
+            body['missing'].append(name)
+        except OSError as error:
+            body['errors'].append(describe(error))
+    return body
+
+def op_chmod(directory, mode, names, keep_special=False):
+    errors = []
+    for name in names:
+        path = os.path.join(encode(directory), encode(name))
+        try:
+            # Like GNU chmod, short octal modes leave the setuid and setgid bits of directories alone
+            if keep_special and stat.S_ISDIR(os.stat(path).st_mode):
+                os.chmod(path, mode | os.stat(path).st_mode & (stat.S_ISUID | stat.S_ISGID))
+            else:
+                os.chmod(path, mode)
+        except OSError as error:
+            errors.append('chmod: ' + describe(error))
+    body = op_stat(directory, names)
+    body['errors'] = errors + body['errors']
+    return body
+
+def op_walk(rid, root, depth, limit):
+    pending = collections.deque([(encode(root), 1)])
+    submitted, listed, failed, truncated = 1, 0, 0, False
+    while pending and rid not in cancelled:
+        path, level = pending.popleft()
+        body, directories = columns(), []
+        body['path'] = decode(path)
+        try:
+            body['mtime'] = int(os.stat(path).st_mtime)
+            scan(path, body, directories)
+        except OSError as error:
+            failed += 1
+            send(rid, {'path': body['path'], 'failed': describe(error)}, more=True)
+            continue
+        listed += 1
+        send(rid, body, more=True)
+        if level >= depth:
+            continue
+        for name in directories:
+            if submitted >= limit:
+                truncated = True
+                break
+            pending.append((os.path.join(path, name), level + 1))
+            submitted += 1
+    return {'listed': listed, 'failed': failed, 'truncated': truncated}
+
+HANDLERS = {'hello': op_hello, 'list': op_list, 'stat': op_stat, 'chmod': op_chmod}
+
+def reply(rid, body):
+    # Nobody waits for the answer to a cancelled request
+    if rid not in cancelled:
+        send(rid, body)
+
+def handle(rid, request):
+    try:
+        op = request.pop('op')
+        if op == 'walk':
+            reply(rid, op_walk(rid, **request))
+        else:
+            reply(rid, HANDLERS[op](**request))
+    except OSError as error:
+        reply(rid, {'error': describe(error)})
+    except Exception as error:
+        reply(rid, {'error': repr(error)})
+    finally:
+        with state_lock:
+            running.discard(rid)
+            cancelled.discard(rid)
+
+def read_exact(size):
+    data = b''
+    while len(data) < size:
+        chunk = stdin.read(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+while True:
+    header = read_exact(HEADER.size)
+    if header is None:
+        break
+    length, rid, flags = HEADER.unpack(header)
+    data = read_exact(length)
+    if data is None:
+        break
+    if flags & COMPRESSED:
+        data = zlib.decompress(data)
+    request = json.loads(data.decode())
+    if request['op'] == 'cancel':
+        # Cancels of requests already answered are dropped, so the set only holds running ones
+        with state_lock:
+            if request['target'] in running:
+                cancelled.add(request['target'])
+        continue
+    with state_lock:
+        running.add(rid)
+    thread = threading.Thread(target=handle, args=(rid, request))
+    thread.daemon = True
+    thread.start()
+'''
+
+HELPER_COMMAND = f"command -v python3 >/dev/null 2>&1 || exit 127; exec python3 -u -c {shlex.quote(HELPER_SOURCE)}"
+
+class RemoteError(OSError):
+    """A request the helper could not carry out, e.g. a directory that cannot be read."""
+
+class RemoteHelper:
+    """Client side of one helper channel. Requests may come from any thread, a reader thread
+    routes response frames back to them by request id."""
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.lock = threading.Lock()
+        self.send_lock = threading.Lock()
+        self.pending = {}  # Request id -> queue of (body, more), body None once the helper is gone
+        self.next_id = CANCEL_REQUEST_ID + 1
+        self.alive = True
+        self.reader = threading.Thread(target=self.read_frames, daemon=True)
+        self.reader.start()
+
+    def read_exact(self, size):
+        data = b''
+        while len(data) < size:
+            chunk = self.channel.recv(size - len(data))
+            if not chunk:
+                raise EOFError()
+            data += chunk
+        return data
+
+    def read_frames(self):
+        try:
+            while True:
+                length, rid, flags = HEADER.unpack(self.read_exact(HEADER.size))
+                data = self.read_exact(length)
+                if flags & COMPRESSED:
+                    data = zlib.decompress(data)
+                with self.lock:
+                    responses = self.pending.get(rid)
+                if responses is not None:
+                    responses.put((json.loads(data), flags & MORE))
+        except Exception:
+            pass
+        finally:
+            with self.lock:
+                self.alive = False
+                waiting = list(self.pending.values())
+            for responses in waiting:
+                responses.put((None, 0))
+
+    def send(self, rid, body):
+        data = json.dumps(body, separators=(',', ':')).encode()
+        flags = 0
+        if len(data) > COMPRESS_THRESHOLD:
+            data, flags = zlib.compress(data, 1), COMPRESSED
+        try:
+            with self.send_lock:
+                self.channel.sendall(HEADER.pack(len(data), rid, flags) + data)
+        except Exception as e:
+            raise HelperClosed(f"The remote helper channel failed: {e}")
+
+    def stream(self, op, cancel_event=None, timeout=None, **arguments):
+        """Sends one request and yields its response frames as they arrive."""
+        responses = queue.Queue()
+        with self.lock:
+            if not self.alive:
+                raise HelperClosed("The remote helper is not running.")
+            rid = self.next_id
+            self.next_id += 1
+            self.pending[rid] = responses
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            if cancel_event is not None and cancel_event.is_set():
+                raise TaskCancelled()
+            self.send(rid, dict(arguments, op=op))
+            while True:
+                # Checked before every frame, a walk streaming without pause is cancelled too
+                if cancel_event is not None and cancel_event.is_set():
+                    self.send(CANCEL_REQUEST_ID, {'op': 'cancel', 'target': rid})
+                    raise TaskCancelled()
+                try:
+                    body, more = responses.get(timeout=CHANNEL_POLL_SECONDS)
+                except queue.Empty:
+                    if deadline is not None and time.monotonic() > deadline:
+                        raise HelperClosed(f"The remote helper did not answer within {timeout}s.")
+                    continue
+                if body is None:
+                    raise HelperClosed("The remote helper exited.")
+                if 'error' in body:
+                    raise RemoteError(body['error'])
+                yield body
+                if not more:
+                    return
+        finally:
+            with self.lock:
+                self.pending.pop(rid, None)
+
+    def request(self, op, cancel_event=None, timeout=None, **arguments):
+        for body in self.stream(op, cancel_event, timeout, **arguments):
+            return body
+
+    @timed('helper.list')
+    def list_directory(self, path, cached=None, cancel_event=None):
+        """Same contract as core.list_directory."""
+        try:
+            body = self.request('list', cancel_event, path=path, known_mtime=cached['mtime'] if cached else None)
+        except RemoteError as e:
+            return [], str(e), None
+        if body.get('unchanged'):
+            return cached['entries'], '', body['mtime']
+        return entries_from_columns(body), '\n'.join(body['errors']), body['mtime']
+
+    @timed('helper.stat')
+    def stat_entries(self, directory, names, cancel_event=None):
+        """Same contract as core.stat_entries."""
+        body = self.request('stat', cancel_event, directory=directory, names=list(names))
+        return entries_from_columns(body), body['missing']
+
+    @timed('helper.chmod')
+    def chmod_entries(self, directory, mode, names):
+        """Same contract as core.chmod_entries, for octal modes."""
+        body = self.request('chmod', directory=directory, mode=int(mode, 8), names=list(names),
+                            keep_special=len(mode) < 5)
+        errors = '\n'.join(body['errors'])
+        return entries_from_columns(body), errors, 1 if errors else 0
+
+    @timed('helper.walk')
+    def walk(self, root, on_listing, depth, max_directories, cancel_event=None):
+        """Same contract as core.list_tree, the remote side walks breadth first and streams
+        one frame per directory."""
+        for body in self.stream('walk', cancel_event, root=root, depth=depth, limit=max_directories):
+            if 'path' not in body:
+                return body['listed'], body['failed'], body['truncated']
+            if 'failed' in body:
+                on_listing(body['path'], None, body['failed'], None)
+            else:
+                errors = '\n'.join(body['errors'])
+                on_listing(body['path'], entries_from_columns(body), errors, body['mtime'])
+
+    def close(self):
+        self.alive = False
+        self.channel.close()
+
+def entries_from_columns(body):
+    users, groups = body['users'], body['groups']  # JSON object keys are strings
+    entries = [
+        {
+            'name': name,
+            'size': size,
+            'mode': mode,
+            'owner': users.get(str(uid), str(uid)),
+            'group': groups.get(str(gid), str(gid)),
+            'type': get_file_type(mode),
+        }
+        for name, mode, size, uid, gid in zip(body['names'], body['modes'], body['sizes'], body['uids'], body['gids'])
+    ]
+    entries.sort(key=lambda entry: entry['name'])
+    return entries
+
+def start_helper(client, timeout=HELPER_START_TIMEOUT):
+    """Starts the helper on the host of client and registers it, so core functions use it for that
+    client from then on. Returns the helper, or None when the host cannot run it."""
+    helper = remote_helpers.get(client)
+    if helper is not None and helper.alive:
+        return helper
+    with span('helper_start'):
+        # exec_command would hand back a stdin file that sends EOF once garbage collected
+        channel = client.get_transport().open_session()
+        channel.exec_command(HELPER_COMMAND)
+        helper = RemoteHelper(channel)
+        try:
+            helper.request('hello', timeout=timeout)
+        except (HelperClosed, RemoteError):
+            helper.close()
+            return None
+    remote_helpers[client] = helper
+    return helper
+
+def stop_helper(client):
+    helper = remote_helpers.pop(client, None)
+    if helper is not None:
+        helper.close()
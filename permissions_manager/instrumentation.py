@@ -0,0 +1,194 @@
+"""Lightweight instrumentation of remote calls and UI updates.
+
+Spans feed per-operation latency histograms and a bounded trace buffer that exports as a Chrome
+trace (chrome://tracing, Perfetto). SSH channels are counted per user action, the action being
+whatever the current thread announced with action(); bytes are counted on the wire by wrapping
+the connection socket. Everything is safe to call from any thread and cheap enough to stay on.
+"""
+import json
+import os
+import socket
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+
+
+# Histogram bucket upper bounds in milliseconds, doubling from 0.25 ms to about 65 s
+BUCKET_BOUNDS_MS = tuple(0.25 * 2 ** i for i in range(19))
+TRACE_LIMIT = 200000  # Trace events kept, oldest are dropped first
+BACKGROUND_ACTION = 'background'
+
+class Histogram:
+    """Log-scale latency histogram, percentiles are reported as bucket upper bounds."""
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKET_BOUNDS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+    def add(self, milliseconds):
+        index = 0
+        while index < len(BUCKET_BOUNDS_MS) and milliseconds > BUCKET_BOUNDS_MS[index]:
+            index += 1
+        self.buckets[index] += 1
+        self.count += 1
+        self.total += milliseconds
+        self.maximum = max(self.maximum, milliseconds)
+
+    def percentile(self, fraction):
+        threshold = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= threshold:
+                return min(BUCKET_BOUNDS_MS[index], self.maximum) if index < len(BUCKET_BOUNDS_MS) else self.maximum
+        return 0.0
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean_ms': self.total / self.count if self.count else 0.0,
+            'p50_ms': self.percentile(0.5),
+            'p95_ms': self.percentile(0.95),
+            'max_ms': self.maximum,
+        }
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started = time.perf_counter()
+            self.histograms = {}
+            self.actions = {}  # name -> {'count', 'channels'}
+            self.channels = 0
+            self.bytes_in = 0
+            self.bytes_out = 0
+            self.trace = deque(maxlen=TRACE_LIMIT)
+
+    def current_action(self):
+        return getattr(self.local, 'action', None) or BACKGROUND_ACTION
+
+    def record(self, name, started, ended, category='remote', args=None):
+        """Adds one finished operation, times are time.perf_counter() values."""
+        event = {
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': (started - self.started) * 1e6,
+            'dur': (ended - started) * 1e6,
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+        }
+        event_args = dict(args or {}, action=self.current_action())
+        event['args'] = event_args
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.add((ended - started) * 1000)
+            self.trace.append(event)
+
+    def count_channel(self):
+        action = self.current_action()
+        with self.lock:
+            self.channels += 1
+            self.actions.setdefault(action, {'count': 0, 'channels': 0})['channels'] += 1
+
+    def count_bytes(self, received=0, sent=0):
+        with self.lock:
+            self.bytes_in += received
+            self.bytes_out += sent
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'operations': {name: histogram.summary() for name, histogram in self.histograms.items()},
+                'actions': {name: dict(action) for name, action in self.actions.items()},
+                'channels': self.channels,
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+                'trace_events': len(self.trace),
+            }
+
+    def export_trace(self, path):
+        """Writes the trace buffer as Chrome trace JSON, with the summary as metadata."""
+        with self.lock:
+            events = list(self.trace)
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms', 'metadata': self.snapshot()}, f)
+        return len(events)
+
+recorder = Recorder()
+
+@contextmanager
+def span(name, category='remote', **args):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        recorder.record(name, started, time.perf_counter(), category, args)
+
+def timed(name, category='remote'):
+    """Decorator recording every call of a function as a span."""
+    def decorate(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name, category):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+@contextmanager
+def action(name):
+    """Attributes channels opened by this thread to a user action until the block ends."""
+    previous = getattr(recorder.local, 'action', None)
+    recorder.local.action = name
+    with recorder.lock:
+        recorder.actions.setdefault(name, {'count': 0, 'channels': 0})['count'] += 1
+    try:
+        yield
+    finally:
+        recorder.local.action = previous
+
+def count_channels(transport):
+    """Counts every channel the transport opens (exec, SFTP, forwarded connections)."""
+    open_channel = transport.open_channel
+
+    def counting_open_channel(*args, **kwargs):
+        recorder.count_channel()
+        return open_channel(*args, **kwargs)
+
+    transport.open_channel = counting_open_channel
+
+class CountingSocket:
+    """Socket wrapper handed to paramiko so the byte counters see exactly what crosses the wire."""
+
+    def __init__(self, sock):
+        self.sock = sock
+
+    def recv(self, size, *flags):
+        data = self.sock.recv(size, *flags)
+        recorder.count_bytes(received=len(data))
+        return data
+
+    def send(self, data, *flags):
+        sent = self.sock.send(data, *flags)
+        recorder.count_bytes(sent=sent)
+        return sent
+
+    def sendall(self, data, *flags):
+        self.sock.sendall(data, *flags)
+        recorder.count_bytes(sent=len(data))
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+def open_counting_socket(host, port, timeout=None):
+    return CountingSocket(socket.create_connection((host, port), timeout))
@@ -0,0 +1,100 @@
+"""Connection inventories: bulk import of hosts from ~/.ssh/config, CSV files and Ansible INI inventories.
+
+Every reader yields (host, port, username, password, key_file) rows for db.import_connections,
+which stores a whole file in one transaction and skips the hosts that are already saved.
+"""
+import csv
+import getpass
+import shlex
+
+from permissions_manager.core import DEFAULT_SSH_PORT, SSH_CONFIG_PATH, load_ssh_config
+
+
+CSV_COLUMNS = {
+    'host': ('host', 'hostname', 'address'),
+    'port': ('port',),
+    'username': ('username', 'user'),
+    'password': ('password',),
+    'key_file': ('key_file', 'identity_file', 'key'),
+}
+
+def read_ssh_config(path=SSH_CONFIG_PATH):
+    """One row per concrete Host alias, patterns such as * are skipped. The alias is saved as the
+    host so that HostName, IdentityFile and ProxyJump keep coming from the config when connecting."""
+    config = load_ssh_config(path)
+    if config is None:
+        raise FileNotFoundError(f"No ssh config at {path}")
+    for alias in sorted(config.get_hostnames()):
+        if any(character in alias for character in '*?!'):
+            continue
+        options = config.lookup(alias)
+        yield alias, int(options.get('port', DEFAULT_SSH_PORT)), options.get('user') or getpass.getuser(), None, None
+
+def read_csv(path):
+    """Rows of a CSV file with a header, a host column is required, port, username (or user),
+    password and key_file are optional."""
+    with open(path, newline='') as stream:
+        reader = csv.DictReader(stream)
+        header = {name.strip().lower(): name for name in reader.fieldnames or []}
+        columns = {field: next((header[name] for name in names if name in header), None)
+                   for field, names in CSV_COLUMNS.items()}
+        if columns['host'] is None:
+            raise ValueError(f"{path}: a 'host' column is required")
+        for line, record in enumerate(reader, start=2):
+            values = {field: (record.get(column) or '').strip() if column else ''
+                      for field, column in columns.items()}
+            if not values['host']:
+                continue
+            try:
+                port = int(values['port'] or DEFAULT_SSH_PORT)
+            except ValueError:
+                raise ValueError(f"{path}:{line}: invalid port {values['port']!r}")
+            yield (values['host'], port, values['username'] or getpass.getuser(),
+                   values['password'] or None, values['key_file'] or None)
+
+def parse_host_line(line):
+    """Splits 'name key=value ...' into the name and its variables."""
+    fields = shlex.split(line, comments=True)
+    return fields[0], dict(field.split('=', 1) for field in fields[1:] if '=' in field)
+
+def read_ansible_inventory(path):
+    """Hosts of an INI style Ansible inventory. ansible_host, ansible_port, ansible_user,
+    ansible_password and ansible_ssh_private_key_file are honoured, set on the host line or in
+    [group:vars] and [all:vars] sections. A host listed in several groups is imported once."""
+    hosts, group_vars, memberships = {}, {}, {}
+    section = 'ungrouped'
+    with open(path) as stream:
+        for line in stream:
+            line = line.strip()
+            if not line or line[0] in '#;':
+                continue
+            if line.startswith('[') and line.endswith(']'):
+                section = line[1:-1].strip()
+                continue
+            group, _, kind = section.partition(':')
+            if kind == 'vars':
+                name, _, value = line.partition('=')
+                group_vars.setdefault(group, {})[name.strip()] = shlex.split(value)[0] if value.strip() else ''
+            elif kind != 'children':
+                name, variables = parse_host_line(line)
+                hosts.setdefault(name, {}).update(variables)
+                memberships.setdefault(name, []).append(group)
+
+    for name, variables in hosts.items():
+        merged = dict(group_vars.get('all', {}))
+        for group in memberships[name]:
+            merged.update(group_vars.get(group, {}))
+        merged.update(variables)
+        key_file = merged.get('ansible_ssh_private_key_file') or merged.get('ansible_private_key_file')
+        yield (merged.get('ansible_host', name), int(merged.get('ansible_port', DEFAULT_SSH_PORT)),
+               merged.get('ansible_user') or getpass.getuser(), merged.get('ansible_password') or None,
+               key_file or None)
+
+def read_inventory(path, inventory_format):
+    if inventory_format == 'ssh_config':
+        return read_ssh_config(path or SSH_CONFIG_PATH)
+    if inventory_format == 'csv':
+        return read_csv(path)
+    if inventory_format == 'ansible':
+        return read_ansible_inventory(path)
+    raise ValueError(f"Unknown inventory format: {inventory_format}")
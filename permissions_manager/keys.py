@@ -0,0 +1,69 @@
+"""In-memory cache of decrypted private keys, so reconnects skip key parsing and passphrase prompts.
+
+Keys are cached per file (path and modification time, a replaced file is read again) and
+forgotten after idle_timeout seconds without use. An idle_timeout of None keeps them until the
+process exits or clear() is called.
+"""
+import os
+import threading
+import time
+
+from permissions_manager.core import read_private_key
+
+
+KEY_IDLE_TIMEOUT = 15 * 60
+
+class KeyCache:
+    def __init__(self, idle_timeout=KEY_IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self.lock = threading.Lock()
+        self.keys = {}  # (real path, mtime_ns) -> [key, last_used]
+
+    def cache_key(self, key_file):
+        path = os.path.realpath(os.path.expanduser(key_file.strip()))
+        return path, os.stat(path).st_mtime_ns
+
+    def get(self, key_file):
+        try:
+            cache_key = self.cache_key(key_file)
+        except OSError:
+            return None
+        now = time.monotonic()
+        with self.lock:
+            self.purge(now)
+            item = self.keys.get(cache_key)
+            if item is None:
+                return None
+            item[1] = now
+            return item[0]
+
+    def put(self, key_file, key):
+        cache_key = self.cache_key(key_file)
+        with self.lock:
+            self.keys[cache_key] = [key, time.monotonic()]
+
+    def purge(self, now):
+        if self.idle_timeout is None:
+            return
+        for cache_key in [cache_key for cache_key, item in self.keys.items() if now - item[1] > self.idle_timeout]:
+            del self.keys[cache_key]
+
+    def clear(self):
+        with self.lock:
+            self.keys.clear()
+
+    def __len__(self):
+        with self.lock:
+            self.purge(time.monotonic())
+            return len(self.keys)
+
+key_cache = KeyCache()
+
+def load_key(key_file, passphrase=None):
+    """Returns the decrypted key of key_file, parsing (and decrypting) the file only on a cache miss.
+    Raises paramiko.PasswordRequiredException for uncached encrypted keys without a passphrase."""
+    key = key_cache.get(key_file)
+    if key is None:
+        key = read_private_key(key_file, passphrase)
+        key_cache.put(key_file, key)
+    return key
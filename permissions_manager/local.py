@@ -0,0 +1,332 @@
+"""Local filesystem backend: the machine the application runs on, without SSH.
+
+LocalClient stands in for a paramiko client, so everything that takes a client works on local
+paths too. Listings, stats, tree walks and chmods go through LocalBackend, registered for the
+client the same way as a remote helper, which calls os.scandir, os.lstat and os.chmod directly
+and walks trees with a thread pool, since on NFS or CephFS mounts every directory read is a round
+trip to the server. Features built on shell commands (search, ACLs, watch, snapshots) run them
+through a local /bin/sh, in place of the exec channel.
+"""
+import os
+import grp
+import pwd
+import stat
+import queue
+import signal
+import socket
+import posixpath
+import subprocess
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import lru_cache
+
+from permissions_manager.core import (
+    CHANNEL_CHUNK_SIZE, CHANNEL_POLL_SECONDS, ERROR_SAMPLE_SIZE, PROGRESS_INTERVAL_SECONDS, TREE_MAX_DIRECTORIES,
+    TaskCancelled, get_file_type, remote_helpers,
+)
+from permissions_manager.instrumentation import timed
+
+
+LOCAL_HOST_KEY = 'localhost'  # Stands in for 'user@host:port' in the listing cache and change journal
+LOCAL_WORKERS = 8  # Directories read at once, most of the time is spent waiting on the filesystem
+CLOSE_GRACE_SECONDS = 1  # Time a closed command gets to clean up before it is killed
+
+class LocalChannel:
+    """Local shell process with the parts of the paramiko Channel interface that
+    core.stream_command_output uses."""
+
+    def __init__(self, command):
+        # A session of its own, so closing stops the children of the shell as well
+        self.process = subprocess.Popen(['/bin/sh', '-c', command], stdin=subprocess.DEVNULL,
+                                        stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True)
+        self.timeout = None
+        self.stdout = queue.Queue()
+        self.stderr = queue.Queue()
+        self.stdout_done = False
+        self.readers = [
+            threading.Thread(target=self.pump, args=(self.process.stdout, self.stdout), daemon=True),
+            threading.Thread(target=self.pump, args=(self.process.stderr, self.stderr), daemon=True),
+        ]
+        for reader in self.readers:
+            reader.start()
+
+    def pump(self, stream, chunks):
+        while True:
+            data = os.read(stream.fileno(), CHANNEL_CHUNK_SIZE)
+            if not data:
+                break
+            chunks.put(data)
+        stream.close()
+        chunks.put(b'')
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def recv(self, size):
+        if self.stdout_done:
+            return b''
+        try:
+            data = self.stdout.get(timeout=self.timeout)
+        except queue.Empty:
+            raise socket.timeout()
+        self.stdout_done = not data
+        return data
+
+    def recv_stderr_ready(self):
+        return not self.stderr.empty()
+
+    def recv_stderr(self, size):
+        return self.stderr.get_nowait()
+
+    def exit_status_ready(self):
+        return self.process.poll() is not None
+
+    def recv_exit_status(self):
+        exit_status = self.process.wait()
+        # Everything written to stderr is queued once the exit status is known, as with SSH
+        self.readers[1].join()
+        return exit_status
+
+    def close(self):
+        if self.process.poll() is not None:
+            return
+        try:
+            os.killpg(self.process.pid, signal.SIGTERM)
+            self.process.wait(CLOSE_GRACE_SECONDS)
+        except subprocess.TimeoutExpired:
+            os.killpg(self.process.pid, signal.SIGKILL)
+            self.process.wait()
+        except ProcessLookupError:
+            pass
+
+class LocalStream:
+    def __init__(self, channel):
+        self.channel = channel
+
+class LocalClient:
+    """Takes the place of the SSH client for the local machine."""
+
+    def __init__(self):
+        self.backend = LocalBackend()
+        remote_helpers[self] = self.backend
+
+    def exec_command(self, command):
+        stream = LocalStream(LocalChannel(command))
+        return stream, stream, stream
+
+    def close(self):
+        self.backend.close()
+
+@lru_cache(maxsize=None)
+def user_name(uid):
+    try:
+        return pwd.getpwuid(uid).pw_name
+    except KeyError:
+        return str(uid)
+
+@lru_cache(maxsize=None)
+def group_name(gid):
+    try:
+        return grp.getgrgid(gid).gr_name
+    except KeyError:
+        return str(gid)
+
+def entry_from_stat(name, st):
+    return {
+        'name': name,
+        'size': st.st_size,
+        'mode': st.st_mode,
+        'owner': user_name(st.st_uid),
+        'group': group_name(st.st_gid),
+        'type': get_file_type(st.st_mode),
+    }
+
+def chmod_bits(mode, current_mode):
+    """Bits GNU chmod sets for an octal mode: directories keep their setuid and setgid bits
+    unless the mode has five or more digits."""
+    bits = int(mode, 8)
+    if len(mode) < 5 and stat.S_ISDIR(current_mode):
+        bits |= current_mode & (stat.S_ISUID | stat.S_ISGID)
+    return bits
+
+def describe_error(error, operation='cannot access'):
+    return f"{operation} '{error.filename}': {error.strerror}" if error.filename else str(error)
+
+def scan_directory(path):
+    """Returns (entries, errors, mtime), entries sorted by name. scandir already knows the type of
+    most entries, only the attributes need one lstat each."""
+    mtime = int(os.stat(path).st_mtime)
+    entries, errors = [], []
+    with os.scandir(path) as iterator:
+        for item in iterator:
+            try:
+                entries.append(entry_from_stat(item.name, item.stat(follow_symlinks=False)))
+            except OSError as e:
+                errors.append(describe_error(e))
+    entries.sort(key=lambda entry: entry['name'])
+    return entries, '\n'.join(errors), mtime
+
+def walk_parallel(root, visit, depth=None, max_directories=None, workers=LOCAL_WORKERS, cancel_event=None):
+    """Breadth first walk calling visit(path) on a thread pool, up to workers directories at a
+    time. visit returns the names of the subdirectories to descend into. Yields
+    (path, subdirectories, error) from this thread as visits finish, parents before children,
+    subdirectories None when visit raised OSError. The final item is (None, None, truncated)."""
+    pool = ThreadPoolExecutor(max_workers=workers)
+    pending = {pool.submit(visit, root): (root, 1)}
+    submitted, truncated = 1, False
+    try:
+        while pending:
+            done, _ = wait(pending, timeout=CHANNEL_POLL_SECONDS, return_when=FIRST_COMPLETED)
+            if cancel_event is not None and cancel_event.is_set():
+                raise TaskCancelled()
+            for future in done:
+                path, level = pending.pop(future)
+                try:
+                    subdirectories = future.result()
+                except OSError as e:
+                    yield path, None, describe_error(e)
+                    continue
+                yield path, subdirectories, ''
+                if depth is not None and level >= depth:
+                    continue
+                for name in subdirectories:
+                    if max_directories is not None and submitted >= max_directories:
+                        truncated = True
+                        break
+                    child = posixpath.join(path, name)
+                    pending[pool.submit(visit, child)] = (child, level + 1)
+                    submitted += 1
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+    yield None, None, truncated
+
+class LocalBackend:
+    """Answers the calls core routes to a remote helper, straight from the local filesystem."""
+
+    alive = True
+
+    @timed('local.list')
+    def list_directory(self, path, cached=None, cancel_event=None):
+        """Same contract as core.list_directory."""
+        try:
+            if cached and int(os.stat(path).st_mtime) == cached['mtime']:
+                return cached['entries'], '', cached['mtime']
+            return scan_directory(path)
+        except OSError as e:
+            return [], describe_error(e), None
+
+    @timed('local.stat')
+    def stat_entries(self, directory, names, cancel_event=None):
+        """Same contract as core.stat_entries."""
+        entries, missing = [], []
+        for name in names:
+            try:
+                entries.append(entry_from_stat(name, os.lstat(posixpath.join(directory, name))))
+            except OSError:
+                missing.append(name)
+        return entries, missing
+
+    @timed('local.chmod')
+    def chmod_entries(self, directory, mode, names):
+        """Same contract as core.chmod_entries, for octal modes."""
+        errors = []
+        try:
+            directory_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        except OSError as e:
+            return [], f"chmod: {describe_error(e)}", 1
+        try:
+            for name in names:
+                try:
+                    # fchmodat relative to the open directory, no path lookup from the root per name
+                    os.chmod(name, chmod_bits(mode, os.stat(name, dir_fd=directory_fd).st_mode), dir_fd=directory_fd)
+                except OSError as e:
+                    errors.append(f"chmod: cannot access '{name}': {e.strerror}")
+        finally:
+            os.close(directory_fd)
+        entries, missing = self.stat_entries(directory, names)
+        return entries, '\n'.join(errors), 1 if errors else 0
+
+    @timed('local.walk')
+    def walk(self, root, on_listing, depth, max_directories=TREE_MAX_DIRECTORIES, cancel_event=None):
+        """Same contract as core.list_tree."""
+        listings = {}
+
+        def visit(path):
+            listings[path] = scan_directory(path)
+            return [entry['name'] for entry in listings[path][0] if entry['type'] == 'directory']
+
+        listed = failed = 0
+        for path, subdirectories, result in walk_parallel(root, visit, depth, max_directories,
+                                                          cancel_event=cancel_event):
+            if path is None:
+                return listed, failed, result
+            if subdirectories is None:
+                failed += 1
+                on_listing(path, None, result, None)
+                continue
+            listed += 1
+            on_listing(path, *listings.pop(path))
+
+    @timed('local.chmod_recursive')
+    def chmod_recursive(self, path, file_mode, dir_mode, on_progress=None, cancel_event=None):
+        """Same contract as core.chmod_recursive, for octal modes. Every directory is opened once and
+        its entries are changed relative to it, directories after their contents have been read."""
+        started = time.monotonic()
+        counters = {'processed': 0, 'errors': 0, 'reported': started}
+        error_sample = []
+        lock = threading.Lock()
+
+        def report(processed, errors):
+            with lock:
+                counters['processed'] += processed
+                counters['errors'] += len(errors)
+                error_sample.extend(errors[:ERROR_SAMPLE_SIZE - len(error_sample)])
+
+        def visit(directory):
+            subdirectories, errors, processed = [], [], 0
+            directory_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                with os.scandir(directory_fd) as iterator:
+                    for item in iterator:
+                        try:
+                            if item.is_dir(follow_symlinks=False):
+                                subdirectories.append(item.name)
+                            elif file_mode and not item.is_symlink():
+                                os.chmod(item.name, int(file_mode, 8), dir_fd=directory_fd)
+                                processed += 1
+                        except OSError as e:
+                            errors.append(f"chmod: cannot access '{posixpath.join(directory, item.name)}': {e.strerror}")
+                if dir_mode:
+                    os.fchmod(directory_fd, chmod_bits(dir_mode, os.fstat(directory_fd).st_mode))
+                    processed += 1
+            finally:
+                os.close(directory_fd)
+            report(processed, errors)
+            return subdirectories
+
+        try:
+            mode = os.lstat(path).st_mode
+            if not stat.S_ISDIR(mode):
+                # A single entry, as find would treat it
+                if not file_mode or stat.S_ISLNK(mode):
+                    return 0, 0, [], 0, time.monotonic() - started
+                os.chmod(path, int(file_mode, 8))
+                return 1, 0, [], 0, time.monotonic() - started
+        except OSError as e:
+            return 0, 1, [f"chmod: {describe_error(e)}"], 1, time.monotonic() - started
+        for directory, subdirectories, result in walk_parallel(path, visit, cancel_event=cancel_event):
+            if directory is None:
+                break
+            if subdirectories is None:
+                report(0, [f"chmod: {result}"])
+            now = time.monotonic()
+            if on_progress and now - counters['reported'] >= PROGRESS_INTERVAL_SECONDS:
+                counters['reported'] = now
+                on_progress(counters['processed'], counters['errors'],
+                            counters['processed'] / max(now - started, 1e-6))
+        exit_status = 1 if counters['errors'] else 0
+        return counters['processed'], counters['errors'], error_sample, exit_status, time.monotonic() - started
+
+    def close(self):
+        pass
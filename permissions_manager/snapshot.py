@@ -0,0 +1,221 @@
+"""Permission snapshots: capture, compact on-disk storage and streaming diff.
+
+A snapshot maps every path under a remote root to (mode, uid, gid, type, mtime). Records are
+collected in one streaming find pass, sorted with an external merge sort and written sorted by
+path with shared-prefix compression inside a gzip stream. Because both sides of a diff are
+sorted, comparing two snapshots is a single merge pass in bounded memory.
+"""
+import os
+import gzip
+import json
+import heapq
+import shlex
+import struct
+import tempfile
+import time
+
+from permissions_manager.core import COMMAND_SIZE_LIMIT, chunk_arguments, start_command, stream_command_output
+from permissions_manager.instrumentation import timed
+
+
+MAGIC = b'PMSNAP1\n'
+SNAPSHOT_DIRECTORY = 'snapshots'
+SNAPSHOT_FIELDS = 6
+SORT_RUN_SIZE = 200000  # Records held in memory before a sorted run is spilled to disk
+RECORD = struct.Struct('>HIIcq')  # mode, uid, gid, type, mtime
+RUN_HEADER = struct.Struct('>I')
+
+# Relative path, permission bits, uid, gid, type letter and mtime, all NUL-terminated
+SNAPSHOT_FORMAT = '%P\\0%m\\0%U\\0%G\\0%y\\0%T@\\0'
+
+def snapshot_directory(database_path):
+    """Snapshots are kept in a directory next to connections.db."""
+    return os.path.join(os.path.dirname(os.path.abspath(database_path)), SNAPSHOT_DIRECTORY)
+
+def build_snapshot_command(root):
+    return f"find {shlex.quote(root)} -printf '{SNAPSHOT_FORMAT}'"
+
+def write_varint(stream, value):
+    while value >= 0x80:
+        stream.write(bytes((value & 0x7f | 0x80,)))
+        value >>= 7
+    stream.write(bytes((value,)))
+
+def read_varint(stream):
+    value = shift = 0
+    while True:
+        byte = stream.read(1)
+        if not byte:
+            raise EOFError()
+        value |= (byte[0] & 0x7f) << shift
+        if byte[0] < 0x80:
+            return value
+        shift += 7
+
+def write_run(records):
+    """Spills sorted records to a temporary file and returns its path."""
+    handle, path = tempfile.mkstemp(prefix='pmsnap-', suffix='.run')
+    with os.fdopen(handle, 'wb') as stream:
+        for record in records:
+            stream.write(RUN_HEADER.pack(len(record[0])))
+            stream.write(record[0])
+            stream.write(RECORD.pack(*record[1:]))
+    return path
+
+def read_run(path):
+    with open(path, 'rb') as stream:
+        while True:
+            header = stream.read(RUN_HEADER.size)
+            if not header:
+                return
+            name = stream.read(RUN_HEADER.unpack(header)[0])
+            yield (name,) + RECORD.unpack(stream.read(RECORD.size))
+
+def write_snapshot(path, records, metadata):
+    """Writes records, which must be sorted by path, and returns how many were written."""
+    count = 0
+    previous = b''
+    header = json.dumps(metadata).encode()
+    with gzip.open(path, 'wb') as stream:
+        stream.write(MAGIC)
+        write_varint(stream, len(header))
+        stream.write(header)
+        for name, mode, uid, gid, file_type, mtime in records:
+            # Sorted paths share long prefixes, only the differing suffix is stored
+            shared = 0
+            limit = min(len(name), len(previous))
+            while shared < limit and name[shared] == previous[shared]:
+                shared += 1
+            write_varint(stream, shared)
+            write_varint(stream, len(name) - shared)
+            stream.write(name[shared:])
+            stream.write(RECORD.pack(mode, uid, gid, file_type, mtime))
+            previous = name
+            count += 1
+    return count
+
+def read_snapshot_metadata(path):
+    with gzip.open(path, 'rb') as stream:
+        if stream.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"Not a permissions snapshot: {path}")
+        return json.loads(stream.read(read_varint(stream)))
+
+def read_snapshot(path):
+    """Yields (path, mode, uid, gid, type, mtime) records in path order, path as bytes."""
+    with gzip.open(path, 'rb') as stream:
+        if stream.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"Not a permissions snapshot: {path}")
+        stream.read(read_varint(stream))
+        previous = b''
+        while True:
+            try:
+                shared = read_varint(stream)
+            except EOFError:
+                return
+            name = previous[:shared] + stream.read(read_varint(stream))
+            yield (name,) + RECORD.unpack(stream.read(RECORD.size))
+            previous = name
+
+def parse_snapshot_record(fields):
+    name, mode, uid, gid, file_type, mtime = fields
+    return (name or b'.', int(mode, 8), int(uid), int(gid), file_type[:1] or b'?', int(float(mtime)))
+
+@timed('take_snapshot')
+def take_snapshot(client, root, output_path, metadata=None, cancel_event=None):
+    """Streams a recursive listing of root into a snapshot file in one remote pass.
+    Memory is bounded by SORT_RUN_SIZE, larger trees are merged from sorted runs on disk.
+    Returns (entry_count, error_count, elapsed)."""
+    started = time.monotonic()
+    state = {'pending': b'', 'fields': [], 'errors': 0}
+    buffer, runs = [], []
+
+    def on_stdout(data):
+        if not data:
+            return
+        parts = (state['pending'] + data).split(b'\0')
+        state['pending'] = parts.pop()
+        fields = state['fields']
+        for part in parts:
+            fields.append(part)
+            if len(fields) == SNAPSHOT_FIELDS:
+                buffer.append(parse_snapshot_record(fields))
+                fields.clear()
+        if len(buffer) >= SORT_RUN_SIZE:
+            buffer.sort()
+            runs.append(write_run(buffer))
+            buffer.clear()
+
+    def on_stderr(data):
+        state['errors'] += data.count(b'\n')
+
+    channel = start_command(client, build_snapshot_command(root))
+    try:
+        stream_command_output(channel, on_stdout, on_stderr, cancel_event)
+        buffer.sort()
+        metadata = dict(metadata or {}, root=root, created=time.time())
+        count = write_snapshot(output_path, heapq.merge(buffer, *(read_run(run) for run in runs)), metadata)
+    finally:
+        for run in runs:
+            os.remove(run)
+    return count, state['errors'], time.monotonic() - started
+
+def diff_snapshots(old_records, new_records):
+    """Merge-joins two sorted record streams and yields (change, path, old, new) where change is
+    'added', 'removed' or 'changed'. Records whose mode, owner and type match are skipped."""
+    old_iter, new_iter = iter(old_records), iter(new_records)
+    old, new = next(old_iter, None), next(new_iter, None)
+    while old is not None or new is not None:
+        if new is None or (old is not None and old[0] < new[0]):
+            yield 'removed', old[0], old, None
+            old = next(old_iter, None)
+        elif old is None or new[0] < old[0]:
+            yield 'added', new[0], None, new
+            new = next(new_iter, None)
+        else:
+            if old[1:5] != new[1:5]:
+                yield 'changed', old[0], old, new
+            old, new = next(old_iter, None), next(new_iter, None)
+
+def restore_commands(root, differences):
+    """Yields the shell commands that put changed entries back to their old mode and owner.
+    Paths are grouped per target mode and owner so one command covers many entries, each group
+    is flushed as soon as it reaches the command size limit, keeping memory bounded."""
+    groups = {}  # (operation, value) -> [names, size]
+    budget = COMMAND_SIZE_LIMIT - len(root) - 200
+
+    def flush(key):
+        names, size = groups.pop(key)
+        operation, value = key
+        for chunk in chunk_arguments(names, budget):
+            yield f"cd {shlex.quote(root)} && {operation} {value} {' '.join(chunk)}"
+
+    def flush_owners():
+        # chown clears setuid/setgid bits, so pending ownership changes always run before modes
+        for key in [key for key in groups if key[0].startswith('chown')]:
+            yield from flush(key)
+
+    for change, name, old, new in differences:
+        if change != 'changed':
+            continue
+        path = name.decode(errors='surrogateescape')
+        old_mode, old_uid, old_gid, old_type = old[1:5]
+        new_mode, new_uid, new_gid = new[1:4]
+        keys = []
+        if (old_uid, old_gid) != (new_uid, new_gid):
+            keys.append(('chown -h --', f'{old_uid}:{old_gid}'))
+        if old_mode != new_mode and old_type != b'l':
+            # Five digits: GNU chmod keeps a directory's setuid and setgid bits for shorter numeric modes
+            keys.append(('chmod --', format(old_mode, '05o')))
+        for key in keys:
+            group = groups.setdefault(key, [[], 0])
+            group[0].append(path)
+            group[1] += len(path) + 3
+            if group[1] > budget:
+                if key[0].startswith('chmod'):
+                    yield from flush_owners()
+                if key in groups:
+                    yield from flush(key)
+
+    yield from flush_owners()
+    for key in list(groups):
+        yield from flush(key)